@@ -0,0 +1,53 @@
+"""
+基准测试: AnalyzerService 分析模式延迟对比
+
+使用固定延迟的假 LLM，对比 sequential / parallel / single_shot 三种模式
+单次分析的端到端延迟（不访问网络）。
+
+运行: python benchmarks/bench_analyzer_modes.py
+"""
+import asyncio
+import statistics
+import time
+
+from timem_evolve.llm import FakeChatModel, LatencyDistribution
+from timem_evolve.models import Session, Message
+from timem_evolve.services.analyzer_service import AnalyzerService
+
+LLM_LATENCY_MS = 200  # 每次假 LLM 调用的延迟
+RUNS = 5
+
+
+def make_session() -> Session:
+    return Session(
+        task="修复登录接口的 500 错误",
+        messages=[
+            Message(role="user", content="登录接口返回 500"),
+            Message(role="assistant", content="请提供错误日志"),
+            Message(role="user", content="日志显示 NoneType has no attribute 'id'"),
+            Message(role="assistant", content="user 查询结果为空时没有处理，需要先判断"),
+        ],
+        outcome="unknown",
+    )
+
+
+async def main():
+    # 关闭节点模型分级，所有节点使用同一个假模型
+    analyzer = AnalyzerService(provider="fake", node_models={})
+
+    print(f"假 LLM 单次调用延迟: {LLM_LATENCY_MS}ms, 每种模式运行 {RUNS} 次")
+    print(f"{'模式':<12} {'LLM调用':>8} {'平均ms':>10} {'最小ms':>10}")
+    for mode in ["sequential", "parallel", "single_shot"]:
+        fake = FakeChatModel(latency=LatencyDistribution("constant", LLM_LATENCY_MS))
+        analyzer.llm.use(fake)
+        latencies = []
+        for _ in range(RUNS):
+            start = time.perf_counter()
+            result = await analyzer.analyze(make_session(), mode=mode)
+            latencies.append((time.perf_counter() - start) * 1000)
+            assert not result["error"], result["error"]
+        print(f"{mode:<12} {fake.calls / RUNS:>8.1f} {statistics.mean(latencies):>10.1f} {min(latencies):>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,198 @@
+"""
+基准测试: Coach Gym 吞吐量
+
+用假模型离线驱动 Coach → Learner 循环（execute_task → evaluate_result →
+learn_from_session）：模拟 Learner Agent 的模型和 Coach/学习器使用的模型可以分别
+配置延迟。对一组并发度逐个运行相同数量的任务，报告 每秒完成任务数、各节点延迟
+分位数 和 DAO 写入开销，并标出吞吐量不再随并发明显增长的饱和点。
+
+运行: python benchmarks/bench_coach_gym.py [--tasks 100] [--concurrency 1,2,4,8,16,32]
+          [--coach-latency constant:200] [--learner-latency lognormal:400:0.4]
+"""
+import argparse
+import asyncio
+import functools
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from timem_evolve.dao.memory_dao import MemoryDAO
+from timem_evolve.llm import FakeChatModel, LatencyDistribution, CHEAP_MODEL_NAME
+from timem_evolve.models import CoachTask
+from timem_evolve.services.coach_service import CoachService, COACH_NODES
+from timem_evolve.services.learner_service import LearnerService
+
+
+# 吞吐量增幅低于该比例时视为饱和
+SATURATION_GAIN = 0.1
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] if ordered else 0.0
+
+
+class WriteTimer:
+    """统计被包装的存储写入方法的调用次数和耗时
+
+    在事件循环线程上执行的同步写入直接阻塞事件循环，单独累计；异步写入
+    （aiosqlite）和通过 asyncio.to_thread 调用的同步写入在后台线程执行，
+    多个任务的写入可以重叠。
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.blocking = 0.0
+
+    def wrap(self, obj, name: str) -> None:
+        method = getattr(obj, name)
+
+        if asyncio.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await method(*args, **kwargs)
+                finally:
+                    self.calls += 1
+                    self.total += time.perf_counter() - start
+        else:
+            @functools.wraps(method)
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - start
+                    self.calls += 1
+                    self.total += elapsed
+                    if threading.current_thread() is threading.main_thread():
+                        self.blocking += elapsed
+
+        setattr(obj, name, timed)
+
+
+async def run_level(data_dir: str, num_tasks: int, concurrency: int,
+                    coach_latency: LatencyDistribution, learner_latency: LatencyDistribution):
+    dao = MemoryDAO(data_dir=data_dir)
+    await dao.init_db()
+    learner = LearnerService(dao, provider="fake")
+    coach = CoachService(dao, learner, provider="fake")
+
+    coach_model = FakeChatModel("fake-coach", latency=coach_latency, seed=1)
+    learner_model = FakeChatModel("fake-learner", latency=learner_latency, seed=2)
+    for router in (coach.llm, learner.llm):
+        router.use(coach_model)
+        router.use(coach_model, CHEAP_MODEL_NAME)
+    coach.learner_llm.use(learner_model)
+
+    coach.coach_storage.save_tasks([
+        CoachTask(business_goal="代码调试", task_description=f"修复第 {i} 个接口超时问题", difficulty="medium")
+        for i in range(num_tasks)
+    ])
+
+    writes = WriteTimer()
+    for name in ("save_session", "save_skill", "save_rule"):
+        writes.wrap(dao, name)
+    for name in ("save_tasks", "transition"):
+        writes.wrap(coach.coach_storage, name)
+
+    node_latency = defaultdict(list)
+    node_started = {}
+
+    def on_node(task_id: str, node: str, state: str) -> None:
+        if state == "running":
+            node_started[(task_id, node)] = time.perf_counter()
+        elif (task_id, node) in node_started:
+            node_latency[node].append(time.perf_counter() - node_started.pop((task_id, node)))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_one(task: CoachTask) -> bool:
+        async with semaphore:
+            try:
+                await coach._run_claimed(task, on_node=functools.partial(on_node, task.task_id))
+                return True
+            except Exception as e:
+                print(f"任务运行失败: {e}")
+                return False
+
+    start = time.perf_counter()
+    claimed = await asyncio.to_thread(coach.coach_storage.claim_tasks)
+    results = await asyncio.gather(*(run_one(task) for task in claimed))
+    wall = time.perf_counter() - start
+
+    completed = sum(results)
+    return {
+        "completed": completed,
+        "tasks_per_second": completed / wall if wall > 0 else 0.0,
+        "wall": wall,
+        "nodes": {
+            node: (percentile(node_latency[node], 0.5), percentile(node_latency[node], 0.95),
+                   percentile(node_latency[node], 0.99))
+            for node in COACH_NODES
+        },
+        "llm_calls": coach_model.calls + learner_model.calls,
+        "writes": writes.calls,
+        "write_ms_per_task": writes.total / max(completed, 1) * 1000,
+        "blocking_share": writes.blocking / wall if wall > 0 else 0.0,
+    }
+
+
+async def run(num_tasks: int, levels, coach_latency: LatencyDistribution, learner_latency: LatencyDistribution):
+    print(f"任务数: {num_tasks}, Coach 模型延迟: {coach_latency.kind}:{coach_latency.mean_ms}:{coach_latency.spread}"
+          f", Learner 模型延迟: {learner_latency.kind}:{learner_latency.mean_ms}:{learner_latency.spread}")
+    print(f"{'并发':>6}{'完成':>6}{'任务/秒':>10}{'LLM 调用':>10}{'写入次数':>10}{'写入ms/任务':>12}{'写入阻塞循环':>12}")
+
+    results = []
+    for concurrency in levels:
+        data_dir = tempfile.mkdtemp(prefix="bench_coach_gym_")
+        try:
+            result = await run_level(data_dir, num_tasks, concurrency, coach_latency, learner_latency)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        results.append((concurrency, result))
+        print(f"{concurrency:>6}{result['completed']:>6}{result['tasks_per_second']:>10.2f}"
+              f"{result['llm_calls']:>10}{result['writes']:>10}{result['write_ms_per_task']:>12.2f}"
+              f"{result['blocking_share']:>12.1%}")
+
+    print("\n各节点延迟 (ms, p50 / p95 / p99)")
+    print(f"{'并发':>6}" + "".join(f"{node:>28}" for node in COACH_NODES))
+    for concurrency, result in results:
+        cells = "".join(
+            f"{f'{p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f}':>28}"
+            for p50, p95, p99 in (result["nodes"][node] for node in COACH_NODES)
+        )
+        print(f"{concurrency:>6}{cells}")
+
+    saturation = None
+    for (_, previous), (concurrency, current) in zip(results, results[1:]):
+        if current["tasks_per_second"] < previous["tasks_per_second"] * (1 + SATURATION_GAIN):
+            saturation = concurrency
+            break
+    if saturation:
+        print(f"\n饱和点: 并发 {saturation} 时吞吐量增幅低于 {SATURATION_GAIN:.0%}")
+    else:
+        print("\n在测试的并发范围内吞吐量仍在增长")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=100)
+    parser.add_argument("--concurrency", default="1,2,4,8,16,32", help="逗号分隔的并发度列表")
+    parser.add_argument("--coach-latency", default="constant:200", help="kind:mean_ms[:spread]")
+    parser.add_argument("--learner-latency", default="lognormal:400:0.4", help="kind:mean_ms[:spread]")
+    args = parser.parse_args()
+    asyncio.run(run(
+        args.tasks,
+        [int(level) for level in args.concurrency.split(",")],
+        LatencyDistribution.parse(args.coach_latency),
+        LatencyDistribution.parse(args.learner_latency),
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+基准测试: JSON 文件 DAO 对事件循环的阻塞
+
+持续写入反馈的同时并发执行技能搜索，对比两种方式下的 事件循环延迟 与 搜索延迟：
+1. 直接在事件循环上调用同步的文件读写方法（inspect.unwrap 得到的原始方法）；
+2. 当前的 MemoryDAO（文件读写在 I/O 线程池中执行）。
+
+运行: python benchmarks/bench_dao_loop_lag.py [--skills 2000] [--writes 200] [--searches 200]
+"""
+import argparse
+import asyncio
+import inspect
+import shutil
+import statistics
+import tempfile
+import time
+
+from timem_evolve.dao.memory_dao import MemoryDAO
+from timem_evolve.models import Feedback, Skill, Workflow
+from timem_evolve.observability import EventLoopLagMonitor, MetricsRegistry
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)]
+
+
+async def run_mode(dao: MemoryDAO, offloaded: bool, writes: int, searches: int) -> dict:
+    if offloaded:
+        save_feedback, search_skills = dao.save_feedback, dao.search_skills
+    else:
+        raw_save, raw_search = inspect.unwrap(MemoryDAO.save_feedback), inspect.unwrap(MemoryDAO.search_skills)
+
+        async def save_feedback(feedback):
+            return raw_save(dao, feedback)
+
+        async def search_skills(query):
+            return raw_search(dao, query)
+
+    registry = MetricsRegistry()
+    monitor = EventLoopLagMonitor(
+        interval=0.005, histogram=registry.histogram("lag", "事件循环延迟"),
+        max_gauge=registry.gauge("lag_max", "最大延迟")
+    )
+    latencies = []
+
+    async def writer():
+        for i in range(writes):
+            await save_feedback(Feedback(session_id="bench", message_index=i, rating="positive"))
+            await asyncio.sleep(0)
+
+    async def searcher():
+        for _ in range(searches):
+            start = time.perf_counter()
+            await search_skills("超时")
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.002)
+
+    monitor.start(keep_samples=True)
+    start = time.perf_counter()
+    await asyncio.gather(writer(), searcher())
+    elapsed = time.perf_counter() - start
+    await monitor.stop()
+    return {
+        "elapsed": elapsed,
+        "lag_p99": percentile(monitor.samples, 0.99) if monitor.samples else 0.0,
+        "lag_max": monitor.max_lag,
+        "search_p50": statistics.median(latencies),
+        "search_p99": percentile(latencies, 0.99),
+    }
+
+
+async def run(num_skills: int, writes: int, searches: int) -> None:
+    results = {}
+    for offloaded in (False, True):
+        data_dir = tempfile.mkdtemp(prefix="bench_dao_lag_")
+        try:
+            dao = MemoryDAO(data_dir=data_dir)
+            await dao.init_db()
+            await dao.save_learned_artifacts([
+                Skill(
+                    name=f"技能 {i}", description="排查接口超时" if i % 10 == 0 else "整理代码结构",
+                    workflow=Workflow(steps=["定位", "修复"], sop="先复现再修复" * 20)
+                )
+                for i in range(num_skills)
+            ], [])
+            results["线程池" if offloaded else "事件循环上同步读写"] = await run_mode(dao, offloaded, writes, searches)
+            dao.close()
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"{'模式':<20}{'总耗时 s':>10}{'循环延迟 p99 ms':>18}{'最大 ms':>10}{'搜索 p50 ms':>14}{'搜索 p99 ms':>14}")
+    for name, r in results.items():
+        print(f"{name:<20}{r['elapsed']:>10.2f}{r['lag_p99'] * 1000:>18.1f}{r['lag_max'] * 1000:>10.1f}"
+              f"{r['search_p50'] * 1000:>14.1f}{r['search_p99'] * 1000:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--skills", type=int, default=2000)
+    parser.add_argument("--writes", type=int, default=200)
+    parser.add_argument("--searches", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.skills, args.writes, args.searches))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+基准测试: 反馈 → 学习 → 存储 流水线吞吐
+
+使用本地假模型（LLM_PROVIDER=fake）离线压测 LearnerService.learn_from_feedback，
+并将端到端耗时拆分为模拟的提供方延迟和框架自身开销（DAO、格式化、解析等）。
+
+运行: python benchmarks/bench_learning_pipeline.py [--feedbacks 200] [--latency lognormal:300:0.4] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+
+from timem_evolve.dao.memory_dao import MemoryDAO
+from timem_evolve.llm import FakeChatModel, LatencyDistribution, CHEAP_MODEL_NAME
+from timem_evolve.models import Session, Message, Feedback
+from timem_evolve.services.learner_service import LearnerService
+
+
+async def prepare(dao: MemoryDAO, num_feedbacks: int):
+    """生成会话和反馈"""
+    feedbacks = []
+    for i in range(num_feedbacks):
+        session = Session(
+            task=f"任务 {i}",
+            messages=[
+                Message(role="user", content=f"问题 {i}：如何排查接口超时？"),
+                Message(role="assistant", content="先查看慢日志，再检查下游依赖的耗时。"),
+            ],
+            outcome="success" if i % 2 == 0 else "failure",
+        )
+        await dao.save_session(session)
+        feedbacks.append(Feedback(
+            session_id=session.session_id,
+            message_index=1,
+            rating="positive" if i % 2 == 0 else "negative",
+            comment="很有帮助" if i % 2 == 0 else "没有解决问题",
+        ))
+    for feedback in feedbacks:
+        await dao.save_feedback(feedback)
+    return feedbacks
+
+
+async def run(num_feedbacks: int, latency: LatencyDistribution, concurrency: int):
+    data_dir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    try:
+        dao = MemoryDAO(data_dir=data_dir)
+        await dao.init_db()
+        feedbacks = await prepare(dao, num_feedbacks)
+
+        learner = LearnerService(dao, provider="fake")
+        fake = FakeChatModel(latency=latency, seed=42)
+        learner.llm.use(fake)
+        learner.llm.use(fake, CHEAP_MODEL_NAME)
+
+        semaphore = asyncio.Semaphore(concurrency)
+        per_feedback = []
+
+        async def learn(feedback: Feedback):
+            async with semaphore:
+                start = time.perf_counter()
+                learned_id = await learner.learn_from_feedback(feedback)
+                per_feedback.append(time.perf_counter() - start)
+                return learned_id
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(learn(f) for f in feedbacks))
+        wall = time.perf_counter() - start
+
+        learned = sum(1 for r in results if r)
+        mean_latency = sum(per_feedback) / len(per_feedback)
+        provider_latency = fake.simulated_latency / max(fake.calls, 1)
+        overhead = mean_latency - fake.simulated_latency / len(feedbacks)
+
+        print(f"延迟分布: {latency.kind}:{latency.mean_ms}:{latency.spread}, 并发: {concurrency}")
+        print(f"反馈数: {len(feedbacks)}, 学到: {learned}, LLM 调用: {fake.calls}")
+        print(f"总耗时: {wall:.2f}s, 吞吐: {len(feedbacks) / wall:.1f} 反馈/秒")
+        print(f"单条平均耗时: {mean_latency * 1000:.1f}ms (模拟提供方延迟 {provider_latency * 1000:.1f}ms/次)")
+        print(f"框架自身开销: {overhead * 1000:.2f}ms/反馈")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feedbacks", type=int, default=200)
+    parser.add_argument("--latency", default="constant:0", help="kind:mean_ms[:spread]")
+    parser.add_argument("--concurrency", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args.feedbacks, LatencyDistribution.parse(args.latency), args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
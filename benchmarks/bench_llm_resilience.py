@@ -0,0 +1,72 @@
+"""
+基准测试: 截止时间和对冲请求对尾延迟的影响
+
+使用带延迟尖刺的假模型，对比 不处理 / 仅截止时间 / 截止时间 + p95 对冲 三种配置下
+单次调用的 p50、p99 和失败数。
+
+运行: python benchmarks/bench_llm_resilience.py [--calls 500] [--latency constant:100:0:0.03:5000] [--timeout 2]
+"""
+import argparse
+import asyncio
+import time
+
+from langchain_core.messages import HumanMessage
+
+from timem_evolve.llm import FakeChatModel, LatencyDistribution, ModelRouter, ResilientCaller, LLMUnavailableError
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+async def run_config(label: str, caller: ResilientCaller, latency: LatencyDistribution, num_calls: int, concurrency: int):
+    router = ModelRouter("bench", singleflight=None)
+    router.use(FakeChatModel(latency=latency, seed=7))
+    router.set_caller(router.default_model, caller)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+    failures = 0
+
+    async def one(i: int):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await router.ainvoke([HumanMessage(content=f"识别任务类型 {i}")])
+            except LLMUnavailableError:
+                failures += 1
+            durations.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(num_calls)))
+    stats = caller.stats()
+    print(f"{label:<16}{percentile(durations, 0.5) * 1000:>10.1f}{percentile(durations, 0.99) * 1000:>10.1f}"
+          f"{failures:>8}{stats['hedged']:>8}")
+
+
+async def run(num_calls: int, latency: LatencyDistribution, timeout: float, concurrency: int):
+    print(f"调用数: {num_calls}, 延迟分布: {latency.kind}:{latency.mean_ms}:{latency.spread}"
+          f", 尖刺 {latency.spike_rate:.0%} × {latency.spike_ms:.0f}ms")
+    print(f"{'配置':<16}{'p50(ms)':>10}{'p99(ms)':>10}{'失败':>8}{'对冲':>8}")
+    await run_config("无保护", ResilientCaller(), latency, num_calls, concurrency)
+    await run_config("截止时间", ResilientCaller(timeout=timeout), latency, num_calls, concurrency)
+    await run_config(
+        "截止时间+对冲",
+        ResilientCaller(timeout=timeout, hedge_after="p95", min_hedge_samples=20),
+        latency, num_calls, concurrency
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=500)
+    parser.add_argument("--latency", default="constant:100:0:0.03:5000", help="kind:mean_ms[:spread[:spike_rate:spike_ms]]")
+    parser.add_argument("--timeout", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(run(args.calls, LatencyDistribution.parse(args.latency), args.timeout, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
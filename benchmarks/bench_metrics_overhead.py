@@ -0,0 +1,139 @@
+"""
+基准测试: 指标与追踪的热路径开销
+
+插桩的开销（每次调用几微秒）远小于这台机器上 DAO 操作本身的抖动，直接对比
+有/无插桩的端到端耗时不稳定。因此分两步测量：
+1. 插桩本身的固定成本：同一个空的异步函数包装前后的耗时差，以及
+   同一个空 ASGI 应用挂载 MetricsMiddleware + TracingMiddleware（未采样）前后的耗时差；
+2. 真实操作的基线耗时：未插桩的 MemoryDAO 方法（inspect.unwrap 得到的原始方法，JSON 文件
+   方法同样放到 DAO 的 I/O 线程池中执行）和经过 FastAPI 路由的请求。
+开销比例 = 固定成本 / 基线耗时。各项取多轮中的最小值以排除调度噪声，
+任一项超过 --max-overhead 时返回非零退出码。
+
+运行: python benchmarks/bench_metrics_overhead.py [--iterations 20000] [--rounds 7] [--max-overhead 0.03]
+"""
+import argparse
+import asyncio
+import inspect
+import shutil
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from timem_evolve.dao.memory_dao import MemoryDAO, _operation
+from timem_evolve.models import Message, Session, Skill, Workflow
+from timem_evolve.observability import MetricsMiddleware, TracingMiddleware
+
+
+async def best_time(call, iterations: int, rounds: int) -> float:
+    """多轮中每次调用的最短平均耗时（秒）"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            result = call()
+            if inspect.isawaitable(result):
+                await result
+        best = min(best, (time.perf_counter() - start) / iterations)
+    return best
+
+
+async def async_noop() -> None:
+    pass
+
+
+async def asgi_noop(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def call_asgi(app) -> None:
+    scope = {
+        "type": "http", "method": "GET", "path": "/skills/search", "headers": [],
+        "query_string": b"query=x"
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def run(iterations: int, rounds: int, max_overhead: float) -> bool:
+    # 1. 插桩的固定成本
+    async_cost = (
+        await best_time(_operation("bench_async")(async_noop), iterations, rounds)
+        - await best_time(async_noop, iterations, rounds)
+    )
+    middleware_cost = (
+        await best_time(lambda: call_asgi(MetricsMiddleware(TracingMiddleware(asgi_noop))), iterations, rounds)
+        - await best_time(lambda: call_asgi(asgi_noop), iterations, rounds)
+    )
+    print(f"插桩成本: DAO 方法 {async_cost * 1e6:.2f} µs, HTTP 中间件 {middleware_cost * 1e6:.2f} µs\n")
+
+    # 2. 真实操作的基线耗时
+    data_dir = tempfile.mkdtemp(prefix="bench_metrics_")
+    try:
+        dao = MemoryDAO(data_dir=data_dir)
+        await dao.init_db()
+        for i in range(200):
+            await dao.save_skill(Skill(
+                name=f"技能 {i}", description="排查接口超时" if i % 10 == 0 else "整理代码结构",
+                workflow=Workflow(steps=["定位", "修复"], sop="先复现再修复")
+            ))
+        session = Session(task="排查超时", messages=[Message(role="user", content="接口超时了")], outcome="success")
+        await dao.save_session(session)
+        skill_id = (await dao.list_skills(limit=1))[0].skill_id
+
+        def offloaded(method, *args, **kwargs):
+            return dao._run_blocking(inspect.unwrap(method), dao, *args, **kwargs)
+
+        app = FastAPI()
+
+        @app.get("/skills/search")
+        async def search_skills(query: str, top_k: int = 5):
+            return await offloaded(MemoryDAO.search_skills, query=query, top_k=top_k)
+
+        slow = max(iterations // 100, 1)
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            cases = [
+                ("dao.get_skill", lambda: offloaded(MemoryDAO.get_skill, skill_id), slow, async_cost),
+                ("dao.search_skills", lambda: offloaded(MemoryDAO.search_skills, "超时"), slow, async_cost),
+                ("dao.get_session", lambda: inspect.unwrap(MemoryDAO.get_session)(dao, session.session_id),
+                 slow, async_cost),
+                ("GET /skills/search", lambda: client.get("/skills/search", params={"query": "超时"}),
+                 slow, middleware_cost + async_cost),
+            ]
+
+            print(f"{'操作':<22}{'基线 µs':>12}{'插桩 µs':>12}{'开销':>10}")
+            passed = True
+            for name, call, n, cost in cases:
+                base = await best_time(call, n, rounds)
+                overhead = max(cost, 0.0) / base
+                passed = passed and overhead <= max_overhead
+                print(f"{name:<22}{base * 1e6:>12.1f}{cost * 1e6:>12.2f}{overhead:>10.2%}")
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+    print(f"\n开销上限 {max_overhead:.0%}: {'通过' if passed else '未通过'}")
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--max-overhead", type=float, default=0.03)
+    args = parser.parse_args()
+    if not asyncio.run(run(args.iterations, args.rounds, args.max_overhead)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
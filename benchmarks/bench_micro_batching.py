@@ -0,0 +1,93 @@
+"""
+基准测试: 学习器微批处理
+
+对比单轮提炼（每个反馈一次 LLM 调用）和微批处理模式（并发到达的轮次跨会话打包
+进一次调用）下的 每秒处理轮次数 与 每轮 token 数。
+
+运行: python benchmarks/bench_micro_batching.py [--feedbacks 200] [--batch-size 8] [--latency lognormal:300:0.4]
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+
+from timem_evolve.dao.memory_dao import MemoryDAO
+from timem_evolve.llm import FakeChatModel, LatencyDistribution, CHEAP_MODEL_NAME
+from timem_evolve.models import Session, Message, Feedback
+from timem_evolve.services.learner_service import LearnerService
+
+
+async def prepare(dao: MemoryDAO, num_feedbacks: int):
+    """生成会话和反馈，每个会话一条反馈"""
+    feedbacks = []
+    for i in range(num_feedbacks):
+        session = Session(
+            task=f"任务 {i}",
+            messages=[
+                Message(role="user", content=f"问题 {i}：如何排查接口超时？"),
+                Message(role="assistant", content="先查看慢日志，再检查下游依赖的耗时。"),
+            ],
+        )
+        await dao.save_session(session)
+        feedback = Feedback(
+            session_id=session.session_id,
+            message_index=1,
+            rating="positive" if i % 2 == 0 else "negative",
+        )
+        await dao.save_feedback(feedback)
+        feedbacks.append(feedback)
+    return feedbacks
+
+
+async def run_mode(data_dir: str, num_feedbacks: int, latency: LatencyDistribution, batch_size: int):
+    dao = MemoryDAO(data_dir=data_dir)
+    await dao.init_db()
+    feedbacks = await prepare(dao, num_feedbacks)
+
+    learner = LearnerService(dao, provider="fake", micro_batch_size=batch_size)
+    fake = FakeChatModel(latency=latency, seed=42)
+    learner.llm.use(fake)
+    learner.llm.use(fake, CHEAP_MODEL_NAME)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(learner.learn_from_feedback(f) for f in feedbacks))
+    wall = time.perf_counter() - start
+
+    stats = learner.llm.stats()
+    tokens = sum(node["prompt_tokens"] + node["completion_tokens"] for node in stats.values())
+    return {
+        "learned": sum(1 for r in results if r),
+        "calls": fake.calls,
+        "turns_per_second": len(feedbacks) / wall,
+        "tokens_per_turn": tokens / len(feedbacks),
+        "batcher": learner.turn_batcher.stats() if learner.turn_batcher else None,
+    }
+
+
+async def run(num_feedbacks: int, latency: LatencyDistribution, batch_size: int):
+    print(f"反馈数: {num_feedbacks}, 延迟分布: {latency.kind}:{latency.mean_ms}:{latency.spread}")
+    print(f"{'模式':<12}{'学到':>6}{'LLM 调用':>10}{'轮次/秒':>12}{'token/轮':>12}")
+    for label, size in (("单轮", 0), (f"微批({batch_size})", batch_size)):
+        data_dir = tempfile.mkdtemp(prefix="bench_micro_batch_")
+        try:
+            result = await run_mode(data_dir, num_feedbacks, latency, size)
+        finally:
+            shutil.rmtree(data_dir, ignore_errors=True)
+        print(f"{label:<12}{result['learned']:>6}{result['calls']:>10}"
+              f"{result['turns_per_second']:>12.1f}{result['tokens_per_turn']:>12.1f}")
+        if result["batcher"]:
+            print(f"  批处理统计: {result['batcher']}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--feedbacks", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--latency", default="constant:200", help="kind:mean_ms[:spread]")
+    args = parser.parse_args()
+    asyncio.run(run(args.feedbacks, LatencyDistribution.parse(args.latency), args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
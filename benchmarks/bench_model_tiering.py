@@ -0,0 +1,85 @@
+"""
+基准测试: 节点模型分级
+
+对比 AnalyzerService 在所有节点使用同一模型与分类节点使用小模型两种配置下，
+各节点的延迟、升级次数和估算成本。小模型用更低延迟的假模型模拟，
+并按 --cheap-error-rate 的比例返回不合格的回答以触发升级。
+
+运行: python benchmarks/bench_model_tiering.py [--sessions 20] [--cheap-error-rate 0.1]
+"""
+import argparse
+import asyncio
+import time
+
+from timem_evolve.llm import FakeChatModel, LatencyDistribution, CHEAP_MODEL_NAME
+from timem_evolve.models import Session, Message
+from timem_evolve.services.analyzer_service import AnalyzerService
+
+DEFAULT_MODEL = "gpt-4.1-mini"
+
+
+class FlakyFakeModel(FakeChatModel):
+    """按固定比例返回不合格回答的假模型"""
+
+    def __init__(self, error_rate: float, **kwargs):
+        super().__init__(**kwargs)
+        self.error_rate = error_rate
+        self._counter = 0
+
+    def _respond(self, prompt: str) -> str:
+        self._counter += 1
+        if self.error_rate and self._counter % round(1 / self.error_rate) == 0:
+            return "我无法确定，这个问题需要更多的信息才能判断。\n请补充上下文。"
+        return super()._respond(prompt)
+
+
+def make_sessions(n: int):
+    return [
+        Session(
+            task=f"排查第 {i} 个服务的内存泄漏",
+            messages=[
+                Message(role="user", content="服务内存持续上涨" * 20),
+                Message(role="assistant", content="建议先抓取堆快照，对比两次快照的对象增长。" * 20),
+            ],
+            outcome="unknown",
+        )
+        for i in range(n)
+    ]
+
+
+async def run(label: str, node_models, sessions, cheap_error_rate: float):
+    analyzer = AnalyzerService(provider="fake", node_models=node_models, model_name=DEFAULT_MODEL)
+    analyzer.llm.use(FakeChatModel(model_name=DEFAULT_MODEL, latency=LatencyDistribution("normal", 400, 50)))
+    analyzer.llm.use(
+        FlakyFakeModel(cheap_error_rate, model_name=CHEAP_MODEL_NAME, latency=LatencyDistribution("normal", 120, 20)),
+        CHEAP_MODEL_NAME,
+    )
+
+    start = time.perf_counter()
+    async for _ in analyzer.analyze_many(sessions, concurrency=8):
+        pass
+    wall = time.perf_counter() - start
+
+    print(f"\n== {label} ==  总耗时 {wall:.2f}s")
+    print(f"{'节点':<18} {'调用':>6} {'升级':>6} {'平均ms':>10} {'成本$':>10}  模型")
+    total_cost = 0.0
+    for node, stats in analyzer.llm.stats().items():
+        total_cost += stats["cost_usd"]
+        print(f"{node:<18} {stats['calls']:>6} {stats['escalations']:>6} {stats['avg_latency_ms']:>10.1f} "
+              f"{stats['cost_usd']:>10.6f}  {stats['model_calls']}")
+    print(f"总成本: ${total_cost:.6f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--cheap-error-rate", type=float, default=0.1)
+    args = parser.parse_args()
+
+    sessions = make_sessions(args.sessions)
+    await run("单一模型", {}, sessions, args.cheap_error_rate)
+    await run("分类节点使用小模型", None, sessions, args.cheap_error_rate)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
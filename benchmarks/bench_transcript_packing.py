@@ -0,0 +1,53 @@
+"""
+基准测试: 会话记录打包
+
+在合成的长会话上对比完整格式化与按 token 预算打包后的提示词大小，
+并测量打包耗时与缓存命中后的耗时。
+
+运行: python benchmarks/bench_transcript_packing.py
+"""
+import random
+import time
+
+from timem_evolve.llm import estimate_tokens
+from timem_evolve.models import Message
+from timem_evolve.services.transcript_packer import TranscriptPacker, format_messages
+
+
+def make_session_messages(num_turns: int, seed: int = 0):
+    """生成合成会话：每轮一条用户消息和一条助手回复"""
+    rng = random.Random(seed)
+    messages = []
+    for i in range(num_turns):
+        messages.append(Message(role="user", content=f"第 {i} 轮问题：" + "请帮我分析这段日志。" * rng.randint(1, 5)))
+        messages.append(Message(role="assistant", content=f"第 {i} 轮回答: " + "Step-by-step analysis of the log output. " * rng.randint(5, 30)))
+    return messages
+
+
+def main():
+    budgets = [1000, 3000]
+    turn_counts = [10, 50, 200, 1000]
+
+    print(f"{'轮数':>6} {'预算':>6} {'完整tokens':>12} {'打包tokens':>12} {'缩减':>8} {'打包ms':>8} {'缓存ms':>8}")
+    for budget in budgets:
+        for num_turns in turn_counts:
+            messages = make_session_messages(num_turns)
+            packer = TranscriptPacker(token_budget=budget)
+
+            full_tokens = estimate_tokens(format_messages(messages))
+
+            start = time.perf_counter()
+            packed = packer.pack(messages, keep=[len(messages) // 2], session_id=f"s-{num_turns}")
+            pack_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            packer.pack(messages, keep=[len(messages) // 2], session_id=f"s-{num_turns}")
+            cached_ms = (time.perf_counter() - start) * 1000
+
+            packed_tokens = estimate_tokens(packed)
+            reduction = 1 - packed_tokens / full_tokens if full_tokens else 0.0
+            print(f"{num_turns:>6} {budget:>6} {full_tokens:>12} {packed_tokens:>12} {reduction:>7.1%} {pack_ms:>8.2f} {cached_ms:>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
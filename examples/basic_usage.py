@@ -119,21 +119,21 @@ Hello!
     
     # 7. 查询学到的技能
     print("\n📋 查询所有技能...")
-    skills = storage.list_skills()
+    skills = await storage.list_skills()
     print(f"共有 {len(skills)} 个技能:")
     for s in skills:
         print(f"  - {s.name} (置信度: {s.confidence:.2f})")
     
     # 8. 查询学到的规则
     print("\n📋 查询所有规则...")
-    rules = storage.list_rules()
+    rules = await storage.list_rules()
     print(f"共有 {len(rules)} 个规则:")
     for r in rules:
         print(f"  - {r.name} (置信度: {r.confidence:.2f})")
     
     # 9. 搜索技能
     print("\n🔍 搜索技能...")
-    search_results = storage.search_skills("装饰器")
+    search_results = await storage.search_skills("装饰器")
     print(f"找到 {len(search_results)} 个相关技能:")
     for s in search_results:
         print(f"  - {s.name}")
@@ -155,10 +155,10 @@ async def create_and_learn_from_feedback(storage, learner, feedback_create):
         comment=feedback_create.comment
     )
     
-    storage.save_feedback(feedback)
+    await storage.save_feedback(feedback)
     await learner.learn_from_feedback(feedback)
     
-    return storage.get_feedback(feedback.feedback_id)
+    return await storage.get_feedback(feedback.feedback_id)
 
 
 if __name__ == "__main__":
@@ -37,7 +37,14 @@ async def coach_gym_demo():
     # 3. 运行任务
     print(f"\n-> 步骤 2: 运行 Coach 任务 ({task.task_id})")
     try:
-        updated_task = client.run_coach_task(task.task_id)
+        job = client.run_coach_task(task.task_id)
+        for progress in client.stream_coach_job(job.job_id):
+            print(f"作业状态: {progress.status}，节点进度: {progress.nodes}")
+        job = client.get_coach_job(job.job_id)
+        if job.status != "completed":
+            print(f"任务运行失败: {job.error}")
+            return
+        updated_task = job.task
         
         print(f"\n--- 任务运行结果 ---")
         print(f"状态: {updated_task.status}")
@@ -30,6 +30,7 @@ setup(
     python_requires=">=3.8",
     install_requires=[
         "langgraph>=0.2.0",
+        "langgraph-checkpoint-sqlite>=2.0.0",
         "langchain>=0.3.0",
         "langchain-openai>=0.2.0",
         "fastapi>=0.115.0",
@@ -43,6 +44,7 @@ setup(
         "dev": [
             "pytest>=7.0.0",
             "pytest-asyncio>=0.21.0",
+            "pytest-mock>=3.10.0",
             "black>=23.0.0",
             "flake8>=6.0.0",
         ],
@@ -1,5 +1,6 @@
 """核心模块的单元测试"""
 import pytest
+import pytest_asyncio
 import os
 import shutil
 from pathlib import Path
@@ -9,7 +10,7 @@ from datetime import datetime
 from timem_evolve.dao.memory_dao import MemoryDAO
 from timem_evolve.services.session_service import SessionService
 from timem_evolve.services.learner_service import LearnerService
-from timem_evolve.models import Session, SessionCreate, Message, FeedbackCreate, Skill, Rule
+from timem_evolve.models import Session, SessionCreate, Message, Feedback, FeedbackCreate, Skill, Rule
 
 # 模拟 LLM 响应
 MOCK_SKILL_RESPONSE = {
@@ -51,7 +52,7 @@ def memory_dao(test_data_dir):
     return dao
 
 
-@pytest.fixture
+@pytest_asyncio.fixture
 async def session_service(memory_dao):
     """SessionService 实例"""
     await memory_dao.init_db()
@@ -81,12 +82,10 @@ def mock_llm(mocker):
         mock_response = mocker.MagicMock(content=f"```json\n{json_content}\n```")
         return mock_response
 
-    mock_chat_openai = mocker.patch("timem_evolve.services.learner_service.ChatOpenAI")
+    # 所有服务都通过提供方注册表创建 ChatOpenAI
+    mock_chat_openai = mocker.patch("timem_evolve.llm.providers.ChatOpenAI")
     mock_chat_openai.return_value.ainvoke = mocker.AsyncMock(side_effect=mock_ainvoke)
     
-    mock_coach_openai = mocker.patch("timem_evolve.services.coach_service.ChatOpenAI")
-    mock_coach_openai.return_value.ainvoke = mocker.AsyncMock(side_effect=mock_ainvoke)
-    
     return mock_chat_openai
 
 
@@ -125,7 +124,8 @@ async def test_dao_session_operations(memory_dao):
     assert len(sessions_fail) == 0
 
 
-def test_dao_skill_operations(memory_dao):
+@pytest.mark.asyncio
+async def test_dao_skill_operations(memory_dao):
     """测试 Skill 的 DAO 操作"""
     skill = Skill(
         name="测试技能",
@@ -134,16 +134,16 @@ def test_dao_skill_operations(memory_dao):
         confidence=0.9
     )
     
-    memory_dao.save_skill(skill)
+    await memory_dao.save_skill(skill)
     
-    retrieved_skill = memory_dao.get_skill(skill.skill_id)
+    retrieved_skill = await memory_dao.get_skill(skill.skill_id)
     assert retrieved_skill is not None
     assert retrieved_skill.name == "测试技能"
     
-    skills = memory_dao.list_skills()
+    skills = await memory_dao.list_skills()
     assert len(skills) == 1
     
-    search_results = memory_dao.search_skills("测试")
+    search_results = await memory_dao.search_skills("测试")
     assert len(search_results) == 1
 
 
@@ -184,20 +184,21 @@ async def test_learner_service_learn_from_positive_feedback(session_service, lea
         rating="positive",
         comment="解释得非常清楚，步骤很详细。"
     )
-    feedback = learner_service.dao.save_feedback(feedback_create)
+    feedback = Feedback(**feedback_create.model_dump())
+    await learner_service.dao.save_feedback(feedback)
     
     # 3. 触发学习
     learned_id = await learner_service.learn_from_feedback(feedback)
     assert learned_id is not None
     
     # 4. 验证技能是否被保存
-    skills = memory_dao.list_skills()
+    skills = await memory_dao.list_skills()
     assert len(skills) == 1
     assert skills[0].skill_id == learned_id
     assert skills[0].name == MOCK_SKILL_RESPONSE["name"]
     
     # 5. 验证反馈状态是否更新
-    updated_feedback = memory_dao.get_feedback(feedback.feedback_id)
+    updated_feedback = await memory_dao.get_feedback(feedback.feedback_id)
     assert updated_feedback.learned is True
     assert updated_feedback.learned_skill_id == learned_id
 
@@ -223,19 +224,1098 @@ async def test_learner_service_learn_from_negative_feedback(session_service, lea
         rating="negative",
         comment="解释太学术了，完全听不懂。"
     )
-    feedback = learner_service.dao.save_feedback(feedback_create)
+    feedback = Feedback(**feedback_create.model_dump())
+    await learner_service.dao.save_feedback(feedback)
     
     # 3. 触发学习
     learned_id = await learner_service.learn_from_feedback(feedback)
     assert learned_id is not None
     
     # 4. 验证规则是否被保存
-    rules = memory_dao.list_rules()
+    rules = await memory_dao.list_rules()
     assert len(rules) == 1
     assert rules[0].rule_id == learned_id
     assert rules[0].name == MOCK_RULE_RESPONSE["name"]
     
     # 5. 验证反馈状态是否更新
-    updated_feedback = memory_dao.get_feedback(feedback.feedback_id)
+    updated_feedback = await memory_dao.get_feedback(feedback.feedback_id)
     assert updated_feedback.learned is True
     assert updated_feedback.learned_rule_id == learned_id
+
+
+def test_transcript_packer_respects_budget():
+    """测试会话记录打包器保留首尾和目标消息，并控制在预算内"""
+    from timem_evolve.llm import estimate_tokens
+    from timem_evolve.services.transcript_packer import TranscriptPacker
+    
+    messages = [
+        Message(role="user" if i % 2 == 0 else "assistant", content=f"消息{i} " + "内容" * 50)
+        for i in range(100)
+    ]
+    packer = TranscriptPacker(token_budget=500)
+    
+    packed = packer.pack(messages, keep=[41], session_id="s1")
+    assert estimate_tokens(packed) <= 600
+    assert "消息0 " in packed
+    assert "消息99 " in packed
+    assert "消息41 " in packed
+    assert "省略" in packed
+    
+    # 同一会话再次打包命中缓存
+    assert packer.pack(messages, keep=[41], session_id="s1") == packed
+    assert packer.cache_hits == 1
+    
+    # 消息条数不变但内容被修改时不返回旧结果
+    messages[99] = Message(role="assistant", content="消息99 已修改")
+    assert "已修改" in packer.pack(messages, keep=[41], session_id="s1")
+    assert packer.cache_hits == 1
+
+
+@pytest.mark.asyncio
+async def test_session_summarizer_incremental(memory_dao, mocker):
+    """测试滚动摘要按块增量推进并持久化复用"""
+    from timem_evolve.services.session_summarizer import SessionSummarizer
+    
+    await memory_dao.init_db()
+    llm = mocker.MagicMock()
+    llm.ainvoke = mocker.AsyncMock(return_value=mocker.MagicMock(content="摘要"))
+    
+    session = Session(
+        task="长会话",
+        messages=[Message(role="user", content=f"消息{i}") for i in range(50)]
+    )
+    summarizer = SessionSummarizer(memory_dao, llm, recent_messages=4, chunk_size=10)
+    
+    context = await summarizer.build_context(session, 45)
+    assert "[早前对话摘要]" in context
+    assert "消息44" in context
+    assert "消息5" not in context.split("[最近对话]")[1]
+    assert llm.ainvoke.await_count == 4
+    
+    # 新的摘要器实例从持久化的摘要继续，只为新增的块调用 LLM
+    summarizer = SessionSummarizer(memory_dao, llm, recent_messages=4, chunk_size=10, cache_size=2)
+    await summarizer.build_context(session, 49)
+    assert llm.ainvoke.await_count == 4
+    
+    # 缓存按内容失效且有上限
+    session.messages[47] = Message(role="user", content="已修改")
+    assert "已修改" in await summarizer.build_context(session, 49)
+    await summarizer.build_context(session, 48)
+    assert len(summarizer._cache) == 2
+
+
+@pytest.mark.asyncio
+async def test_analyzer_modes(mocker):
+    """测试并行扇出与单次调用两种分析模式"""
+    from timem_evolve.services.analyzer_service import AnalyzerService
+    
+    def mock_ainvoke(messages):
+        prompt = messages[-1].content
+        if "一次性完成" in prompt:
+            content = json.dumps({
+                "task_type": "代码解释",
+                "is_successful": True,
+                "key_insights": "分步解释",
+                "skill": {"name": MOCK_SKILL_RESPONSE["name"], "steps": ["a"]},
+                "rule": None
+            }, ensure_ascii=False)
+        elif "识别任务类型" in prompt:
+            content = "代码解释"
+        else:
+            content = "洞察"
+        return mocker.MagicMock(content=content)
+    
+    mock_openai = mocker.patch("timem_evolve.llm.providers.ChatOpenAI")
+    mock_openai.return_value.ainvoke = mocker.AsyncMock(side_effect=mock_ainvoke)
+    
+    analyzer = AnalyzerService()
+    session = Session(task="解释代码", messages=[Message(role="user", content="hi")], outcome="success")
+    
+    result = await analyzer.analyze(session, mode="parallel")
+    assert result["error"] == ""
+    assert result["task_type"] == "代码解释"
+    assert result["is_successful"] is True
+    assert mock_openai.return_value.ainvoke.await_count == 3
+    
+    result = await analyzer.analyze(session, mode="single_shot")
+    assert result["error"] == ""
+    assert json.loads(result["reflection"])["name"] == MOCK_SKILL_RESPONSE["name"]
+    assert mock_openai.return_value.ainvoke.await_count == 4
+
+
+@pytest.mark.asyncio
+async def test_analyzer_analyze_sessions_reuses_results(memory_dao, mocker):
+    """测试批量分析按内容哈希复用已保存的结果"""
+    from timem_evolve.services.analyzer_service import AnalyzerService
+    
+    await memory_dao.init_db()
+    mock_openai = mocker.patch("timem_evolve.llm.providers.ChatOpenAI")
+    mock_openai.return_value.ainvoke = mocker.AsyncMock(return_value=mocker.MagicMock(content="信息检索"))
+    
+    analyzer = AnalyzerService(dao=memory_dao)
+    sessions = [
+        Session(task=f"任务{i}", messages=[Message(role="user", content=f"问题{i}")], outcome="failure")
+        for i in range(3)
+    ]
+    
+    seen = [state["session"].session_id async for state in analyzer.analyze_many(sessions, concurrency=2)]
+    assert sorted(seen) == sorted(s.session_id for s in sessions)
+    
+    first = await analyzer.analyze_sessions(sessions, concurrency=2)
+    assert [r.session_id for r in first] == [s.session_id for s in sessions]
+    assert not any(r.cached for r in first)
+    
+    calls = mock_openai.return_value.ainvoke.await_count
+    second = await analyzer.analyze_sessions(sessions)
+    assert all(r.cached for r in second)
+    assert mock_openai.return_value.ainvoke.await_count == calls
+    
+    # 其他模式的结果不复用
+    single_shot = await analyzer.analyze_sessions(sessions, mode="single_shot")
+    assert not any(r.cached for r in single_shot)
+    assert all(r.mode == "single_shot" for r in single_shot)
+
+
+@pytest.mark.asyncio
+async def test_fake_provider_is_deterministic(memory_dao, monkeypatch):
+    """测试假模型提供方可离线驱动学习流程且输出确定"""
+    from timem_evolve.llm import create_llm, FakeChatModel
+    
+    monkeypatch.setenv("LLM_PROVIDER", "fake")
+    llm = create_llm()
+    assert isinstance(llm, FakeChatModel)
+    
+    from langchain_core.messages import HumanMessage
+    prompt = [HumanMessage(content='请判断。只需要返回 "成功" 或 "失败"')]
+    first = await llm.ainvoke(prompt)
+    second = await llm.ainvoke(prompt)
+    assert first.content == second.content
+    assert first.usage_metadata["input_tokens"] > 0
+    
+    await memory_dao.init_db()
+    learner = LearnerService(memory_dao)
+    session = Session(
+        task="离线任务",
+        messages=[Message(role="user", content="问题"), Message(role="assistant", content="回答")],
+        outcome="success"
+    )
+    skill = await learner.extract_skill_from_session(session)
+    assert skill is not None
+    assert await memory_dao.get_skill(skill.skill_id) is not None
+
+
+@pytest.mark.asyncio
+async def test_model_router_escalates_invalid_cheap_answer():
+    """测试小模型回答未通过校验时升级到默认模型"""
+    from langchain_core.messages import HumanMessage
+    from timem_evolve.llm import ModelRouter, FakeChatModel
+    from timem_evolve.llm.router import is_one_of
+    
+    router = ModelRouter("test", "big", provider="fake", node_models={"classify": "small"})
+    router.use(FakeChatModel(model_name="big", responses=[("判定", "success")]), "big")
+    router.use(FakeChatModel(model_name="small", responses=[("判定", "不确定")]), "small")
+    
+    response = await router.ainvoke(
+        [HumanMessage(content="判定结果")], node="classify", validator=is_one_of("success", "failure")
+    )
+    assert response.content == "success"
+    
+    stats = router.stats()["classify"]
+    assert stats["calls"] == 2
+    assert stats["escalations"] == 1
+    assert stats["model_calls"] == {"small": 1, "big": 1}
+
+
+@pytest.mark.asyncio
+async def test_feedback_coalescer_batches_session_feedbacks(memory_dao):
+    """测试同一会话窗口内的反馈合并为一次 LLM 调用"""
+    import asyncio
+    from timem_evolve.llm import FakeChatModel
+    from timem_evolve.services.feedback_coalescer import FeedbackCoalescer
+    
+    await memory_dao.init_db()
+    learner = LearnerService(memory_dao, provider="fake")
+    fake = FakeChatModel()
+    learner.llm.use(fake)
+    
+    session = Session(
+        task="多轮评价",
+        messages=[
+            Message(role="user" if i % 2 == 0 else "assistant", content=f"消息{i}")
+            for i in range(6)
+        ]
+    )
+    await memory_dao.save_session(session)
+    feedbacks = [
+        Feedback(session_id=session.session_id, message_index=1, rating="positive"),
+        Feedback(session_id=session.session_id, message_index=3, rating="negative"),
+        Feedback(session_id=session.session_id, message_index=5, rating="positive"),
+    ]
+    
+    coalescer = FeedbackCoalescer(learner, window_seconds=0.05)
+    learned_ids = await asyncio.gather(*(coalescer.submit(f) for f in feedbacks))
+    
+    assert all(learned_ids)
+    assert fake.calls == 1
+    assert coalescer.batches == 1
+    assert (await memory_dao.get_feedback(feedbacks[1].feedback_id)).learned_rule_id == learned_ids[1]
+    assert (await memory_dao.get_feedback(feedbacks[2].feedback_id)).learned_skill_id == learned_ids[2]
+    
+    # 去抖动：窗口内不断有新反馈时继续等待；enqueue 不等待学习结果
+    session = Session(task="陆续评价", messages=session.messages)
+    await memory_dao.save_session(session)
+    coalescer = FeedbackCoalescer(learner, window_seconds=0.2)
+    feedbacks = [Feedback(session_id=session.session_id, message_index=i, rating="positive") for i in (1, 3, 5)]
+    for feedback in feedbacks:
+        coalescer.enqueue(feedback)
+        await asyncio.sleep(0.12)
+    assert coalescer.batches == 0 and coalescer.pending_count == 3
+    await asyncio.sleep(0.2)
+    await coalescer.flush_all()
+    assert coalescer.batches == 1
+    assert all([(await memory_dao.get_feedback(f.feedback_id)).learned for f in feedbacks])
+
+
+@pytest.mark.asyncio
+async def test_learner_micro_batching_across_sessions(memory_dao):
+    """测试微批处理模式将不同会话的轮次打包进一次 LLM 调用，无效元素单独重试"""
+    import asyncio
+    import re
+    from timem_evolve.llm import FakeChatModel
+    
+    await memory_dao.init_db()
+    learner = LearnerService(memory_dao, provider="fake", micro_batch_size=4, micro_batch_wait=0.05)
+    # 批量结果缺少条目 3，应单独重试
+    def batch_response(prompt):
+        items = [
+            {"item": int(n), "type": "skill" if label == "好评" else "rule",
+             **(MOCK_SKILL_RESPONSE if label == "好评" else MOCK_RULE_RESPONSE)}
+            for n, label in re.findall(r"条目 (\d+)（(好评|差评)", prompt)
+            if n != "3"
+        ]
+        return "```json\n" + json.dumps(items, ensure_ascii=False) + "\n```"
+    fake = FakeChatModel(responses=[("批量提炼", batch_response)])
+    learner.llm.use(fake)
+    
+    feedbacks = []
+    for i in range(4):
+        session = Session(
+            task=f"任务{i}",
+            messages=[Message(role="user", content=f"问题{i}"), Message(role="assistant", content=f"回答{i}")]
+        )
+        await memory_dao.save_session(session)
+        feedback = Feedback(
+            session_id=session.session_id,
+            message_index=1,
+            rating="positive" if i % 2 == 0 else "negative"
+        )
+        await memory_dao.save_feedback(feedback)
+        feedbacks.append(feedback)
+    
+    learned_ids = await asyncio.gather(*(learner.learn_from_feedback(f) for f in feedbacks))
+    
+    assert all(learned_ids)
+    assert fake.calls == 2
+    stats = learner.turn_batcher.stats()
+    assert stats["batches"] == 1
+    assert stats["retries"] == 1
+    assert stats["turns_per_second"] > 0
+    assert (await memory_dao.get_feedback(feedbacks[3].feedback_id)).learned_rule_id == learned_ids[3]
+    
+    # 批次被取消时，等待中的调用方收到取消而不是一直挂起
+    async def hang(*args, **kwargs):
+        await asyncio.sleep(3600)
+    learner.llm.ainvoke = hang
+    turn = {"user_message": "问题", "ai_response": "回答", "context": ""}
+    waiters = [asyncio.create_task(learner.turn_batcher.submit("skill", "任务", turn, None)) for _ in range(4)]
+    await asyncio.sleep(0.01)
+    for task in list(learner.turn_batcher._inflight):
+        task.cancel()
+    results = await asyncio.wait_for(asyncio.gather(*waiters, return_exceptions=True), timeout=1)
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+@pytest.mark.asyncio
+async def test_learner_extract_artifacts_from_mixed_session(memory_dao):
+    """测试一次调用从结果混合的会话中提炼多个技能和规则，并过滤低置信度条目"""
+    from timem_evolve.llm import FakeChatModel
+    
+    await memory_dao.init_db()
+    learner = LearnerService(memory_dao, provider="fake")
+    low_confidence_rule = {**MOCK_RULE_RESPONSE, "name": "低置信度规则", "confidence": 0.2}
+    fake = FakeChatModel(responses=[(
+        "同时提炼",
+        "```json\n" + json.dumps({
+            "skills": [MOCK_SKILL_RESPONSE, {"name": "缺少字段"}],
+            "rules": [MOCK_RULE_RESPONSE, low_confidence_rule]
+        }, ensure_ascii=False) + "\n```"
+    )])
+    learner.llm.use(fake)
+    
+    session = Session(
+        task="混合结果的会话",
+        messages=[Message(role="user", content="问题"), Message(role="assistant", content="回答")]
+    )
+    artifacts = await learner.extract_artifacts_from_session(session, min_confidence=0.5)
+    
+    assert fake.calls == 1
+    assert [s.name for s in artifacts.skills] == [MOCK_SKILL_RESPONSE["name"]]
+    assert [r.name for r in artifacts.rules] == [MOCK_RULE_RESPONSE["name"]]
+    assert (await memory_dao.get_skill(artifacts.skills[0].skill_id)).source_sessions == [session.session_id]
+    assert await memory_dao.get_rule(artifacts.rules[0].rule_id) is not None
+    assert not memory_dao.skills_path.with_suffix(".json.tmp").exists()
+    
+    # 返回的不是 JSON 对象时得到空结果而不是异常
+    learner.llm.use(FakeChatModel(responses=[("同时提炼", "[1, 2]")]))
+    empty = await learner.extract_artifacts_from_session(session)
+    assert not empty.skills and not empty.rules
+
+
+@pytest.mark.asyncio
+async def test_model_router_singleflight_deduplicates_inflight_calls():
+    """测试并发的相同请求只调用一次模型，完成后的相同请求重新调用"""
+    import asyncio
+    from langchain_core.messages import HumanMessage
+    from timem_evolve.llm import FakeChatModel, LatencyDistribution, ModelRouter, SingleFlight
+    
+    singleflight = SingleFlight()
+    router = ModelRouter("test", singleflight=singleflight)
+    fake = FakeChatModel(latency=LatencyDistribution("constant", 20))
+    router.use(fake)
+    
+    messages = [HumanMessage(content="识别任务类型")]
+    responses = await asyncio.gather(*(router.ainvoke(messages, node="identify_task") for _ in range(5)))
+    
+    assert fake.calls == 1
+    assert {r.content for r in responses} == {"代码调试"}
+    assert singleflight.deduplicated == 4
+    assert router.stats()["identify_task"]["deduplicated"] == 4
+    assert singleflight.inflight_count == 0
+    
+    await router.ainvoke(messages, node="identify_task")
+    assert fake.calls == 2
+    
+    # 不同服务的路由器按提供方和模型名合并，而不是按各自的模型实例
+    routers = [
+        ModelRouter(service, provider="fake", singleflight=singleflight) for service in ("learner", "analyzer")
+    ]
+    for r in routers:
+        r.get_model().latency = LatencyDistribution("constant", 20)
+    calls = singleflight.calls
+    await asyncio.gather(*(r.ainvoke(messages) for r in routers))
+    assert singleflight.calls == calls + 1
+
+
+@pytest.mark.asyncio
+async def test_resilient_caller_timeout_hedging_and_circuit_breaker(memory_dao):
+    """测试截止时间、对冲请求和熔断"""
+    import asyncio
+    from langchain_core.messages import HumanMessage
+    from timem_evolve.llm import (
+        FakeChatModel, LatencyDistribution, ModelRouter, ResilientCaller, CircuitBreaker,
+        LLMTimeoutError, CircuitOpenError
+    )
+    from timem_evolve.llm.fake import FakeProviderError
+    
+    messages = [HumanMessage(content="识别任务类型")]
+    
+    # 延迟尖刺超过截止时间
+    router = ModelRouter("test", singleflight=None)
+    router.use(FakeChatModel(latency=LatencyDistribution("constant", 0, spike_rate=1.0, spike_ms=500)))
+    router.set_caller(router.default_model, ResilientCaller(timeout=0.05))
+    with pytest.raises(LLMTimeoutError):
+        await router.ainvoke(messages)
+    
+    # 第一次请求卡住，对冲请求先返回
+    calls = []
+    class SlowFirstModel:
+        async def ainvoke(self, messages):
+            calls.append(1)
+            await asyncio.sleep(1.0 if len(calls) == 1 else 0.0)
+            return await FakeChatModel().ainvoke(messages)
+    router = ModelRouter("test", singleflight=None)
+    router.use(SlowFirstModel())
+    caller = ResilientCaller(timeout=0.5, hedge_after=0.02)
+    router.set_caller(router.default_model, caller)
+    response = await router.ainvoke(messages)
+    assert response.content == "代码调试"
+    assert caller.hedged == 1 and caller.hedge_wins == 1
+    
+    # 错误率过高时熔断，之后直接拒绝
+    router = ModelRouter("test", singleflight=None)
+    failing = FakeChatModel(error_rate=1.0)
+    router.use(failing)
+    breaker = CircuitBreaker(failure_rate=0.5, window=4, min_calls=4, reset_seconds=60)
+    router.set_caller(router.default_model, ResilientCaller(breaker=breaker))
+    for _ in range(4):
+        with pytest.raises(FakeProviderError):
+            await router.ainvoke(messages)
+    with pytest.raises(CircuitOpenError):
+        await router.ainvoke(messages)
+    assert failing.calls == 4
+    assert breaker.stats()["state"] == "open"
+    
+    # 学习器不把熔断当作无效回复吞掉
+    learner = LearnerService(memory_dao, provider="fake")
+    learner.llm = router
+    turn = {"user_message": "问题", "ai_response": "回答", "context": ""}
+    with pytest.raises(CircuitOpenError):
+        await learner._extract_skill_from_turn("任务", turn, None)
+    
+    # 半开状态的试探调用被取消后，下一次调用可以重新试探
+    breaker = CircuitBreaker(failure_rate=0.5, window=2, min_calls=2, reset_seconds=0.01)
+    caller = ResilientCaller(breaker=breaker)
+    
+    async def boom():
+        raise RuntimeError("boom")
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            await caller.call(boom)
+    await asyncio.sleep(0.02)
+    probe = asyncio.create_task(caller.call(lambda: asyncio.sleep(3600)))
+    await asyncio.sleep(0)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    assert await caller.call(lambda: asyncio.sleep(0, result="ok")) == "ok"
+    assert breaker.stats()["state"] == "closed"
+
+
+@pytest.mark.asyncio
+async def test_llm_accounting_records_and_rolls_up(memory_dao):
+    """测试每次 LLM 调用被记录，并按节点汇总到 SQLite"""
+    import asyncio
+    from langchain_core.messages import HumanMessage
+    from timem_evolve.llm import FakeChatModel, LatencyDistribution, ModelRouter, LLMAccounting, SingleFlight
+    
+    await memory_dao.init_db()
+    accounting = LLMAccounting(capacity=100)
+    router = ModelRouter("analyzer", model_name="gpt-4.1-mini", singleflight=SingleFlight(), accounting=accounting)
+    router.use(FakeChatModel(latency=LatencyDistribution("constant", 10)))
+    
+    messages = [HumanMessage(content="识别任务类型")]
+    await asyncio.gather(router.ainvoke(messages, node="identify_task"), router.ainvoke(messages, node="identify_task"))
+    await router.ainvoke([HumanMessage(content="提取关键步骤")], node="extract_insights")
+    
+    summary = accounting.summary()
+    assert summary["analyzer.identify_task"]["calls"] == 2
+    assert summary["analyzer.identify_task"]["cache_hits"] == 1
+    assert summary["analyzer.identify_task"]["p95_ms"] >= 10
+    assert summary["analyzer.extract_insights"]["cost_usd"] > 0
+    
+    assert await accounting.rollup(memory_dao) == 2
+    assert await accounting.rollup(memory_dao) == 0
+    totals = await memory_dao.get_llm_usage_totals()
+    assert totals["analyzer.identify_task"]["calls"] == 2
+    assert totals["analyzer.identify_task"]["prompt_tokens"] == summary["analyzer.identify_task"]["prompt_tokens"]
+    
+    # 汇总前被挤出缓冲区的记录仍计入总量；并发汇总不重复写入
+    accounting = LLMAccounting(capacity=2)
+    for _ in range(5):
+        accounting.record("learner", "summarize", "gpt-4.1-nano", prompt_tokens=10)
+    assert accounting.evicted_before_rollup == 3
+    await asyncio.gather(accounting.rollup(memory_dao), accounting.rollup(memory_dao))
+    totals = await memory_dao.get_llm_usage_totals()
+    assert totals["learner.summarize"]["calls"] == 5
+    assert totals["learner.summarize"]["prompt_tokens"] == 50
+
+
+@pytest.mark.asyncio
+async def test_outcome_classifier_skips_confident_llm_calls(tmp_path):
+    """测试本地分类器从已标注会话训练后，置信度足够时不再调用 LLM 判定结果"""
+    from timem_evolve.llm import FakeChatModel
+    from timem_evolve.services.analyzer_service import AnalyzerService
+    from timem_evolve.services.outcome_classifier import OutcomeClassifier
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    for i in range(30):
+        await dao.save_session(Session(
+            task=f"修复接口问题 {i}",
+            messages=[
+                Message(role="user", content="接口返回 500"),
+                Message(role="assistant", content="检查一下日志"),
+                Message(role="user", content="问题已解决，非常感谢"),
+            ],
+            outcome="success"
+        ))
+        await dao.save_session(Session(
+            task=f"修复接口问题 {i}",
+            messages=[
+                Message(role="user", content="接口返回 500"),
+                Message(role="assistant", content="检查一下日志"),
+                Message(role="user", content="还是报错，完全没用"),
+            ],
+            outcome="failure"
+        ))
+    # 本地分类器自己给出的标签不参与训练
+    for i in range(5):
+        await dao.save_session(Session(
+            task=f"分类器标注 {i}", messages=[Message(role="user", content="完全没用")],
+            outcome="success", metadata={"outcome_source": "classifier"}
+        ))
+    
+    classifier = OutcomeClassifier(dao, threshold=0.9, min_samples=10, audit_rate=0.0)
+    analyzer = AnalyzerService(provider="fake", outcome_classifier=classifier, node_models={})
+    fake = FakeChatModel()
+    analyzer.llm.use(fake)
+    
+    confident = Session(
+        task="修复接口问题",
+        messages=[Message(role="user", content="接口返回 500"), Message(role="user", content="还是报错，完全没用")]
+    )
+    result = await analyzer.analyze(confident)
+    assert result["is_successful"] is False
+    assert "evaluate_outcome" not in analyzer.llm.stats()
+    
+    # 与训练数据无关的会话置信度不足，回退到 LLM 并统计一致率
+    unrelated = Session(task="写一首诗", messages=[Message(role="user", content="关于秋天")])
+    await analyzer.analyze(unrelated)
+    assert analyzer.llm.stats()["evaluate_outcome"]["calls"] == 1
+    
+    stats = classifier.stats()
+    assert stats["trained"] == 60
+    assert stats["avoided"] == 1 and stats["fallbacks"] == 1
+    assert stats["compared"] == 1
+    
+    # 增量训练只读取游标之后的新会话
+    await dao.save_session(Session(task="新会话", messages=[Message(role="user", content="好了")], outcome="success"))
+    assert await classifier.train_from_dao(batch_size=7) == 1
+    assert await classifier.train_from_dao() == 0
+    assert classifier.stats()["trained"] == 61
+
+
+@pytest.mark.asyncio
+async def test_task_type_index_reuses_labels_and_filters_sessions(tmp_path):
+    """测试相似任务复用已识别的任务类型，且任务类型可用于过滤会话"""
+    from timem_evolve.llm import FakeChatModel
+    from timem_evolve.services.analyzer_service import AnalyzerService
+    from timem_evolve.services.task_type_index import TaskTypeIndex
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    analyzer = AnalyzerService(provider="fake", dao=dao, task_type_index=TaskTypeIndex(dao), node_models={})
+    analyzer.llm.use(FakeChatModel())
+    
+    first = Session(task="修复登录接口返回 500 的问题", messages=[Message(role="user", content="hi")], outcome="failure")
+    second = Session(task="修复登录接口返回 502 的问题", messages=[Message(role="user", content="hi")], outcome="failure")
+    other = Session(task="写一首关于秋天的诗", messages=[Message(role="user", content="hi")], outcome="success")
+    for session in (first, second, other):
+        await dao.save_session(session)
+    
+    for session in (first, second, other):
+        await analyzer.analyze(session)
+    
+    assert analyzer.llm.stats()["identify_task"]["calls"] == 2
+    assert analyzer.task_type_index.stats()["hits"] == 1
+    # 命中索引的任务不再加入索引
+    assert len(analyzer.task_type_index) == 2
+    sessions = await dao.list_sessions(task_type="代码调试")
+    assert {s.session_id for s in sessions} == {first.session_id, second.session_id, other.session_id}
+    assert (await dao.get_session(second.session_id)).task_type == "代码调试"
+    
+    # 新实例从会话表预热索引
+    index = TaskTypeIndex(dao)
+    assert await index.lookup("修复登录接口返回 503 的问题") == "代码调试"
+    
+    # 超出上限时淘汰最早的条目，精确匹配也随之失效
+    index = TaskTypeIndex(max_entries=2)
+    for task, task_type in (("任务一", "甲"), ("任务二", "乙"), ("任务三", "丙")):
+        index.add(task, task_type)
+    assert len(index) == 2
+    assert index.nearest("任务一") != ("甲", 1.0)
+
+
+@pytest.mark.asyncio
+async def test_coach_run_tasks_claims_each_task_once(tmp_path):
+    """测试并发的批量运行不会重复执行同一个任务"""
+    import asyncio
+    from timem_evolve.llm import FakeChatModel, LatencyDistribution
+    from timem_evolve.models import CoachTask
+    from timem_evolve.services.coach_service import CoachService
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    learner = LearnerService(dao, provider="fake")
+    coach = CoachService(dao, learner, provider="fake", node_models={})
+    fake = FakeChatModel(latency=LatencyDistribution("constant", 5))
+    for router in (coach.llm, coach.learner_llm, learner.llm):
+        router.use(fake)
+    
+    tasks = [CoachTask(business_goal="调试", task_description=f"修复第 {i} 个缺陷") for i in range(6)]
+    for task in tasks:
+        coach.coach_storage.save_task(task)
+    
+    first, second = await asyncio.gather(
+        coach.run_tasks(concurrency=3),
+        coach.run_tasks(task_ids=[t.task_id for t in tasks[:3]], concurrency=3)
+    )
+    
+    assert first.claimed + second.claimed == 6
+    assert first.completed + second.completed == 6
+    assert coach.llm.stats()["evaluate_result"]["calls"] == 6
+    assert all(t.status == "completed" and t.session_id for t in await coach.list_tasks())
+    assert (await coach.run_tasks()).claimed == 0
+
+
+@pytest.mark.asyncio
+async def test_coach_generate_curriculum_batches_and_deduplicates(tmp_path):
+    """测试课程按批生成、按难度配额分配，并丢弃与已有任务重复的任务"""
+    from timem_evolve.llm import FakeChatModel
+    from timem_evolve.models import CoachTask
+    from timem_evolve.services.coach_service import CoachService
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    coach = CoachService(dao, LearnerService(dao, provider="fake"), provider="fake")
+    coach.llm.use(FakeChatModel())
+    
+    existing = CoachTask(business_goal="算法", task_description="实现快速排序，并处理空输入和超大输入")
+    coach.coach_storage.save_task(existing)
+    
+    tasks = await coach.generate_curriculum(
+        "算法", n=24, difficulty_mix={"easy": 1, "medium": 2, "hard": 1}, batch_size=10
+    )
+    
+    assert len(tasks) == 24
+    assert [t.difficulty for t in tasks].count("medium") == 12
+    descriptions = [t.task_description for t in tasks]
+    assert len(set(descriptions)) == 24
+    assert existing.task_description not in descriptions
+    # 24 个任务只需少量批量调用，而不是逐个生成
+    assert coach.llm.stats()["generate_curriculum"]["calls"] < 24
+    assert len(await coach.list_tasks()) == 25
+
+
+@pytest.mark.asyncio
+async def test_coach_generate_curriculum_skips_malformed_items(tmp_path):
+    """测试 LLM 返回的非法 difficulty 被丢弃，失败的批次不中断生成"""
+    from timem_evolve.services.coach_service import CoachService
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    coach = CoachService(dao, LearnerService(dao, provider="fake"), provider="fake")
+    
+    calls = []
+    
+    async def fake_batch(business_goal, counts, avoid, batch_number):
+        calls.append(batch_number)
+        if len(calls) == 1:
+            raise ValueError("LLM 返回了非法 JSON")
+        return [
+            {"task_description": "列表难度", "difficulty": ["easy"]},
+            {"task_description": "字典难度", "difficulty": {"level": "easy"}},
+            {"task_description": "未知难度", "difficulty": "extreme"},
+            {"task_description": "实现二分查找", "difficulty": "easy"},
+        ]
+    
+    coach._generate_task_batch = fake_batch
+    tasks = await coach.generate_curriculum("算法", n=1, difficulty_mix={"easy": 1}, max_rounds=2)
+    
+    assert [t.task_description for t in tasks] == ["实现二分查找"]
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_coach_jobs_report_progress_and_cancel(tmp_path):
+    """测试后台作业的并发上限、逐节点进度和取消"""
+    import asyncio
+    from timem_evolve.llm import FakeChatModel, LatencyDistribution
+    from timem_evolve.models import CoachTask
+    from timem_evolve.services.coach_service import CoachService
+    from timem_evolve.services.coach_jobs import CoachJobManager
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    learner = LearnerService(dao, provider="fake")
+    coach = CoachService(dao, learner, provider="fake", node_models={})
+    fake = FakeChatModel(latency=LatencyDistribution("constant", 10))
+    for router in (coach.llm, coach.learner_llm, learner.llm):
+        router.use(fake)
+    manager = CoachJobManager(coach, max_concurrency=1)
+    
+    async def wait_until(condition):
+        while not condition():
+            await asyncio.sleep(0.005)
+    
+    async def collect(stream):
+        return [item async for item in stream]
+    
+    tasks = [CoachTask(business_goal="调试", task_description=f"修复第 {i} 个缺陷") for i in range(3)]
+    coach.coach_storage.save_tasks(tasks)
+    jobs = [await manager.submit(tasks[0].task_id)] + await manager.submit_batch([t.task_id for t in tasks])
+    assert [job.task_id for job in jobs] == [t.task_id for t in tasks]
+    with pytest.raises(ValueError):
+        await manager.submit(tasks[0].task_id)
+    assert await manager.submit_batch() == []
+    
+    events = manager.events(jobs[0].job_id)
+    first = await events.__anext__()
+    assert first.status in ("queued", "running")
+    await asyncio.wait_for(wait_until(lambda: manager.stats()["running"] == 1), timeout=5)
+    assert manager.stats()["queued"] == 2
+    
+    # 取消排队中的作业：任务退回 pending
+    cancelled = await manager.cancel(jobs[2].job_id)
+    assert cancelled.status == "cancelled"
+    
+    snapshots = await asyncio.wait_for(collect(events), timeout=5)
+    assert snapshots[-1].status == "completed"
+    assert any(s.current_node == "evaluate_result" for s in snapshots)
+    assert snapshots[-1].nodes == {
+        "execute_task": "done", "evaluate_result": "done", "learn_from_session": "done"
+    }
+    
+    # 取消运行中的作业：工作流中止，任务退回 pending
+    await asyncio.wait_for(wait_until(lambda: manager.get(jobs[1].job_id).status == "running"), timeout=5)
+    cancelled = await manager.cancel(jobs[1].job_id)
+    assert cancelled.status == "cancelled" and cancelled.finished_at
+    
+    statuses = {t.task_id: t.status for t in await coach.list_tasks()}
+    assert statuses == {tasks[0].task_id: "completed", tasks[1].task_id: "pending", tasks[2].task_id: "pending"}
+
+
+def test_coach_storage_migrates_json_and_transitions_atomically(tmp_path):
+    """测试 Coach 任务存储：导入旧 JSON、按 ID/状态查询、原子状态迁移"""
+    import json
+    from timem_evolve.models import CoachTask
+    from timem_evolve.services.coach_service import CoachStorage
+    
+    legacy = [CoachTask(business_goal="调试", task_description=f"任务 {i}") for i in range(3)]
+    legacy[2].status = "completed"
+    (tmp_path / "coach_tasks.json").write_text(
+        json.dumps([t.model_dump(mode="json") for t in legacy], ensure_ascii=False)
+    )
+    
+    storage = CoachStorage(data_dir=str(tmp_path))
+    assert not (tmp_path / "coach_tasks.json").exists()
+    assert [t.task_id for t in storage.list_tasks()] == [t.task_id for t in legacy]
+    assert storage.get_task(legacy[1].task_id).task_description == "任务 1"
+    assert storage.get_task("missing") is None
+    assert storage.count_tasks("pending") == 2
+    
+    assert storage.transition(legacy[0].task_id, "pending", "running")
+    assert not storage.transition(legacy[0].task_id, "pending", "running")
+    assert storage.get_task(legacy[0].task_id).status == "running"
+    
+    # 第二个存储实例（模拟另一个进程）只能领取剩下的任务
+    other = CoachStorage(data_dir=str(tmp_path))
+    assert [t.task_id for t in other.claim_tasks()] == [legacy[1].task_id]
+    assert storage.claim_tasks() == []
+    assert [t.task_id for t in storage.list_tasks(status="running")] == [legacy[0].task_id, legacy[1].task_id]
+
+
+def test_coach_state_is_materialized_and_rebuildable(tmp_path):
+    """测试 Coach 统计随任务状态增量更新、分组统计和重建"""
+    from timem_evolve.models import CoachTask
+    from timem_evolve.services.coach_service import CoachStorage
+    
+    storage = CoachStorage(data_dir=str(tmp_path))
+    tasks = [
+        CoachTask(business_goal="调试", task_description="任务 1", difficulty="easy"),
+        CoachTask(business_goal="调试", task_description="任务 2", difficulty="hard"),
+        CoachTask(business_goal="写作", task_description="任务 3", difficulty="easy"),
+    ]
+    storage.save_tasks(tasks)
+    assert storage.get_stats()["total_tasks"] == 3
+    
+    claimed = storage.claim_tasks([tasks[0].task_id, tasks[1].task_id])
+    claimed[0].status, claimed[0].outcome, claimed[0].learned_skill_id = "completed", "success", "s1"
+    claimed[1].status, claimed[1].outcome, claimed[1].learned_rule_id = "completed", "failure", "r1"
+    storage.save_tasks(claimed, from_status="running")
+    # 重复保存同一状态不会重复计数
+    storage.save_task(claimed[0], from_status="running")
+    # 过期的任务对象不会覆盖已迁移的状态
+    storage.save_task(claimed[1].model_copy(update={"status": "pending"}))
+    assert storage.get_task(tasks[1].task_id).status == "completed"
+    
+    expected = {
+        "total_tasks": 3, "completed_tasks": 2, "successful_tasks": 1,
+        "failed_tasks": 1, "skills_gained": 1, "rules_gained": 1,
+    }
+    stats = storage.get_stats()
+    assert {k: stats[k] for k in expected} == expected
+    
+    by_goal = storage.get_stats_breakdown("business_goal")
+    assert by_goal["调试"]["completed_tasks"] == 2 and by_goal["写作"]["total_tasks"] == 1
+    assert storage.get_stats_breakdown("difficulty")["easy"]["successful_tasks"] == 1
+    
+    assert storage.transition(tasks[0].task_id, "completed", "pending")
+    stats = storage.get_stats()
+    assert stats["completed_tasks"] == 1 and stats["successful_tasks"] == 0 and stats["skills_gained"] == 0
+    assert storage.get_stats_breakdown("difficulty")["easy"]["successful_tasks"] == 0
+    materialized = {k: storage.get_stats()[k] for k in expected}
+    storage.rebuild_stats()
+    assert {k: storage.get_stats()[k] for k in expected} == materialized
+    
+    # 计数损坏后可以从任务表重建
+    storage._conn.execute("UPDATE coach_stats SET total_tasks = 99")
+    storage._conn.commit()
+    storage.rebuild_stats()
+    rebuilt = storage.get_stats()
+    assert rebuilt["total_tasks"] == 3 and rebuilt["completed_tasks"] == 1
+    assert storage.get_stats_breakdown("business_goal")["调试"]["total_tasks"] == 2
+
+
+@pytest.mark.asyncio
+async def test_checkpointed_graphs_resume_without_repeating_nodes(tmp_path):
+    """测试中断的 Coach 任务和分析从未完成的节点继续，启动清扫退回孤儿任务"""
+    import asyncio
+    from timem_evolve.llm import FakeChatModel
+    from timem_evolve.models import CoachTask
+    from timem_evolve.services.analyzer_service import AnalyzerService
+    from timem_evolve.services.coach_service import CoachService
+    from timem_evolve.services.graph_checkpoints import GraphCheckpoints
+    
+    class Crash(Exception):
+        pass
+    
+    crashes = {"评估 Learner Agent 的表现": 1, "可复用的技能总结": 1}
+    
+    def crash_once(marker):
+        def respond(prompt):
+            if crashes[marker]:
+                crashes[marker] -= 1
+                raise Crash(marker)
+            return "这是一个模拟的回复。"
+        return respond
+    
+    fake = FakeChatModel(success_rate=1.0, responses=[(m, crash_once(m)) for m in crashes])
+    checkpoints = GraphCheckpoints(tmp_path / "checkpoints.db")
+    try:
+        dao = MemoryDAO(data_dir=str(tmp_path))
+        await dao.init_db()
+    
+        # Coach：evaluate_result 第一次失败，模拟进程在运行中退出
+        learner = LearnerService(dao, provider="fake")
+        coach = CoachService(dao, learner, provider="fake", node_models={}, checkpoints=checkpoints)
+        learner_model = FakeChatModel()
+        coach.learner_llm.use(learner_model)
+        for router in (coach.llm, learner.llm):
+            router.use(fake)
+        task = CoachTask(business_goal="调试", task_description="修复缺陷")
+        coach.coach_storage.save_task(task)
+        claimed = coach.coach_storage.claim_tasks([task.task_id])[0]
+        with pytest.raises(Crash):
+            await coach._run_graph(claimed)
+        assert learner_model.calls == 1
+    
+        recovered = await coach.recover_orphaned_tasks()
+        assert recovered == {"resumable": [task.task_id], "reset": []}
+        done = await coach.run_task(await coach.get_task(task.task_id))
+        assert done.status == "completed"
+        # execute_task 已完成，不会再次调用模拟的 Learner 模型
+        assert learner_model.calls == 1
+        assert checkpoints.resumed == 1
+        assert await checkpoints.pending_nodes(await coach._graph_with_checkpoints(), f"coach:{task.task_id}") == ()
+    
+        # 分析器：reflect 第一次失败，再次分析同一会话时只重跑 reflect
+        analyzer = AnalyzerService(dao=dao, provider="fake", node_models={}, checkpoints=checkpoints)
+        analyzer.llm.use(fake)
+        session = Session(task="排查超时", messages=[Message(role="user", content="接口超时了")], outcome="success")
+        first = await analyzer.analyze(session)
+        assert first["error"]
+        calls = analyzer.llm.stats()["identify_task"]["calls"]
+        second = await analyzer.analyze(session)
+        assert not second["error"] and second["reflection"]
+        assert analyzer.llm.stats()["identify_task"]["calls"] == calls
+        assert checkpoints.resumed == 2
+        # 同一内容的并发分析各用独立线程，互不读取或删除对方的检查点
+        both = await asyncio.gather(analyzer.analyze(session), analyzer.analyze(session))
+        assert all(not r["error"] for r in both)
+        assert checkpoints.resumed == 2
+    finally:
+        await checkpoints.close()
+
+
+@pytest.mark.asyncio
+async def test_profiling_middleware_profiles_flagged_requests_into_bounded_ring(tmp_path, monkeypatch):
+    """测试只有带标记的请求被剖析，剖析数不超过上限"""
+    import httpx
+    # 导入 timem_evolve.api 会创建 API 的全局实例（./data），在临时目录中导入
+    monkeypatch.chdir(tmp_path)
+    from fastapi import FastAPI
+    from timem_evolve.api.profiling import ProfileStore, ProfilingMiddleware
+    
+    app = FastAPI()
+    
+    @app.get("/ping")
+    async def ping():
+        return {"ok": True}
+    
+    store = ProfileStore(tmp_path / "profiles", max_profiles=2)
+    app.add_middleware(ProfilingMiddleware, store=store, token="secret")
+    
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        plain = await client.get("/ping")
+        assert "x-profile-id" not in plain.headers
+        wrong = await client.get("/ping", headers={"X-Profile": "1"})
+        assert "x-profile-id" not in wrong.headers
+        
+        ids = []
+        for _ in range(3):
+            response = await client.get("/ping", params={"__profile": "secret"})
+            assert response.status_code == 200
+            ids.append(response.headers["x-profile-id"])
+    
+    profiles = store.list_profiles()
+    assert [p["profile_id"] for p in profiles] == sorted(ids[1:], reverse=True)
+    assert profiles[0]["path"] == "/ping" and profiles[0]["status"] == 200
+    assert store.path(ids[0]) is None
+    assert "(ping)" in store.render(ids[2], limit=1000)
+    assert store.path("../sessions") is None
+
+
+@pytest.mark.asyncio
+async def test_tracing_spans_cover_feedback_learning_and_graph_nodes(tmp_path):
+    """测试一次反馈学习的 span 覆盖 DAO、上下文构建、LLM 调用和 JSON 解析，图节点挂在分析下"""
+    import asyncio
+    from timem_evolve.llm import FakeChatModel
+    from timem_evolve.observability import default_tracer, span, JsonLinesExporter, OTLPExporter
+    from timem_evolve.services.analyzer_service import AnalyzerService
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    learner = LearnerService(dao, provider="fake")
+    learner.llm.use(FakeChatModel())
+    analyzer = AnalyzerService(dao=dao, provider="fake", node_models={})
+    analyzer.llm.use(FakeChatModel())
+    session = Session(task="排查超时", messages=[
+        Message(role="user", content="接口超时了"),
+        Message(role="assistant", content="先看慢查询日志")
+    ], outcome="success")
+    await dao.save_session(session)
+    feedback = Feedback(session_id=session.session_id, message_index=1, rating="positive")
+    
+    # 未采样时不记录任何追踪
+    await learner.learn_from_feedback(feedback)
+    assert default_tracer.recent() == []
+    
+    exporter = JsonLinesExporter(tmp_path / "traces.jsonl")
+    default_tracer.exporters.append(exporter)
+    try:
+        with span("POST /feedbacks", sampled=True) as root:
+            assert await learner.learn_from_feedback(feedback)
+        with span("analyze", sampled=True):
+            await analyzer.analyze(session)
+        await asyncio.to_thread(default_tracer.flush)
+    finally:
+        default_tracer.exporters.remove(exporter)
+    
+    feedback_trace = default_tracer.get(root.trace.trace_id)
+    spans = {s["name"]: s for s in feedback_trace["spans"]}
+    for name in ("dao.get_session", "learner.build_context", "llm.learner.extract_skill_from_turn",
+                 "learner.parse_json", "dao.save_skill", "dao.save_feedback"):
+        assert spans[name]["parent_id"] is not None, name
+    assert spans["learner.learn_from_feedback"]["parent_id"] == spans["POST /feedbacks"]["span_id"]
+    assert spans["dao.get_session"]["parent_id"] == spans["learner.learn_from_feedback"]["span_id"]
+    assert spans["llm.learner.extract_skill_from_turn"]["attributes"]["prompt_tokens"] > 0
+    
+    analysis_trace = default_tracer.recent(limit=1, name="analyze")[0]
+    spans = {s["name"]: s for s in analysis_trace["spans"]}
+    assert spans["analyzer.identify_task"]["parent_id"] == spans["analyzer.analyze"]["span_id"]
+    assert spans["llm.analyzer.reflect"]["parent_id"] == spans["analyzer.reflect"]["span_id"]
+    
+    exported = [json.loads(line) for line in (tmp_path / "traces.jsonl").read_text().splitlines()]
+    assert {t["trace_id"] for t in exported} == {feedback_trace["trace_id"], analysis_trace["trace_id"]}
+    otlp_spans = OTLPExporter().payload([root.trace])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(otlp_spans) == len(feedback_trace["spans"])
+    assert all(len(s["traceId"]) == 32 and len(s["spanId"]) == 16 for s in otlp_spans)
+
+
+@pytest.mark.asyncio
+async def test_metrics_record_routes_dao_operations_store_sizes_and_loop_lag(tmp_path):
+    """测试请求和 DAO 操作的直方图、导出时计算的存储大小以及事件循环延迟监控"""
+    import asyncio
+    import time
+    import httpx
+    from fastapi import FastAPI
+    from timem_evolve.observability import MetricsRegistry, MetricsMiddleware, EventLoopLagMonitor
+    from timem_evolve.observability.metrics import DAO_OPERATION_SECONDS
+    
+    dao = MemoryDAO(data_dir=str(tmp_path))
+    await dao.init_db()
+    before = DAO_OPERATION_SECONDS.count(operation="get_session")
+    session = Session(task="t", messages=[Message(role="user", content="hi")], outcome="success")
+    await dao.save_session(session)
+    await dao.get_session(session.session_id)
+    await dao.save_skill(Skill(name="s", description="d", workflow={"steps": [], "sop": ""}))
+    assert DAO_OPERATION_SECONDS.count(operation="get_session") == before + 1
+    
+    registry = MetricsRegistry()
+    requests = registry.histogram("http_seconds", "请求耗时", ["method", "route", "status"])
+    records = registry.gauge("records", "记录数", ["store"])
+    
+    async def collect():
+        for store, count in (await dao.count_records()).items():
+            records.set(count, store=store)
+    registry.add_collector(collect)
+    
+    app = FastAPI()
+    
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: str):
+        return {"id": item_id}
+    
+    app.add_middleware(MetricsMiddleware, histogram=requests)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        for item_id in ("a", "b"):
+            await client.get(f"/items/{item_id}")
+        await client.get("/missing")
+    
+    text = await registry.collect()
+    assert 'http_seconds_count{method="GET",route="/items/{item_id}",status="200"} 2' in text
+    assert 'http_seconds_count{method="GET",route="unmatched",status="404"} 1' in text
+    assert 'http_seconds_bucket{method="GET",route="/items/{item_id}",status="200",le="+Inf"} 2' in text
+    assert 'records{store="sessions"} 1' in text and 'records{store="skills"} 1' in text
+    
+    lag = registry.histogram("lag", "事件循环延迟")
+    monitor = EventLoopLagMonitor(interval=0.01, histogram=lag, max_gauge=registry.gauge("lag_max", "最大延迟"))
+    monitor.start(keep_samples=True)
+    await asyncio.sleep(0.03)
+    time.sleep(0.1)  # 阻塞事件循环
+    await asyncio.sleep(0.03)
+    await monitor.stop()
+    assert max(monitor.samples) >= 0.08
+    assert lag.count() == len(monitor.samples)
+
+
+@pytest.mark.asyncio
+async def test_dao_json_io_runs_off_event_loop_without_losing_writes(tmp_path):
+    """测试 JSON 文件读写在线程池中执行，不阻塞事件循环，并发写入不丢失"""
+    import asyncio
+    import threading
+    import time
+    
+    dao = MemoryDAO(data_dir=str(tmp_path), io_workers=4)
+    await dao.init_db()
+    original_load = dao._load_skills
+    threads = []
+    
+    def slow_load():
+        threads.append(threading.current_thread().name)
+        time.sleep(0.2)
+        return original_load()
+    
+    dao._load_skills = slow_load
+    ticks = 0
+    
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+    
+    task = asyncio.create_task(ticker())
+    await dao.list_skills()
+    task.cancel()
+    assert threads and threads[0].startswith("memory-dao-io")
+    assert ticks >= 5
+    dao._load_skills = original_load
+    
+    feedbacks = [Feedback(session_id="s", message_index=i, rating="positive") for i in range(30)]
+    await asyncio.gather(*(dao.save_feedback(f) for f in feedbacks))
+    saved = await dao.list_feedbacks(limit=100)
+    assert {f.feedback_id for f in saved} == {f.feedback_id for f in feedbacks}
+    dao.close()
@@ -6,7 +6,10 @@ from .dao.memory_dao import MemoryDAO
 from .services.session_service import SessionService
 from .services.analyzer_service import AnalyzerService
 from .services.learner_service import LearnerService
-from .services.coach_service import CoachAgent
+from .services.coach_service import CoachService
+
+# 兼容旧名称
+CoachAgent = CoachService
 
 from .models import (
     Session, SessionCreate, Message, Skill, Rule, Feedback, FeedbackCreate,
@@ -18,6 +21,7 @@ __all__ = [
     "SessionService",
     "AnalyzerService",
     "LearnerService",
+    "CoachService",
     "CoachAgent",
     "Session",
     "SessionCreate",
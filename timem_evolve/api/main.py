@@ -1,35 +1,154 @@
 """FastAPI 主应用"""
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import RedirectResponse
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import FileResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from contextlib import asynccontextmanager
-from typing import List, Optional
+from typing import Dict, List, Literal, Optional
+import asyncio
+import logging
+import os
+import time
 
+from .profiling import ProfileStore, ProfilingMiddleware
 from ..dao.memory_dao import MemoryDAO
 from ..services.session_service import SessionService
 from ..services.learner_service import LearnerService
 from ..services.coach_service import CoachService
+from ..services.coach_jobs import CoachJobManager
+from ..services.graph_checkpoints import GraphCheckpoints
 from ..services.analyzer_service import AnalyzerService
+from ..services.feedback_coalescer import FeedbackCoalescer
+from ..services.outcome_classifier import OutcomeClassifier
+from ..services.task_type_index import TaskTypeIndex
+from ..llm import LLMUnavailableError, default_accounting
+from ..observability import (
+    TracingMiddleware, MetricsMiddleware, EventLoopLagMonitor, default_tracer, default_registry
+)
 from ..models import (
     Session, SessionCreate, 
     Skill, Rule, 
     Feedback, FeedbackCreate,
-    CoachTask, CoachState, CoachTaskCreate
+    CoachTask, CoachState, CoachTaskCreate, CoachCurriculumRequest, CoachBatchRequest, CoachJob,
+    AnalysisResult, AnalyzeRequest, LearnedArtifacts
 )
 
 
+logger = logging.getLogger(__name__)
+
 # 全局实例
 dao = MemoryDAO(data_dir="./data")
 session_service = SessionService(dao)
-learner_service = LearnerService(dao)
-coach_service = CoachService(dao, learner_service)
-analyzer_service = AnalyzerService()
+learner_service = LearnerService(
+    dao,
+    micro_batch_size=int(os.environ.get("LEARNER_MICRO_BATCH_SIZE", "0")),
+    micro_batch_wait=float(os.environ.get("LEARNER_MICRO_BATCH_WAIT", "0.05"))
+)
+# LangGraph 检查点：进程重启后中断的 Coach 任务和分析从未完成的节点继续
+graph_checkpoints = (
+    GraphCheckpoints(dao.data_dir / "checkpoints.db")
+    if os.environ.get("GRAPH_CHECKPOINTS", "0") == "1" else None
+)
+# 本地成功/失败分类器：置信度达到阈值时跳过 evaluate_outcome 的 LLM 调用
+outcome_classifier = OutcomeClassifier(
+    dao, threshold=float(os.environ.get("OUTCOME_CLASSIFIER_THRESHOLD", "0.95"))
+) if os.environ.get("OUTCOME_CLASSIFIER", "1") != "0" else None
+coach_service = CoachService(
+    dao, learner_service, outcome_classifier=outcome_classifier, checkpoints=graph_checkpoints
+)
+# 后台运行 Coach 任务的作业管理器，同时运行的作业数由 COACH_JOB_CONCURRENCY 控制
+coach_jobs = CoachJobManager(
+    coach_service, max_concurrency=int(os.environ.get("COACH_JOB_CONCURRENCY", "2"))
+)
+analyzer_service = AnalyzerService(
+    dao=dao,
+    outcome_classifier=outcome_classifier,
+    checkpoints=graph_checkpoints,
+    # 与已识别任务的相似度达到阈值时复用其任务类型，不调用 LLM
+    task_type_index=TaskTypeIndex(
+        dao, threshold=float(os.environ.get("TASK_TYPE_SIMILARITY_THRESHOLD", "0.85"))
+    )
+)
+
+# 反馈合并窗口（秒）：大于 0 时同一会话窗口内的反馈合并为一次学习
+FEEDBACK_COALESCE_WINDOW = float(os.environ.get("FEEDBACK_COALESCE_WINDOW", "0"))
+feedback_coalescer = (
+    FeedbackCoalescer(learner_service, window_seconds=FEEDBACK_COALESCE_WINDOW)
+    if FEEDBACK_COALESCE_WINDOW > 0 else None
+)
+
+# LLM 调用记录汇总到 SQLite 的间隔（秒）
+LLM_ROLLUP_INTERVAL = float(os.environ.get("LLM_ROLLUP_INTERVAL", "60"))
+
+# 进程指标（GET /metrics）：请求耗时、DAO 操作耗时、存储大小、学习队列深度和事件循环延迟
+loop_lag_monitor = EventLoopLagMonitor(interval=float(os.environ.get("LOOP_LAG_INTERVAL", "0.1")))
+STORE_RECORDS = default_registry.gauge("timem_store_records", "各存储的记录数", ["store"])
+COACH_TASKS = default_registry.gauge("timem_coach_tasks", "各状态的 Coach 任务数", ["status"])
+LEARNING_QUEUE_DEPTH = default_registry.gauge("timem_learning_queue_depth", "等待学习的条目数", ["queue"])
+COACH_JOBS = default_registry.gauge("timem_coach_jobs", "各状态的 Coach 作业数", ["status"])
+
+
+async def _collect_store_sizes() -> None:
+    for store, count in (await dao.count_records()).items():
+        STORE_RECORDS.set(count, store=store)
+    coach_counts = await asyncio.to_thread(
+        lambda: {status: coach_service.coach_storage.count_tasks(status)
+                 for status in ("pending", "running", "completed", "failed")}
+    )
+    STORE_RECORDS.set(sum(coach_counts.values()), store="coach_tasks")
+    for status, count in coach_counts.items():
+        COACH_TASKS.set(count, status=status)
+
+
+default_registry.add_collector(_collect_store_sizes)
+LEARNING_QUEUE_DEPTH.set_function(lambda: {
+    ("feedback_coalescer",): feedback_coalescer.pending_count if feedback_coalescer else 0,
+    ("turn_batcher",): learner_service.turn_batcher.pending_count if learner_service.turn_batcher else 0,
+    ("coach_jobs",): coach_jobs.stats()["queued"],
+})
+COACH_JOBS.set_function(lambda: {
+    (status,): count for status, count in coach_jobs.stats().items() if status != "max_concurrency"
+})
+
+# 按请求剖析：启用后带 X-Profile 请求头或 ?__profile= 参数的请求会被 cProfile 剖析
+profile_store = ProfileStore(
+    dao.data_dir / "profiles", max_profiles=int(os.environ.get("PROFILING_MAX_PROFILES", "50"))
+) if os.environ.get("PROFILING", "0") == "1" else None
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 初始化数据库
     await dao.init_db()
+    default_accounting.start_rollups(dao, interval_seconds=LLM_ROLLUP_INTERVAL)
+    loop_lag_monitor.start()
+    
+    # 上次进程退出时仍为 running 的任务：退回 pending，有检查点的在后台继续运行
+    recovered = await coach_service.recover_orphaned_tasks()
+    if recovered["resumable"] or recovered["reset"]:
+        logger.info(
+            "恢复中断的 Coach 任务: 可继续 %d 个，重置 %d 个",
+            len(recovered["resumable"]), len(recovered["reset"])
+        )
+    if os.environ.get("COACH_RESUME_ON_STARTUP", "1") != "0":
+        for task_id in recovered["resumable"]:
+            try:
+                await coach_jobs.submit(task_id)
+            except ValueError as e:
+                logger.warning("继续运行 Coach 任务失败: %s", e)
+    
     yield
+    # 取消的作业把任务退回 pending；已完成节点的检查点保留，任务再次运行时从中断处继续
+    await coach_jobs.shutdown()
+    if feedback_coalescer:
+        await feedback_coalescer.flush_all()
+    if learner_service.turn_batcher:
+        await learner_service.turn_batcher.drain()
+    await default_accounting.stop_rollups(dao)
+    if graph_checkpoints:
+        await graph_checkpoints.close()
+    await asyncio.to_thread(default_tracer.flush)
+    await asyncio.to_thread(coach_service.close)
+    await asyncio.to_thread(dao.close)
+    await loop_lag_monitor.stop()
 
 
 app = FastAPI(
@@ -38,6 +157,13 @@ app = FastAPI(
     description="自进化智能体框架的后端服务",
     lifespan=lifespan
 )
+# 追踪：按 TRACING_SAMPLE_RATE 采样请求，带 X-Trace: 1 请求头的请求总是追踪
+app.add_middleware(TracingMiddleware, tracer=default_tracer)
+app.add_middleware(MetricsMiddleware)
+if profile_store:
+    app.add_middleware(
+        ProfilingMiddleware, store=profile_store, token=os.environ.get("PROFILING_TOKEN") or None
+    )
 
 
 @app.get("/")
@@ -60,9 +186,27 @@ async def get_session(session_id: str):
 
 
 @app.get("/sessions", response_model=List[Session])
-async def list_sessions(outcome: Optional[str] = None, limit: int = 100):
-    """列出会话"""
-    return await session_service.list_sessions(outcome=outcome, limit=limit)
+async def list_sessions(outcome: Optional[str] = None, task_type: Optional[str] = None, limit: int = 100):
+    """列出会话（可按结果和任务类型过滤）"""
+    return await session_service.list_sessions(outcome=outcome, limit=limit, task_type=task_type)
+
+
+@app.post("/sessions/analyze", response_model=List[AnalysisResult])
+async def analyze_sessions(request: AnalyzeRequest):
+    """批量分析会话（内容未变化的会话直接返回已保存的分析结果）"""
+    sessions = []
+    for session_id in request.session_ids:
+        session = await session_service.get_session(session_id)
+        if not session:
+            raise HTTPException(status_code=404, detail=f"Session not found: {session_id}")
+        sessions.append(session)
+    
+    return await analyzer_service.analyze_sessions(
+        sessions,
+        concurrency=request.concurrency,
+        mode=request.mode,
+        force=request.force
+    )
 
 
 # ==================== Feedbacks ====================
@@ -73,14 +217,23 @@ async def add_feedback(feedback_create: FeedbackCreate):
     feedback = Feedback(**feedback_create.model_dump())
     
     # 1. 保存反馈
-    dao.save_feedback(feedback)
+    await dao.save_feedback(feedback)
+    
+    # 2. 启用合并窗口时放入队列，与同一会话的其他反馈一起在后台学习，立即返回未学习的反馈
+    if feedback_coalescer:
+        feedback_coalescer.enqueue(feedback)
+        return feedback
     
-    # 2. 触发学习
-    learned_id = await learner_service.learn_from_feedback(feedback)
+    # 3. 触发学习；LLM 超时或熔断时直接返回未学习的反馈，之后可以重新学习
+    try:
+        learned_id = await learner_service.learn_from_feedback(feedback)
+    except LLMUnavailableError as e:
+        print(f"反馈学习失败: {e}")
+        learned_id = None
     
-    # 3. 重新获取反馈（可能已更新 learned 状态）
+    # 4. 重新获取反馈（可能已更新 learned 状态）
     if learned_id:
-        feedback = dao.get_feedback(feedback.feedback_id)
+        feedback = await dao.get_feedback(feedback.feedback_id)
     
     return feedback
 
@@ -92,7 +245,7 @@ async def list_feedbacks(
     limit: int = 100
 ):
     """列出反馈"""
-    return dao.list_feedbacks(session_id=session_id, learned=learned, limit=limit)
+    return await dao.list_feedbacks(session_id=session_id, learned=learned, limit=limit)
 
 
 # ==================== Skills ====================
@@ -100,13 +253,13 @@ async def list_feedbacks(
 @app.get("/skills", response_model=List[Skill])
 async def list_skills(limit: int = 100):
     """列出技能"""
-    return dao.list_skills(limit=limit)
+    return await dao.list_skills(limit=limit)
 
 
 @app.get("/skills/search", response_model=List[Skill])
 async def search_skills(query: str, top_k: int = 5):
     """搜索技能"""
-    return dao.search_skills(query=query, top_k=top_k)
+    return await dao.search_skills(query=query, top_k=top_k)
 
 
 # ==================== Rules ====================
@@ -114,13 +267,13 @@ async def search_skills(query: str, top_k: int = 5):
 @app.get("/rules", response_model=List[Rule])
 async def list_rules(limit: int = 100):
     """列出规则"""
-    return dao.list_rules(limit=limit)
+    return await dao.list_rules(limit=limit)
 
 
 @app.get("/rules/search", response_model=List[Rule])
 async def search_rules(query: str, top_k: int = 5):
     """搜索规则"""
-    return dao.search_rules(query=query, top_k=top_k)
+    return await dao.search_rules(query=query, top_k=top_k)
 
 
 # ==================== Learning ====================
@@ -142,12 +295,34 @@ async def learn_from_session(session_id: str):
     return None
 
 
+@app.post("/learn/session/{session_id}/artifacts", response_model=LearnedArtifacts)
+async def learn_artifacts_from_session(session_id: str, min_confidence: float = 0.0):
+    """一次调用从会话中同时提炼零或多个技能和规则（适用于结果混合或未知的会话）"""
+    session = await session_service.get_session(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    return await learner_service.extract_artifacts_from_session(session, min_confidence=min_confidence)
+
+
 # ==================== Coach ====================
 
 @app.get("/coach/state", response_model=CoachState)
 async def get_coach_state():
     """获取 Coach 模块的统计状态"""
-    return coach_service.get_state()
+    return await coach_service.get_state()
+
+
+@app.get("/coach/state/breakdown", response_model=Dict[str, CoachState])
+async def get_coach_state_breakdown(by: Literal["business_goal", "difficulty"] = "business_goal"):
+    """按业务目标或难度分组的 Coach 统计状态"""
+    return await coach_service.get_state_breakdown(by)
+
+
+@app.post("/coach/state/rebuild", response_model=CoachState)
+async def rebuild_coach_state():
+    """从任务重新计算物化的 Coach 统计（计数异常时使用）"""
+    return await coach_service.rebuild_state()
 
 
 @app.post("/coach/generate_task", response_model=CoachTask)
@@ -160,35 +335,181 @@ async def generate_coach_task(task_create: CoachTaskCreate):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/coach/run_task/{task_id}", response_model=CoachTask)
-async def run_coach_task(task_id: str):
-    """运行一个 Coach 任务"""
+@app.post("/coach/generate_curriculum", response_model=List[CoachTask])
+async def generate_coach_curriculum(request: CoachCurriculumRequest):
+    """批量生成一组去重后的 Coach 任务"""
     try:
-        tasks = coach_service.list_tasks()
-        task = next((t for t in tasks if t.task_id == task_id), None)
-        
-        if not task:
-            raise HTTPException(status_code=404, detail="Coach Task not found")
-            
-        if task.status != "pending":
-            raise HTTPException(status_code=400, detail=f"Task status is {task.status}, only 'pending' tasks can be run.")
-            
-        # 异步运行任务
-        # 注意：这里直接调用 run_task 会阻塞主线程，实际部署中应使用后台任务
-        # 简化处理：直接调用
-        updated_task = await coach_service.run_task(task)
-        return updated_task
-        
-    except HTTPException:
-        raise
+        return await coach_service.generate_curriculum(
+            request.business_goal, request.n, request.difficulty_mix
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/coach/run_task/{task_id}", response_model=CoachJob, status_code=202)
+async def run_coach_task(task_id: str, response: Response):
+    """提交一个 Coach 任务在后台运行，返回作业句柄（通过 /coach/jobs/{job_id} 查询进度）"""
+    task = await coach_service.get_task(task_id)
+    
+    if not task:
+        raise HTTPException(status_code=404, detail="Coach Task not found")
+        
+    if task.status != "pending":
+        raise HTTPException(status_code=400, detail=f"Task status is {task.status}, only 'pending' tasks can be run.")
+    
+    try:
+        job = await coach_jobs.submit(task_id)
+    except ValueError as e:
+        # 任务已被其他请求领取
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    response.headers["Location"] = f"/coach/jobs/{job.job_id}"
+    return job
+
+
+@app.get("/coach/jobs", response_model=List[CoachJob])
+async def list_coach_jobs(status: Optional[str] = None):
+    """列出 Coach 作业"""
+    return coach_jobs.list_jobs(status=status)
+
+
+@app.get("/coach/jobs/{job_id}", response_model=CoachJob)
+async def get_coach_job(job_id: str):
+    """获取 Coach 作业的状态和各节点进度"""
+    job = coach_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Coach Job not found")
+    return job
+
+
+@app.get("/coach/jobs/{job_id}/events")
+async def stream_coach_job_events(job_id: str):
+    """以 Server-Sent Events 推送 Coach 作业的进度，作业结束后关闭"""
+    if not coach_jobs.get(job_id):
+        raise HTTPException(status_code=404, detail="Coach Job not found")
+    
+    async def event_stream():
+        async for job in coach_jobs.events(job_id):
+            yield f"event: job\ndata: {job.model_dump_json()}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/coach/jobs/{job_id}/cancel", response_model=CoachJob)
+async def cancel_coach_job(job_id: str):
+    """取消 Coach 作业，任务退回 pending"""
+    job = await coach_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Coach Job not found")
+    return job
+
+
+@app.post("/coach/run_batch", response_model=List[CoachJob], status_code=202)
+async def run_coach_batch(request: CoachBatchRequest):
+    """领取一批 Coach 任务（默认所有 pending 任务）在后台运行，返回每个任务的作业句柄"""
+    return await coach_jobs.submit_batch(
+        task_ids=request.task_ids,
+        status=request.status,
+        limit=request.limit
+    )
+
+
 @app.get("/coach/tasks", response_model=List[CoachTask])
 async def list_coach_tasks(status: Optional[str] = None):
     """列出 Coach 任务"""
-    return coach_service.list_tasks(status=status)
+    return await coach_service.list_tasks(status=status)
+
+
+@app.get("/coach/tasks/{task_id}", response_model=CoachTask)
+async def get_coach_task(task_id: str):
+    """获取 Coach 任务"""
+    task = await coach_service.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail="Coach Task not found")
+    return task
+
+
+# ==================== Metrics ====================
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus 文本格式的进程指标"""
+    return PlainTextResponse(
+        await default_registry.collect(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@app.get("/metrics/llm")
+async def get_llm_metrics(window_seconds: Optional[float] = None):
+    """
+    LLM 调用指标（按 "服务.节点"）：
+    - recent: 进程内最近的调用记录，含延迟分位数（可用 window_seconds 限定时间窗口）
+    - totals: 汇总到 SQLite 的历史总量（返回前先汇总尚未写入的记录）
+    - outcome_classifier: 本地结果分类器节省的调用比例和与 LLM 的一致率
+    - task_type_index: 任务类型索引的命中率
+    """
+    since = time.time() - window_seconds if window_seconds else None
+    
+    await default_accounting.rollup(dao)
+    return {
+        "recent": default_accounting.summary(since=since),
+        "totals": await dao.get_llm_usage_totals(),
+        "outcome_classifier": outcome_classifier.stats() if outcome_classifier else None,
+        "task_type_index": analyzer_service.task_type_index.stats(),
+    }
+
+
+
+# ==================== Admin ====================
+
+def _require_profiling() -> ProfileStore:
+    if not profile_store:
+        raise HTTPException(status_code=404, detail="Profiling is disabled (set PROFILING=1)")
+    return profile_store
+
+
+@app.get("/admin/profiles")
+async def list_profiles():
+    """列出保存的请求剖析（最新的在前）"""
+    return _require_profiling().list_profiles()
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def download_profile(profile_id: str, format: Literal["prof", "text"] = "prof",
+                           sort: str = "cumulative", limit: int = 40):
+    """下载请求剖析：prof 为 pstats 文件，text 为按 sort 排序的前 limit 个函数"""
+    store = _require_profiling()
+    path = store.path(profile_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "text":
+        try:
+            return PlainTextResponse(store.render(profile_id, sort=sort, limit=limit))
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"Unknown sort key: {sort}")
+    return FileResponse(path, media_type="application/octet-stream", filename=path.name)
+
+
+
+@app.get("/admin/traces")
+async def list_traces(limit: int = 20, name: Optional[str] = None):
+    """最近完成的追踪（最新的在前），name 按根 span 名称过滤（例如 POST /feedbacks）"""
+    return {"stats": default_tracer.stats(), "traces": default_tracer.recent(limit=limit, name=name)}
+
+
+@app.get("/admin/traces/{trace_id}")
+async def get_trace(trace_id: str):
+    """获取一个追踪的所有 span"""
+    trace = default_tracer.get(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    return trace
 
 
 if __name__ == "__main__":
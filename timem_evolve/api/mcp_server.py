@@ -73,11 +73,11 @@ async def feedback_turn(args: FeedbackToolArguments) -> Dict[str, Any]:
             comment=feedback_create.comment
         )
         
-        dao.save_feedback(feedback)
+        await dao.save_feedback(feedback)
         learned_id = await learner_service.learn_from_feedback(feedback)
         
         # 重新获取更新后的反馈
-        feedback = dao.get_feedback(feedback.feedback_id)
+        feedback = await dao.get_feedback(feedback.feedback_id)
         
         result = {
             "feedback_id": feedback.feedback_id,
@@ -105,9 +105,9 @@ async def search_knowledge(args: SearchToolArguments) -> List[Dict[str, Any]]:
     """
     try:
         if args.knowledge_type == "skill":
-            results = dao.search_skills(args.query, args.top_k)
+            results = await dao.search_skills(args.query, args.top_k)
         elif args.knowledge_type == "rule":
-            results = dao.search_rules(args.query, args.top_k)
+            results = await dao.search_rules(args.query, args.top_k)
         else:
             raise ValueError("Invalid knowledge_type. Must be 'skill' or 'rule'.")
         
@@ -0,0 +1,161 @@
+"""按请求的性能剖析 - 带标记的请求用 cProfile 采集，结果保存在有上限的磁盘环中"""
+import cProfile
+import io
+import json
+import pstats
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+from urllib.parse import parse_qs
+
+
+# 触发剖析的请求头和查询参数
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY_PARAM = "__profile"
+# 响应中返回剖析 ID 的请求头
+PROFILE_ID_HEADER = b"x-profile-id"
+
+
+class ProfileStore:
+    """
+    剖析结果的磁盘环。
+
+    每个剖析保存为 <profile_id>.prof（pstats 格式，可用 snakeviz 等工具打开）
+    和一个记录请求信息的 <profile_id>.json；超过 max_profiles 个时删除最早的。
+
+    Args:
+        directory: 保存目录
+        max_profiles: 保留的剖析数上限
+    """
+
+    def __init__(self, directory: Union[str, Path], max_profiles: int = 50):
+        self.directory = Path(directory)
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def new_id() -> str:
+        """以时间开头的剖析 ID，按文件名排序即按时间排序"""
+        return f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+
+    def save(self, profile_id: str, profiler: cProfile.Profile, info: Dict[str, Any]) -> None:
+        """保存一个剖析"""
+        with self._lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            profiler.dump_stats(str(self.directory / f"{profile_id}.prof"))
+            (self.directory / f"{profile_id}.json").write_text(
+                json.dumps({"profile_id": profile_id, **info}, ensure_ascii=False)
+            )
+            self._trim()
+
+    def list_profiles(self) -> List[Dict[str, Any]]:
+        """所有剖析的请求信息，最新的在前"""
+        profiles = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True):
+            try:
+                profiles.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                # 正在被环淘汰或写了一半
+                continue
+        return profiles
+
+    def path(self, profile_id: str) -> Optional[Path]:
+        """剖析文件路径；ID 不合法或不存在时返回 None"""
+        if not re.fullmatch(r"[0-9T]+-[0-9a-f]+", profile_id):
+            return None
+        path = self.directory / f"{profile_id}.prof"
+        return path if path.exists() else None
+
+    def render(self, profile_id: str, sort: str = "cumulative", limit: int = 40) -> Optional[str]:
+        """以文本形式返回耗时最多的函数"""
+        path = self.path(profile_id)
+        if path is None:
+            return None
+        out = io.StringIO()
+        pstats.Stats(str(path), stream=out).sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def _trim(self) -> None:
+        profiles = sorted(self.directory.glob("*.prof"))
+        for path in profiles[:max(len(profiles) - self.max_profiles, 0)]:
+            path.unlink(missing_ok=True)
+            path.with_suffix(".json").unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    ASGI 剖析中间件。
+
+    请求带 X-Profile: 1 请求头或 ?__profile=1 查询参数时，用 cProfile 剖析该请求
+    从进入到响应结束的全部时间（DAO 文件 I/O、pydantic 构造、等待 LLM 等），
+    保存到 store，并在响应头 X-Profile-Id 中返回剖析 ID。未带标记的请求只多一次
+    请求头检查。设置 token 时标记的值必须等于 token，避免任何调用方都能触发剖析。
+
+    cProfile 剖析的是事件循环线程：剖析期间并发执行的其他请求也会计入。
+    同一时间只剖析一个请求，其余带标记的请求照常处理、不剖析。
+
+    Args:
+        app: 被包装的 ASGI 应用
+        store: 剖析结果存储
+        token: 触发剖析需要的标记值（为空时任何非 0 值都触发）
+    """
+
+    def __init__(self, app, store: ProfileStore, token: Optional[str] = None):
+        self.app = app
+        self.store = store
+        self.token = token
+        self._active = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._active or not self._requested(scope):
+            await self.app(scope, receive, send)
+            return
+
+        self._active = True
+        profiler = cProfile.Profile()
+        profile_id = self.store.new_id()
+        status = {"code": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = {
+                    **message,
+                    "headers": [*message.get("headers", []), (PROFILE_ID_HEADER, profile_id.encode())]
+                }
+            await send(message)
+
+        start = time.perf_counter()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            self._active = False
+            self.store.save(profile_id, profiler, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status["code"],
+                "duration_ms": round((time.perf_counter() - start) * 1000, 2),
+                "created_at": time.time(),
+            })
+
+    def _requested(self, scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                return self._accepts(value.decode("latin-1"))
+        query = scope.get("query_string", b"")
+        if PROFILE_QUERY_PARAM.encode() not in query:
+            return False
+        values = parse_qs(query.decode("latin-1")).get(PROFILE_QUERY_PARAM, [])
+        return any(self._accepts(v) for v in values)
+
+    def _accepts(self, value: str) -> bool:
+        if self.token:
+            return value == self.token
+        return value not in ("", "0")
@@ -1,17 +1,53 @@
 """记忆存储层"""
+import asyncio
+import contextvars
+import functools
 import json
+import os
+import threading
 import aiosqlite
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 
-from ..models import Session, Skill, Rule, Feedback
+from ..models import Session, Skill, Rule, Feedback, AnalysisResult
+from ..observability import traced, dao_operation
+
+
+# JSON 文件读写线程池的大小
+DAO_IO_WORKERS = int(os.environ.get("DAO_IO_WORKERS", "4"))
+
+
+def _operation(name: str):
+    """DAO 操作的追踪 span 和耗时指标"""
+    def decorator(func):
+        return traced(f"dao.{name}")(dao_operation(name)(func))
+    return decorator
+
+
+def _offloaded(func):
+    """把同步的文件读写方法变为异步方法，在 DAO 的 I/O 线程池中执行，不阻塞事件循环"""
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        return await self._run_blocking(func, self, *args, **kwargs)
+    return wrapper
 
 
 class MemoryDAO:
-    """记忆存储管理器"""
+    """
+    记忆存储管理器。
+    
+    会话等结构化数据保存在 SQLite（aiosqlite），技能、规则和反馈保存在 JSON 文件。
+    JSON 文件的读写是同步的整文件读写，因此对应的方法都是异步方法，实际读写在
+    最多 io_workers 个线程的线程池中执行，不会阻塞事件循环上的其他请求。
+    
+    Args:
+        data_dir: 数据目录
+        io_workers: JSON 文件读写线程池的大小，默认 DAO_IO_WORKERS
+    """
     
-    def __init__(self, data_dir: str = "./data"):
+    def __init__(self, data_dir: str = "./data", io_workers: Optional[int] = None):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(parents=True, exist_ok=True)
         
@@ -20,6 +56,16 @@ class MemoryDAO:
         self.rules_path = self.data_dir / "rules.json"
         self.feedbacks_path = self.data_dir / "feedbacks.json"
         
+        # 技能和规则文件的写锁（保证 save_learned_artifacts 两个文件一起更新）
+        self._artifacts_lock = threading.RLock()
+        # 反馈文件的读-改-写锁（写入在线程池中并发执行）
+        self._feedbacks_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=io_workers or DAO_IO_WORKERS, thread_name_prefix="memory-dao-io"
+        )
+        # JSON 文件 -> ((修改时间, 大小), 条目数)，避免每次统计都重新解析
+        self._json_counts: Dict[Path, tuple] = {}
+        
         # 初始化文件
         if not self.skills_path.exists():
             self.skills_path.write_text("[]")
@@ -38,33 +84,95 @@ class MemoryDAO:
                     messages TEXT NOT NULL,
                     outcome TEXT NOT NULL,
                     timestamp TEXT NOT NULL,
-                    metadata TEXT
+                    metadata TEXT,
+                    task_type TEXT
+                )
+            """)
+            # 旧数据库没有 task_type 列
+            async with db.execute("PRAGMA table_info(sessions)") as cursor:
+                columns = {row[1] async for row in cursor}
+            if "task_type" not in columns:
+                await db.execute("ALTER TABLE sessions ADD COLUMN task_type TEXT")
+            await db.execute("CREATE INDEX IF NOT EXISTS idx_sessions_task_type ON sessions(task_type)")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS session_summaries (
+                    session_id TEXT NOT NULL,
+                    upto_index INTEGER NOT NULL,
+                    prefix_hash TEXT NOT NULL,
+                    summary TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (session_id, upto_index)
+                )
+            """)
+            # 旧数据库的 analyses 表没有 mode 列（主键只有内容哈希）；表中只是可重算的缓存，直接重建
+            async with db.execute("PRAGMA table_info(analyses)") as cursor:
+                columns = {row[1] async for row in cursor}
+            if columns and "mode" not in columns:
+                await db.execute("DROP TABLE analyses")
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS analyses (
+                    content_hash TEXT NOT NULL,
+                    mode TEXT NOT NULL,
+                    session_id TEXT NOT NULL,
+                    result TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (content_hash, mode)
+                )
+            """)
+            await db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_usage_rollups (
+                    bucket TEXT NOT NULL,
+                    service TEXT NOT NULL,
+                    node TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    calls INTEGER NOT NULL,
+                    cache_hits INTEGER NOT NULL,
+                    errors INTEGER NOT NULL,
+                    prompt_tokens INTEGER NOT NULL,
+                    completion_tokens INTEGER NOT NULL,
+                    latency_total REAL NOT NULL,
+                    cost_usd REAL NOT NULL,
+                    PRIMARY KEY (bucket, service, node, model)
                 )
             """)
             await db.commit()
     
     # ==================== Sessions ====================
     
+    @_operation("save_session")
     async def save_session(self, session: Session) -> None:
         """保存会话"""
         async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
                 """
                 INSERT OR REPLACE INTO sessions 
-                (session_id, task, messages, outcome, timestamp, metadata)
-                VALUES (?, ?, ?, ?, ?, ?)
+                (session_id, task, messages, outcome, timestamp, metadata, task_type)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
                 """,
                 (
                     session.session_id,
                     session.task,
-                    json.dumps([msg.model_dump() for msg in session.messages]),
+                    json.dumps([msg.model_dump(mode='json') for msg in session.messages]),
                     session.outcome,
                     session.timestamp.isoformat(),
-                    json.dumps(session.metadata)
+                    json.dumps(session.metadata),
+                    session.task_type
                 )
             )
             await db.commit()
     
+    def _row_to_session(self, row) -> Session:
+        return Session(
+            session_id=row["session_id"],
+            task=row["task"],
+            messages=json.loads(row["messages"]),
+            outcome=row["outcome"],
+            task_type=row["task_type"],
+            timestamp=datetime.fromisoformat(row["timestamp"]),
+            metadata=json.loads(row["metadata"] or "{}")
+        )
+    
+    @_operation("get_session")
     async def get_session(self, session_id: str) -> Optional[Session]:
         """获取会话"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -75,45 +183,270 @@ class MemoryDAO:
             ) as cursor:
                 row = await cursor.fetchone()
                 if row:
-                    return Session(
-                        session_id=row["session_id"],
-                        task=row["task"],
-                        messages=json.loads(row["messages"]),
-                        outcome=row["outcome"],
-                        timestamp=datetime.fromisoformat(row["timestamp"]),
-                        metadata=json.loads(row["metadata"] or "{}")
-                    )
+                    return self._row_to_session(row)
                 return None
     
+    @_operation("list_sessions")
     async def list_sessions(
         self, 
         outcome: Optional[str] = None,
-        limit: int = 100
+        limit: int = 100,
+        task_type: Optional[str] = None
     ) -> List[Session]:
-        """列出会话"""
+        """列出会话（可按结果和任务类型过滤）"""
+        conditions = []
+        params: list = []
+        if outcome:
+            conditions.append("outcome = ?")
+            params.append(outcome)
+        if task_type:
+            conditions.append("task_type = ?")
+            params.append(task_type)
+        
+        query = "SELECT * FROM sessions"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp DESC LIMIT ?"
+        params.append(limit)
+        
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+                return [self._row_to_session(row) for row in rows]
+    
+    @_operation("list_labeled_sessions")
+    async def list_labeled_sessions(self, since: Optional[str] = None, limit: int = 1000) -> List[Session]:
+        """结果已知（success/failure）的会话，按时间正序；since 为 ISO 时间，只返回不早于该时间的会话"""
+        query = "SELECT * FROM sessions WHERE outcome IN ('success', 'failure')"
+        params: list = []
+        if since:
+            query += " AND timestamp >= ?"
+            params.append(since)
+        query += " ORDER BY timestamp ASC, session_id ASC LIMIT ?"
+        params.append(limit)
+        
         async with aiosqlite.connect(self.db_path) as db:
             db.row_factory = aiosqlite.Row
-            
-            if outcome:
-                query = "SELECT * FROM sessions WHERE outcome = ? ORDER BY timestamp DESC LIMIT ?"
-                params = (outcome, limit)
-            else:
-                query = "SELECT * FROM sessions ORDER BY timestamp DESC LIMIT ?"
-                params = (limit,)
-            
             async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
-                return [
-                    Session(
-                        session_id=row["session_id"],
-                        task=row["task"],
-                        messages=json.loads(row["messages"]),
-                        outcome=row["outcome"],
-                        timestamp=datetime.fromisoformat(row["timestamp"]),
-                        metadata=json.loads(row["metadata"] or "{}")
-                    )
-                    for row in rows
-                ]
+                return [self._row_to_session(row) for row in rows]
+    
+    @_operation("update_session_task_type")
+    async def update_session_task_type(self, session_id: str, task_type: str) -> None:
+        """记录会话的任务类型"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE sessions SET task_type = ? WHERE session_id = ?",
+                (task_type, session_id)
+            )
+            await db.commit()
+    
+    @_operation("list_task_type_examples")
+    async def list_task_type_examples(self, limit: int = 5000) -> List[Dict[str, str]]:
+        """已标注任务类型的会话（仅任务描述和类型），用于预热任务类型索引"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                """
+                SELECT task, task_type FROM sessions
+                WHERE task_type IS NOT NULL
+                ORDER BY timestamp DESC LIMIT ?
+                """,
+                (limit,)
+            ) as cursor:
+                return [{"task": row[0], "task_type": row[1]} async for row in cursor]
+    
+    # ==================== Session Summaries ====================
+    
+    @_operation("save_session_summary")
+    async def save_session_summary(
+        self,
+        session_id: str,
+        upto_index: int,
+        prefix_hash: str,
+        summary: str
+    ) -> None:
+        """保存会话前 upto_index 条消息的滚动摘要"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO session_summaries
+                (session_id, upto_index, prefix_hash, summary, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (session_id, upto_index, prefix_hash, summary, datetime.now().isoformat())
+            )
+            await db.commit()
+    
+    @_operation("get_session_summary")
+    async def get_session_summary(
+        self,
+        session_id: str,
+        max_upto_index: int
+    ) -> Optional[Dict[str, Any]]:
+        """获取覆盖范围不超过 max_upto_index 的最新滚动摘要"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                """
+                SELECT * FROM session_summaries
+                WHERE session_id = ? AND upto_index <= ?
+                ORDER BY upto_index DESC LIMIT 1
+                """,
+                (session_id, max_upto_index)
+            ) as cursor:
+                row = await cursor.fetchone()
+                if row:
+                    return {
+                        "upto_index": row["upto_index"],
+                        "prefix_hash": row["prefix_hash"],
+                        "summary": row["summary"]
+                    }
+                return None
+    
+    # ==================== Analyses ====================
+    
+    @_operation("save_analysis")
+    async def save_analysis(self, result: AnalysisResult) -> None:
+        """保存会话分析结果（按会话内容哈希和分析模式）"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """
+                INSERT OR REPLACE INTO analyses
+                (content_hash, mode, session_id, result, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (
+                    result.content_hash,
+                    result.mode,
+                    result.session_id,
+                    result.model_dump_json(),
+                    result.created_at.isoformat()
+                )
+            )
+            await db.commit()
+    
+    @_operation("get_analysis")
+    async def get_analysis(self, content_hash: str, mode: str = "sequential") -> Optional[AnalysisResult]:
+        """按会话内容哈希和分析模式获取分析结果"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT result FROM analyses WHERE content_hash = ? AND mode = ?",
+                (content_hash, mode)
+            ) as cursor:
+                row = await cursor.fetchone()
+                if row:
+                    return AnalysisResult.model_validate_json(row[0])
+                return None
+    
+    # ==================== LLM 用量 ====================
+    
+    @_operation("save_llm_rollups")
+    async def save_llm_rollups(self, rows: List[Dict[str, Any]]) -> None:
+        """累加写入按 (分钟, 服务, 节点, 模型) 聚合的 LLM 调用用量"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(
+                """
+                INSERT INTO llm_usage_rollups
+                (bucket, service, node, model, calls, cache_hits, errors,
+                 prompt_tokens, completion_tokens, latency_total, cost_usd)
+                VALUES (:bucket, :service, :node, :model, :calls, :cache_hits, :errors,
+                        :prompt_tokens, :completion_tokens, :latency_total, :cost_usd)
+                ON CONFLICT (bucket, service, node, model) DO UPDATE SET
+                    calls = calls + excluded.calls,
+                    cache_hits = cache_hits + excluded.cache_hits,
+                    errors = errors + excluded.errors,
+                    prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                    completion_tokens = completion_tokens + excluded.completion_tokens,
+                    latency_total = latency_total + excluded.latency_total,
+                    cost_usd = cost_usd + excluded.cost_usd
+                """,
+                rows
+            )
+            await db.commit()
+    
+    @_operation("get_llm_usage_totals")
+    async def get_llm_usage_totals(self, since: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """按 "服务.节点" 汇总已保存的 LLM 调用用量
+        
+        Args:
+            since: 只统计该时间（ISO 格式）之后的分钟桶
+        """
+        query = """
+            SELECT service, node,
+                   SUM(calls), SUM(cache_hits), SUM(errors),
+                   SUM(prompt_tokens), SUM(completion_tokens),
+                   SUM(latency_total), SUM(cost_usd)
+            FROM llm_usage_rollups
+        """
+        params = []
+        if since:
+            query += " WHERE bucket >= ?"
+            params.append(since)
+        query += " GROUP BY service, node"
+        
+        totals = {}
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(query, params) as cursor:
+                async for row in cursor:
+                    service, node, calls, cache_hits, errors, prompt_tokens, completion_tokens, latency_total, cost = row
+                    totals[f"{service}.{node}"] = {
+                        "calls": calls,
+                        "cache_hits": cache_hits,
+                        "errors": errors,
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "avg_latency_ms": round(latency_total / calls * 1000, 2) if calls else 0.0,
+                        "cost_usd": round(cost, 6),
+                    }
+        return totals
+    
+    # ==================== 统计 ====================
+    
+    async def count_records(self) -> Dict[str, int]:
+        """各存储的记录数（会话、技能、规则、反馈）"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute("SELECT COUNT(*) FROM sessions") as cursor:
+                sessions = (await cursor.fetchone())[0]
+        counts = await self._run_blocking(lambda: {
+            name: self._json_count(path)
+            for name, path in (("skills", self.skills_path), ("rules", self.rules_path), ("feedbacks", self.feedbacks_path))
+        })
+        return {"sessions": sessions, **counts}
+    
+    def _json_count(self, path: Path) -> int:
+        """JSON 文件中的条目数；文件未变化（大小和修改时间相同）时使用上次的结果"""
+        stat = path.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+        cached = self._json_counts.get(path)
+        if cached and cached[0] == signature:
+            return cached[1]
+        count = len(json.loads(path.read_text()))
+        self._json_counts[path] = (signature, count)
+        return count
+    
+    # ==================== JSON 文件 ====================
+    
+    async def _run_blocking(self, func, *args, **kwargs):
+        """在 I/O 线程池中运行同步函数（继承当前上下文，追踪 span 挂在调用方下）"""
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, functools.partial(context.run, func, *args, **kwargs)
+        )
+    
+    def close(self) -> None:
+        """关闭 I/O 线程池（等待进行中的读写完成）"""
+        self._executor.shutdown(wait=True)
+    
+    def _write_json(self, path: Path, data: List[Dict[str, Any]]) -> None:
+        """原子写入：先写临时文件再替换，避免读到写了一半的文件"""
+        os.replace(self._write_temp(path, data), path)
+    
+    def _write_temp(self, path: Path, data: List[Dict[str, Any]]) -> Path:
+        """写入 path 旁边的临时文件并返回其路径"""
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps(data, indent=2, ensure_ascii=False))
+        return tmp_path
     
     # ==================== Skills ====================
     
@@ -123,23 +456,19 @@ class MemoryDAO:
     
     def _save_skills(self, skills: List[Dict[str, Any]]) -> None:
         """保存技能"""
-        self.skills_path.write_text(json.dumps(skills, indent=2, ensure_ascii=False))
+        self._write_json(self.skills_path, skills)
     
+    @_operation("save_skill")
+    @_offloaded
     def save_skill(self, skill: Skill) -> None:
         """保存技能"""
-        skills = self._load_skills()
-        
-        # 检查是否已存在
-        for i, s in enumerate(skills):
-            if s["skill_id"] == skill.skill_id:
-                skills[i] = skill.model_dump(mode='json')
-                self._save_skills(skills)
-                return
-        
-        # 新增
-        skills.append(skill.model_dump(mode='json'))
-        self._save_skills(skills)
+        with self._artifacts_lock:
+            skills = self._load_skills()
+            self._upsert(skills, "skill_id", skill.model_dump(mode='json'))
+            self._save_skills(skills)
     
+    @_operation("get_skill")
+    @_offloaded
     def get_skill(self, skill_id: str) -> Optional[Skill]:
         """获取技能"""
         skills = self._load_skills()
@@ -148,6 +477,8 @@ class MemoryDAO:
                 return Skill(**s)
         return None
     
+    @_operation("list_skills")
+    @_offloaded
     def list_skills(self, limit: int = 100) -> List[Skill]:
         """列出技能"""
         skills = self._load_skills()
@@ -155,6 +486,8 @@ class MemoryDAO:
         skills.sort(key=lambda x: x.get("created_at", ""), reverse=True)
         return [Skill(**s) for s in skills[:limit]]
     
+    @_operation("search_skills")
+    @_offloaded
     def search_skills(self, query: str, top_k: int = 5) -> List[Skill]:
         """搜索技能（简单的关键词匹配）"""
         skills = self._load_skills()
@@ -180,23 +513,19 @@ class MemoryDAO:
     
     def _save_rules(self, rules: List[Dict[str, Any]]) -> None:
         """保存规则"""
-        self.rules_path.write_text(json.dumps(rules, indent=2, ensure_ascii=False))
+        self._write_json(self.rules_path, rules)
     
+    @_operation("save_rule")
+    @_offloaded
     def save_rule(self, rule: Rule) -> None:
         """保存规则"""
-        rules = self._load_rules()
-        
-        # 检查是否已存在
-        for i, r in enumerate(rules):
-            if r["rule_id"] == rule.rule_id:
-                rules[i] = rule.model_dump(mode='json')
-                self._save_rules(rules)
-                return
-        
-        # 新增
-        rules.append(rule.model_dump(mode='json'))
-        self._save_rules(rules)
+        with self._artifacts_lock:
+            rules = self._load_rules()
+            self._upsert(rules, "rule_id", rule.model_dump(mode='json'))
+            self._save_rules(rules)
     
+    @_operation("get_rule")
+    @_offloaded
     def get_rule(self, rule_id: str) -> Optional[Rule]:
         """获取规则"""
         rules = self._load_rules()
@@ -205,6 +534,8 @@ class MemoryDAO:
                 return Rule(**r)
         return None
     
+    @_operation("list_rules")
+    @_offloaded
     def list_rules(self, limit: int = 100) -> List[Rule]:
         """列出规则"""
         rules = self._load_rules()
@@ -212,6 +543,8 @@ class MemoryDAO:
         rules.sort(key=lambda x: x.get("created_at", ""), reverse=True)
         return [Rule(**r) for r in rules[:limit]]
     
+    @_operation("search_rules")
+    @_offloaded
     def search_rules(self, query: str, top_k: int = 5) -> List[Rule]:
         """搜索规则（简单的关键词匹配）"""
         rules = self._load_rules()
@@ -229,6 +562,45 @@ class MemoryDAO:
         results.sort(key=lambda x: x.confidence, reverse=True)
         return results[:top_k]
 
+    # ==================== Skills + Rules ====================
+    
+    @staticmethod
+    def _upsert(items: List[Dict[str, Any]], key: str, item: Dict[str, Any]) -> None:
+        """已存在则替换，否则追加"""
+        for i, existing in enumerate(items):
+            if existing[key] == item[key]:
+                items[i] = item
+                return
+        items.append(item)
+    
+    @_operation("save_learned_artifacts")
+    @_offloaded
+    def save_learned_artifacts(self, skills: List[Skill], rules: List[Rule]) -> None:
+        """
+        在一次写入中保存一批技能和规则。
+        
+        两个文件都先写临时文件，全部写好后再依次替换；替换规则文件失败时
+        恢复原来的技能文件，保证不会只保存一半。
+        """
+        with self._artifacts_lock:
+            skill_items = self._load_skills()
+            rule_items = self._load_rules()
+            for skill in skills:
+                self._upsert(skill_items, "skill_id", skill.model_dump(mode='json'))
+            for rule in rules:
+                self._upsert(rule_items, "rule_id", rule.model_dump(mode='json'))
+            
+            skills_tmp = self._write_temp(self.skills_path, skill_items)
+            rules_tmp = self._write_temp(self.rules_path, rule_items)
+            
+            previous_skills = self._load_skills()
+            os.replace(skills_tmp, self.skills_path)
+            try:
+                os.replace(rules_tmp, self.rules_path)
+            except Exception:
+                self._write_json(self.skills_path, previous_skills)
+                raise
+    
     # ==================== Feedbacks ====================
     
     def _load_feedbacks(self) -> List[Dict[str, Any]]:
@@ -236,24 +608,20 @@ class MemoryDAO:
         return json.loads(self.feedbacks_path.read_text())
     
     def _save_feedbacks(self, feedbacks: List[Dict[str, Any]]) -> None:
-        """保存反馈"""
-        self.feedbacks_path.write_text(json.dumps(feedbacks, indent=2, ensure_ascii=False))
+        """保存反馈（原子替换，并发读取不会读到写了一半的文件）"""
+        self._write_json(self.feedbacks_path, feedbacks)
     
+    @_operation("save_feedback")
+    @_offloaded
     def save_feedback(self, feedback: Feedback) -> None:
         """保存反馈"""
-        feedbacks = self._load_feedbacks()
-        
-        # 检查是否已存在
-        for i, f in enumerate(feedbacks):
-            if f["feedback_id"] == feedback.feedback_id:
-                feedbacks[i] = feedback.model_dump(mode='json')
-                self._save_feedbacks(feedbacks)
-                return
-        
-        # 新增
-        feedbacks.append(feedback.model_dump(mode='json'))
-        self._save_feedbacks(feedbacks)
+        with self._feedbacks_lock:
+            feedbacks = self._load_feedbacks()
+            self._upsert(feedbacks, "feedback_id", feedback.model_dump(mode='json'))
+            self._save_feedbacks(feedbacks)
     
+    @_operation("get_feedback")
+    @_offloaded
     def get_feedback(self, feedback_id: str) -> Optional[Feedback]:
         """获取反馈"""
         feedbacks = self._load_feedbacks()
@@ -262,6 +630,8 @@ class MemoryDAO:
                 return Feedback(**f)
         return None
     
+    @_operation("list_feedbacks")
+    @_offloaded
     def list_feedbacks(
         self, 
         session_id: Optional[str] = None,
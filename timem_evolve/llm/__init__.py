@@ -0,0 +1,31 @@
+"""LLM 提供方层"""
+from .tokens import estimate_tokens
+from .providers import create_llm, register_provider, list_providers
+from .fake import FakeChatModel, LatencyDistribution
+from .router import ModelRouter, CHEAP_MODEL_NAME
+from .singleflight import SingleFlight, default_singleflight
+from .accounting import LLMAccounting, default_accounting
+from .resilience import (
+    ResilientCaller, CircuitBreaker,
+    LLMUnavailableError, LLMTimeoutError, CircuitOpenError
+)
+
+__all__ = [
+    "create_llm",
+    "register_provider",
+    "list_providers",
+    "FakeChatModel",
+    "LatencyDistribution",
+    "ModelRouter",
+    "CHEAP_MODEL_NAME",
+    "SingleFlight",
+    "default_singleflight",
+    "ResilientCaller",
+    "CircuitBreaker",
+    "LLMUnavailableError",
+    "LLMTimeoutError",
+    "CircuitOpenError",
+    "LLMAccounting",
+    "default_accounting",
+    "estimate_tokens",
+]
@@ -0,0 +1,240 @@
+"""LLM 调用记账 - 记录每次调用的延迟、token 和成本"""
+import asyncio
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+
+# 每百万 token 的价格（美元）：(输入, 输出)
+MODEL_PRICES: Dict[str, tuple] = {
+    "gpt-4.1": (2.0, 8.0),
+    "gpt-4.1-mini": (0.4, 1.6),
+    "gpt-4.1-nano": (0.1, 0.4),
+}
+
+
+def estimate_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """按 MODEL_PRICES 估算一次调用的成本（美元），未知模型按 0 计"""
+    input_price, output_price = MODEL_PRICES.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * input_price + completion_tokens * output_price) / 1_000_000
+
+
+class LLMCallRecord:
+    """一次 LLM 调用的记录"""
+
+    __slots__ = (
+        "seq", "timestamp", "service", "node", "model",
+        "prompt_tokens", "completion_tokens", "latency", "cost_usd", "cache_hit", "error"
+    )
+
+    def __init__(
+        self,
+        seq: int,
+        service: str,
+        node: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        latency: float,
+        cache_hit: bool = False,
+        error: Optional[str] = None
+    ):
+        self.seq = seq
+        self.timestamp = time.time()
+        self.service = service
+        self.node = node
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency = latency
+        self.cost_usd = 0.0 if cache_hit else estimate_cost(model, prompt_tokens, completion_tokens)
+        self.cache_hit = cache_hit
+        self.error = error
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+_ROLLUP_SUMS = (
+    "calls", "cache_hits", "errors", "prompt_tokens", "completion_tokens", "latency_total", "cost_usd"
+)
+RollupKey = Tuple[str, str, str, str]
+
+
+def _add_record(buckets: Dict[RollupKey, Dict[str, Any]], record: LLMCallRecord) -> None:
+    """把一条记录累加到 (分钟, 服务, 节点, 模型) 聚合行"""
+    bucket = datetime.fromtimestamp(record.timestamp).replace(second=0, microsecond=0).isoformat()
+    _add_row(buckets, {
+        "bucket": bucket,
+        "service": record.service,
+        "node": record.node,
+        "model": record.model,
+        "calls": 1,
+        "cache_hits": int(record.cache_hit),
+        "errors": int(bool(record.error)),
+        "prompt_tokens": record.prompt_tokens,
+        "completion_tokens": record.completion_tokens,
+        "latency_total": record.latency,
+        "cost_usd": record.cost_usd,
+    })
+
+
+def _add_row(buckets: Dict[RollupKey, Dict[str, Any]], row: Dict[str, Any]) -> None:
+    """把一个聚合行累加到 buckets"""
+    key = (row["bucket"], row["service"], row["node"], row["model"])
+    existing = buckets.get(key)
+    if existing is None:
+        buckets[key] = dict(row)
+        return
+    for name in _ROLLUP_SUMS:
+        existing[name] += row[name]
+
+
+class LLMAccounting:
+    """
+    进程内的 LLM 调用记账。
+
+    每次调用追加到固定容量的环形缓冲区（超出容量时丢弃最旧的记录），用于计算
+    最近调用的延迟分位数；rollup() 把尚未汇总的记录按 (分钟, 服务, 节点, 模型)
+    聚合后写入 SQLite，用于长期的总量统计。尚未汇总就被挤出缓冲区的记录先累加到
+    待写入的聚合行中（计入 evicted_before_rollup），写入失败的行也会保留到下一次，
+    长期总量不会因此丢失；并发的 rollup() 串行执行，不会重复写入。
+
+    Args:
+        capacity: 环形缓冲区容量
+    """
+
+    def __init__(self, capacity: int = 10000):
+        self._records: Deque[LLMCallRecord] = deque(maxlen=capacity)
+        self._seq = 0
+        self._rolled_seq = 0
+        # 已不在缓冲区中（被淘汰或写入失败）但尚未写入 SQLite 的聚合行
+        self._unsaved: Dict[RollupKey, Dict[str, Any]] = {}
+        self._rollup_lock = asyncio.Lock()
+        self._rollup_task: Optional[asyncio.Task] = None
+
+        # 统计
+        self.evicted_before_rollup = 0
+
+    def record(
+        self,
+        service: str,
+        node: Optional[str],
+        model: str,
+        prompt_tokens: int = 0,
+        completion_tokens: int = 0,
+        latency: float = 0.0,
+        cache_hit: bool = False,
+        error: Optional[str] = None
+    ) -> LLMCallRecord:
+        """记录一次调用；cache_hit 表示结果来自缓存或合并的请求，不计成本"""
+        if len(self._records) == self._records.maxlen and self._records[0].seq > self._rolled_seq:
+            _add_record(self._unsaved, self._records[0])
+            self.evicted_before_rollup += 1
+        self._seq += 1
+        record = LLMCallRecord(
+            self._seq, service, node or "default", model,
+            prompt_tokens, completion_tokens, latency, cache_hit, error
+        )
+        self._records.append(record)
+        return record
+
+    def records(self) -> List[LLMCallRecord]:
+        """缓冲区中的全部记录（从旧到新）"""
+        return list(self._records)
+
+    def summary(self, since: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        按 "服务.节点" 汇总缓冲区中的记录：调用数、缓存命中数、错误数、
+        延迟分位数（仅统计实际调用）、token 和成本。
+
+        Args:
+            since: 只统计该时间戳（秒）之后的记录
+        """
+        groups: Dict[str, List[LLMCallRecord]] = {}
+        for record in self._records:
+            if since is not None and record.timestamp < since:
+                continue
+            groups.setdefault(f"{record.service}.{record.node}", []).append(record)
+
+        result = {}
+        for key, records in sorted(groups.items()):
+            latencies = sorted(r.latency for r in records if not r.cache_hit and not r.error)
+            result[key] = {
+                "calls": len(records),
+                "cache_hits": sum(1 for r in records if r.cache_hit),
+                "errors": sum(1 for r in records if r.error),
+                "p50_ms": round(_percentile(latencies, 0.5) * 1000, 2) if latencies else None,
+                "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+                "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+                "prompt_tokens": sum(r.prompt_tokens for r in records),
+                "completion_tokens": sum(r.completion_tokens for r in records),
+                "cost_usd": round(sum(r.cost_usd for r in records), 6),
+                "models": sorted({r.model for r in records}),
+            }
+        return result
+
+    def pending_rollup(self, upto: Optional[int] = None) -> List[Dict[str, Any]]:
+        """尚未写入 SQLite 的记录（到序号 upto 为止），按 (分钟, 服务, 节点, 模型) 聚合"""
+        buckets: Dict[RollupKey, Dict[str, Any]] = {}
+        for row in self._unsaved.values():
+            _add_row(buckets, row)
+        for record in self._records:
+            if record.seq <= self._rolled_seq or (upto is not None and record.seq > upto):
+                continue
+            _add_record(buckets, record)
+        return list(buckets.values())
+
+    async def rollup(self, dao) -> int:
+        """把尚未汇总的记录写入 SQLite，返回写入的行数"""
+        async with self._rollup_lock:
+            # 写入前先认领序号范围：写入期间到达的记录留给下一次，被淘汰的记录不会重复累加
+            seq = self._seq
+            rows = self.pending_rollup(upto=seq)
+            self._unsaved = {}
+            self._rolled_seq = seq
+            if not rows:
+                return 0
+            try:
+                await dao.save_llm_rollups(rows)
+            except BaseException:
+                for row in rows:
+                    _add_row(self._unsaved, row)
+                raise
+            return len(rows)
+
+    def start_rollups(self, dao, interval_seconds: float = 60.0) -> None:
+        """启动后台任务，每隔 interval_seconds 汇总一次"""
+        if self._rollup_task and not self._rollup_task.done():
+            return
+
+        async def loop():
+            while True:
+                await asyncio.sleep(interval_seconds)
+                try:
+                    await self.rollup(dao)
+                except Exception as e:
+                    print(f"LLM 调用汇总失败: {e}")
+
+        self._rollup_task = asyncio.ensure_future(loop())
+
+    async def stop_rollups(self, dao=None) -> None:
+        """停止后台汇总；提供 dao 时先写入剩余记录"""
+        if self._rollup_task:
+            self._rollup_task.cancel()
+            try:
+                await self._rollup_task
+            except asyncio.CancelledError:
+                pass
+            self._rollup_task = None
+        if dao is not None:
+            await self.rollup(dao)
+
+
+# 进程内共享的实例，所有 ModelRouter 默认记录到这里
+default_accounting = LLMAccounting()
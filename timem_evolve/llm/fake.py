@@ -0,0 +1,263 @@
+"""确定性的本地假模型 - 用于离线基准测试和 CI"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+from typing import Callable, List, Optional, Tuple, Union
+from langchain_core.messages import AIMessage
+
+from .tokens import estimate_tokens
+
+
+CannedResponse = Union[str, Callable[[str], str]]
+
+
+class LatencyDistribution:
+    """模拟的调用延迟分布（单位：毫秒）
+
+    - constant: 固定为 mean_ms
+    - uniform: [mean_ms - spread, mean_ms + spread] 均匀分布
+    - normal: 均值 mean_ms、标准差 spread 的正态分布（截断到 0 以上）
+    - lognormal: 中位数 mean_ms、对数标准差 spread 的对数正态分布（长尾）
+
+    另外可以按 spike_rate 的概率注入 spike_ms 的延迟尖刺，模拟卡住的请求。
+    """
+
+    KINDS = ("constant", "uniform", "normal", "lognormal")
+
+    def __init__(
+        self,
+        kind: str = "constant",
+        mean_ms: float = 0.0,
+        spread: float = 0.0,
+        spike_rate: float = 0.0,
+        spike_ms: float = 0.0
+    ):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown latency distribution: {kind}")
+        self.kind = kind
+        self.mean_ms = mean_ms
+        self.spread = spread
+        self.spike_rate = spike_rate
+        self.spike_ms = spike_ms
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        """从 "kind:mean_ms[:spread[:spike_rate:spike_ms]]" 格式解析，
+        例如 "lognormal:800:0.5" 或 "constant:200:0:0.05:30000" """
+        parts = spec.split(":")
+        kind = parts[0] or "constant"
+        values = [float(p) for p in parts[1:]] + [0.0] * 4
+        return cls(kind, *values[:4])
+
+    def sample(self, rng: random.Random) -> float:
+        """采样一次延迟（秒）"""
+        if self.kind == "constant":
+            ms = self.mean_ms
+        elif self.kind == "uniform":
+            ms = rng.uniform(self.mean_ms - self.spread, self.mean_ms + self.spread)
+        elif self.kind == "normal":
+            ms = rng.gauss(self.mean_ms, self.spread)
+        else:
+            ms = self.mean_ms * rng.lognormvariate(0.0, self.spread) if self.mean_ms > 0 else 0.0
+        if self.spike_rate and rng.random() < self.spike_rate:
+            ms += self.spike_ms
+        return max(ms, 0.0) / 1000
+
+
+def _stable_fraction(text: str) -> float:
+    """根据文本内容得到 [0, 1) 区间内稳定的伪随机数"""
+    digest = hashlib.md5(text.encode("utf-8")).hexdigest()
+    return int(digest[:8], 16) / 0x100000000
+
+
+def _json_block(data) -> str:
+    return f"```json\n{json.dumps(data, indent=2, ensure_ascii=False)}\n```"
+
+
+CANNED_SKILL = {
+    "name": "分步定位问题",
+    "description": "先复现问题，再逐步缩小范围并验证修复。",
+    "steps": ["复现问题", "缩小范围", "验证修复"],
+    "sop": "先确认问题可以稳定复现，然后通过日志和二分法缩小范围，修复后回归验证。",
+    "confidence": 0.8
+}
+
+CANNED_RULE = {
+    "name": "回答前确认需求",
+    "description": "在信息不足时先澄清需求，而不是直接给出结论。",
+    "constraint": "避免在缺少关键信息时直接给出确定性的答案。",
+    "reason": "缺少上下文的回答容易偏离用户真实需求。",
+    "confidence": 0.8
+}
+
+
+def _multi_turn_response(prompt: str) -> str:
+    """为多轮反馈提示词逐轮生成技能或规则"""
+    items = []
+    for number, label in re.findall(r"轮次 (\d+)（(好评|差评)）", prompt):
+        if label == "好评":
+            items.append({"turn": int(number), "type": "skill", **CANNED_SKILL})
+        else:
+            items.append({"turn": int(number), "type": "rule", **CANNED_RULE})
+    return _json_block({"items": items})
+
+
+def _batch_response(prompt: str) -> str:
+    """为跨会话批量提炼提示词逐条生成技能或规则"""
+    items = []
+    for number, label in re.findall(r"条目 (\d+)（(好评|差评)", prompt):
+        if label == "好评":
+            items.append({"item": int(number), "type": "skill", **CANNED_SKILL})
+        else:
+            items.append({"item": int(number), "type": "rule", **CANNED_RULE})
+    return _json_block(items)
+
+
+_CURRICULUM_ACTIONS = ["实现", "调试", "重构", "测试", "优化"]
+_CURRICULUM_TOPICS = [
+    "快速排序", "二分查找", "LRU 缓存", "JSON 解析器", "日期格式化", "CSV 导入",
+    "令牌桶限流器", "重试装饰器", "字符串压缩", "矩阵转置", "最短路径", "布隆过滤器",
+    "配置文件合并", "日志轮转", "分页查询", "事件去抖",
+]
+_CURRICULUM_GOALS = ["处理空输入和超大输入", "补充单元测试", "说明时间复杂度", "兼容旧接口", "给出错误提示"]
+
+
+def _curriculum_response(prompt: str) -> str:
+    """为批量生成任务的提示词按难度配额生成互不相同的任务"""
+    offset = int(_stable_fraction(prompt) * 1000)
+    tasks = []
+    for level, count in re.findall(r"- (easy|medium|hard): (\d+) 个", prompt):
+        for _ in range(int(count)):
+            i = offset + len(tasks)
+            topic = _CURRICULUM_TOPICS[i % len(_CURRICULUM_TOPICS)]
+            action = _CURRICULUM_ACTIONS[(i // len(_CURRICULUM_TOPICS)) % len(_CURRICULUM_ACTIONS)]
+            goal = _CURRICULUM_GOALS[i % len(_CURRICULUM_GOALS)]
+            tasks.append({"task_description": f"{action}{topic}，并{goal}", "difficulty": level})
+    return _json_block(tasks)
+
+
+class FakeProviderError(Exception):
+    """假模型注入的提供方错误"""
+
+
+class FakeChatModel:
+    """
+    确定性的本地聊天模型。
+
+    根据提示词中的标记返回预设的结构化输出，不访问网络。相同提示词总是得到
+    相同的回复；延迟按配置的分布采样（给定 seed 时序列可复现）。
+
+    Args:
+        model_name: 模型名称（写入响应元数据）
+        latency: 延迟分布，默认无延迟
+        seed: 延迟采样的随机种子
+        success_rate: 成功/失败判定类提示词返回“成功”的比例
+        error_rate: 调用抛出 FakeProviderError 的概率，模拟提供方故障
+        responses: 额外的 (标记, 回复) 列表，优先于内置规则匹配；
+            回复可以是字符串，也可以是接收提示词返回字符串的函数
+    """
+
+    def __init__(
+        self,
+        model_name: str = "fake",
+        latency: Optional[LatencyDistribution] = None,
+        seed: int = 0,
+        success_rate: float = 0.7,
+        error_rate: float = 0.0,
+        responses: Optional[List[Tuple[str, CannedResponse]]] = None
+    ):
+        self.model_name = model_name
+        self.latency = latency or LatencyDistribution()
+        self.success_rate = success_rate
+        self.error_rate = error_rate
+        self.responses = list(responses or [])
+        self._rng = random.Random(seed)
+
+        # 统计：用于从端到端耗时中扣除模拟的提供方延迟
+        self.calls = 0
+        self.errors = 0
+        self.simulated_latency = 0.0
+
+    async def ainvoke(self, messages, config=None, **kwargs) -> AIMessage:
+        """异步调用"""
+        prompt = self._prompt_text(messages)
+        delay = self.latency.sample(self._rng)
+        self.calls += 1
+        self.simulated_latency += delay
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.error_rate and self._rng.random() < self.error_rate:
+            self.errors += 1
+            raise FakeProviderError("simulated provider error")
+
+        content = self._respond(prompt)
+        input_tokens = estimate_tokens(prompt)
+        output_tokens = estimate_tokens(content)
+        return AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": input_tokens + output_tokens,
+            },
+            response_metadata={"model_name": self.model_name},
+        )
+
+    def _prompt_text(self, messages) -> str:
+        if isinstance(messages, str):
+            return messages
+        return "\n".join(getattr(m, "content", str(m)) for m in messages)
+
+    def _is_success(self, prompt: str) -> bool:
+        return _stable_fraction(prompt) < self.success_rate
+
+    def _respond(self, prompt: str) -> str:
+        for marker, response in self.responses:
+            if marker in prompt:
+                return response(prompt) if callable(response) else response
+
+        # 内置规则：更具体的标记放在前面
+        if "一次性完成" in prompt:
+            success = self._is_success(prompt)
+            return _json_block({
+                "task_type": "代码调试",
+                "is_successful": success,
+                "key_insights": "- 先复现问题\n- 缩小范围后再修改",
+                "skill": CANNED_SKILL if success else None,
+                "rule": None if success else CANNED_RULE,
+            })
+        if '返回 "success" 或 "failure"' in prompt:
+            return "success" if self._is_success(prompt) else "failure"
+        if "批量生成一组" in prompt:
+            return _curriculum_response(prompt)
+        if "可执行的任务描述" in prompt:
+            index = int(_stable_fraction(prompt) * 1000)
+            return _json_block({
+                "task_description": f"编写一个函数处理输入数据并覆盖边界条件（练习 {index}）",
+                "difficulty": ["easy", "medium", "hard"][index % 3],
+            })
+        if "同时提炼" in prompt:
+            success = self._is_success(prompt)
+            return _json_block({
+                "skills": [CANNED_SKILL],
+                "rules": [] if success else [CANNED_RULE],
+            })
+        if "批量提炼" in prompt:
+            return _batch_response(prompt)
+        if "被评价的轮次" in prompt:
+            return _multi_turn_response(prompt)
+        if "滚动摘要" in prompt:
+            return "用户提出了问题，助手逐步给出了分析和建议。"
+        if '"成功" 或 "失败"' in prompt:
+            return "成功" if self._is_success(prompt) else "失败"
+        if "识别任务类型" in prompt:
+            return "代码调试"
+        if "可复用的技能" in prompt:
+            return _json_block(CANNED_SKILL)
+        if "约束规则" in prompt:
+            return _json_block(CANNED_RULE)
+        if "提取" in prompt:
+            return "- 关键步骤清晰\n- 及时验证结果"
+        return "这是一个模拟的回复。"
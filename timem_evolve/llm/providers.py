@@ -0,0 +1,68 @@
+"""LLM 提供方注册表 - 按配置和环境变量选择模型实现"""
+import os
+from typing import Any, Callable, Dict, Optional
+from langchain_openai import ChatOpenAI
+
+from .fake import FakeChatModel, LatencyDistribution
+
+
+DEFAULT_MODEL_NAME = "gpt-4.1-mini"
+
+# 提供方名称 -> 工厂函数 factory(model_name, temperature, **kwargs)
+_PROVIDERS: Dict[str, Callable[..., Any]] = {}
+
+
+def register_provider(name: str, factory: Callable[..., Any]) -> None:
+    """注册 LLM 提供方
+    
+    Args:
+        name: 提供方名称，通过 LLM_PROVIDER 环境变量或 provider 参数选择
+        factory: 工厂函数，签名为 factory(model_name, temperature, **kwargs)，
+            返回带有 ainvoke(messages) 方法的聊天模型
+    """
+    _PROVIDERS[name] = factory
+
+
+def list_providers() -> list:
+    """列出已注册的提供方"""
+    return sorted(_PROVIDERS)
+
+
+def create_llm(
+    model_name: Optional[str] = None,
+    temperature: float = 0.7,
+    provider: Optional[str] = None,
+    **kwargs
+) -> Any:
+    """创建聊天模型
+    
+    Args:
+        model_name: 模型名称，默认读取 LLM_MODEL_NAME 环境变量
+        temperature: 采样温度
+        provider: 提供方名称，默认读取 LLM_PROVIDER 环境变量（openai）
+    """
+    provider = provider or os.environ.get("LLM_PROVIDER", "openai")
+    model_name = model_name or os.environ.get("LLM_MODEL_NAME", DEFAULT_MODEL_NAME)
+    
+    factory = _PROVIDERS.get(provider)
+    if factory is None:
+        raise ValueError(f"Unknown LLM provider: {provider}. Available: {', '.join(list_providers())}")
+    return factory(model_name, temperature, **kwargs)
+
+
+def _create_openai(model_name: str, temperature: float, **kwargs) -> ChatOpenAI:
+    return ChatOpenAI(model=model_name, temperature=temperature, **kwargs)
+
+
+def _create_fake(model_name: str, temperature: float, **kwargs) -> FakeChatModel:
+    # 延迟分布可通过环境变量配置，例如 FAKE_LLM_LATENCY="lognormal:800:0.5"
+    latency = kwargs.pop("latency", None) or LatencyDistribution.parse(
+        os.environ.get("FAKE_LLM_LATENCY", "constant:0")
+    )
+    seed = int(kwargs.pop("seed", os.environ.get("FAKE_LLM_SEED", "0")))
+    kwargs.setdefault("error_rate", float(os.environ.get("FAKE_LLM_ERROR_RATE", "0")))
+    return FakeChatModel(model_name=model_name, latency=latency, seed=seed, **kwargs)
+
+
+register_provider("openai", _create_openai)
+register_provider("fake", _create_fake)
@@ -0,0 +1,261 @@
+"""LLM 调用的超时、对冲请求和熔断"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Union
+
+
+class LLMUnavailableError(Exception):
+    """LLM 暂时不可用（超时或熔断），调用方可以降级处理或稍后重试"""
+
+
+class LLMTimeoutError(LLMUnavailableError):
+    """LLM 调用超过截止时间"""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """熔断器处于打开状态，调用被直接拒绝"""
+
+
+class LatencyTracker:
+    """最近若干次调用的延迟，用于计算对冲请求的触发延迟"""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """q 分位数（0-1），没有样本时返回 None"""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = min(int(q * len(ordered)), len(ordered) - 1)
+        return ordered[index]
+
+
+class CircuitBreaker:
+    """
+    基于错误率的熔断器。
+
+    最近 window 次调用中失败比例达到 failure_rate（且至少有 min_calls 次调用）时
+    打开熔断，reset_seconds 内的调用直接抛出 CircuitOpenError；之后进入半开状态，
+    放行一次试探调用，成功则关闭，失败则重新打开。
+
+    Args:
+        failure_rate: 触发熔断的错误率
+        window: 统计的最近调用次数
+        min_calls: 触发熔断所需的最少调用次数
+        reset_seconds: 熔断打开后多久尝试恢复
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate: float = 0.5,
+        window: int = 20,
+        min_calls: int = 5,
+        reset_seconds: float = 30.0
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.reset_seconds = reset_seconds
+        self._results: Deque[bool] = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+
+        # 统计
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    def before_call(self) -> None:
+        """调用前检查，熔断打开时抛出 CircuitOpenError"""
+        state = self.state
+        if state == self.OPEN or (state == self.HALF_OPEN and self._probing):
+            self.rejected += 1
+            raise CircuitOpenError("LLM circuit breaker is open")
+        if state == self.HALF_OPEN:
+            self._probing = True
+
+    def release_probe(self) -> None:
+        """试探调用既未成功也未失败（例如被取消）时释放，让下一次调用重新试探"""
+        if self._state == self.HALF_OPEN:
+            self._probing = False
+
+    def record_success(self) -> None:
+        self._results.append(True)
+        if self._state == self.HALF_OPEN:
+            self._state = self.CLOSED
+            self._results.clear()
+
+    def record_failure(self) -> None:
+        self._results.append(False)
+        if self._state == self.HALF_OPEN:
+            self._open()
+            return
+        failures = self._results.count(False)
+        if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_rate:
+            self._open()
+
+    def _open(self) -> None:
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self.opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
+
+
+HedgeSetting = Union[None, float, str]
+
+
+def _parse_hedge(value: Optional[str]) -> HedgeSetting:
+    """LLM_HEDGE_AFTER: 空/0 关闭，"p95" 等分位数，或固定秒数"""
+    if not value or value == "0":
+        return None
+    if value.startswith("p"):
+        return value
+    return float(value)
+
+
+class ResilientCaller:
+    """
+    为单个模型的调用加上截止时间、对冲请求和熔断。
+
+    - timeout: 每次调用（包括对冲请求）的总截止时间，超时抛出 LLMTimeoutError
+    - hedge_after: 主请求超过该延迟仍未返回时再发一个相同请求，取先返回的结果；
+      可以是固定秒数，或 "p95" 这样的分位数（按最近的调用延迟计算，样本不足
+      min_hedge_samples 时不对冲）
+    - breaker: 熔断器，超时和异常都计为失败
+
+    Args:
+        timeout: 截止时间（秒），None 表示不限
+        hedge_after: 对冲延迟
+        breaker: 熔断器，None 表示不熔断
+        min_hedge_samples: 使用分位数对冲时所需的最少样本数
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = None,
+        hedge_after: HedgeSetting = None,
+        breaker: Optional[CircuitBreaker] = None,
+        min_hedge_samples: int = 20
+    ):
+        self.timeout = timeout
+        self.hedge_after = hedge_after
+        self.breaker = breaker
+        self.min_hedge_samples = min_hedge_samples
+        self.latency = LatencyTracker()
+
+        # 统计
+        self.timeouts = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    @classmethod
+    def from_env(cls) -> "ResilientCaller":
+        """从环境变量创建：LLM_TIMEOUT_SECONDS、LLM_HEDGE_AFTER、LLM_CIRCUIT_FAILURE_RATE"""
+        timeout = float(os.environ.get("LLM_TIMEOUT_SECONDS", "60"))
+        failure_rate = float(os.environ.get("LLM_CIRCUIT_FAILURE_RATE", "0.5"))
+        return cls(
+            timeout=timeout or None,
+            hedge_after=_parse_hedge(os.environ.get("LLM_HEDGE_AFTER")),
+            breaker=CircuitBreaker(
+                failure_rate=failure_rate,
+                reset_seconds=float(os.environ.get("LLM_CIRCUIT_RESET_SECONDS", "30"))
+            ) if failure_rate > 0 else None,
+        )
+
+    def hedge_delay(self) -> Optional[float]:
+        """当前的对冲延迟（秒），None 表示不对冲"""
+        if self.hedge_after is None:
+            return None
+        if isinstance(self.hedge_after, str):
+            if len(self.latency) < self.min_hedge_samples:
+                return None
+            return self.latency.percentile(int(self.hedge_after[1:]) / 100)
+        return self.hedge_after
+
+    async def call(self, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        """执行 fn（每次调用都应发出一个新请求），timeout 覆盖默认截止时间"""
+        if self.breaker:
+            self.breaker.before_call()
+
+        deadline = timeout if timeout is not None else self.timeout
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._hedged(fn), deadline)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            if self.breaker:
+                self.breaker.record_failure()
+            raise LLMTimeoutError(f"LLM call exceeded {deadline}s deadline")
+        except Exception:
+            if self.breaker:
+                self.breaker.record_failure()
+            raise
+        except BaseException:
+            # 被取消：不计为失败，但不能让半开状态一直卡在"试探中"而拒绝所有调用
+            if self.breaker:
+                self.breaker.release_probe()
+            raise
+
+        self.latency.add(time.perf_counter() - start)
+        if self.breaker:
+            self.breaker.record_success()
+        return result
+
+    async def _hedged(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        delay = self.hedge_delay()
+        primary = asyncio.ensure_future(fn())
+        if delay is None:
+            return await primary
+
+        tasks = [primary]
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                self.hedged += 1
+                tasks.append(asyncio.ensure_future(fn()))
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+
+            winner = done.pop()
+            if winner.exception() is not None and len(tasks) > 1:
+                # 先返回的请求失败时等待另一个请求
+                other = tasks[1] if winner is primary else primary
+                winner = other if other.done() else (await asyncio.wait([other]))[0].pop()
+            if winner is not primary:
+                self.hedge_wins += 1
+            return winner.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        p95 = self.latency.percentile(0.95)
+        return {
+            "timeouts": self.timeouts,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "p95_ms": round(p95 * 1000, 2) if p95 is not None else None,
+            "breaker": self.breaker.stats() if self.breaker else None,
+        }
@@ -0,0 +1,269 @@
+"""按节点路由的 LLM 调用层 - 为不同图节点选择不同档位的模型"""
+import json
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .providers import create_llm
+from .singleflight import SingleFlight, default_singleflight, request_key
+from .resilience import ResilientCaller
+from .accounting import LLMAccounting, default_accounting
+from .tokens import estimate_tokens
+from ..observability import span, current_span
+
+
+# 简单分类节点默认使用的小模型
+CHEAP_MODEL_NAME = os.environ.get("LLM_CHEAP_MODEL_NAME", "gpt-4.1-nano")
+
+# 是否合并并发的相同请求（默认开启）
+SINGLEFLIGHT_ENABLED = os.environ.get("LLM_SINGLEFLIGHT", "1") != "0"
+
+
+def _load_node_overrides() -> Dict[str, str]:
+    """从 LLM_NODE_MODELS 环境变量读取节点模型配置（JSON 对象）
+
+    键可以是 "节点名" 或 "服务名.节点名"，例如:
+        LLM_NODE_MODELS='{"analyzer.identify_task": "gpt-4.1-mini"}'
+    """
+    raw = os.environ.get("LLM_NODE_MODELS")
+    if not raw:
+        return {}
+    return json.loads(raw)
+
+
+class NodeStats:
+    """单个节点的调用统计"""
+
+    def __init__(self):
+        self.calls = 0
+        self.escalations = 0
+        self.deduplicated = 0
+        self.latency_total = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost_usd = 0.0
+        self.model_calls: Dict[str, int] = {}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "escalations": self.escalations,
+            "deduplicated": self.deduplicated,
+            "avg_latency_ms": round(self.latency_total / self.calls * 1000, 2) if self.calls else 0.0,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+            "model_calls": dict(self.model_calls),
+        }
+
+
+class ModelRouter:
+    """
+    按节点选择模型的 LLM 调用入口。
+
+    每个节点可以配置一个更便宜/更快的模型。调用时若提供 validator，
+    便宜模型的回答未通过校验会自动升级到默认模型重试。
+
+    每个模型的调用经过一个 ResilientCaller（截止时间、对冲请求、熔断），
+    默认配置来自 LLM_TIMEOUT_SECONDS / LLM_HEDGE_AFTER / LLM_CIRCUIT_* 环境变量；
+    超时或熔断时抛出 LLMUnavailableError 的子类。
+
+    Args:
+        service: 服务名称（用于统计和配置键）
+        model_name: 默认模型
+        temperature: 采样温度
+        provider: LLM 提供方
+        node_models: 节点名 -> 模型名，会被 LLM_NODE_MODELS 环境变量覆盖
+        singleflight: 并发相同请求的合并层，默认使用进程内共享实例；
+            LLM_SINGLEFLIGHT=0 时关闭
+        accounting: 调用记账，默认使用进程内共享实例
+    """
+
+    def __init__(
+        self,
+        service: str,
+        model_name: Optional[str] = None,
+        temperature: float = 0.7,
+        provider: Optional[str] = None,
+        node_models: Optional[Dict[str, str]] = None,
+        singleflight: Optional[SingleFlight] = None,
+        accounting: Optional[LLMAccounting] = None
+    ):
+        self.service = service
+        self.temperature = temperature
+        self.provider = provider
+        self.default_model = model_name or os.environ.get("LLM_MODEL_NAME", "gpt-4.1-mini")
+
+        self.node_models = dict(node_models or {})
+        for key, value in _load_node_overrides().items():
+            prefix, _, node = key.rpartition(".")
+            if not prefix or prefix == service:
+                self.node_models[node] = value
+
+        self._models: Dict[str, Any] = {}
+        # 通过 use() 注入的模型：模型名 -> 合并键中代替提供方名称的标识
+        self._injected: Dict[str, str] = {}
+        self._stats: Dict[str, NodeStats] = {}
+        self._callers: Dict[str, ResilientCaller] = {}
+        self.singleflight = singleflight or (default_singleflight if SINGLEFLIGHT_ENABLED else None)
+        self.accounting = accounting or default_accounting
+
+    def use(self, llm: Any, model_name: Optional[str] = None) -> None:
+        """为指定模型名注入聊天模型实例（默认替换默认模型），用于测试和基准"""
+        model_name = model_name or self.default_model
+        self._models[model_name] = llm
+        self._injected[model_name] = f"{type(llm).__name__}@{id(llm):x}"
+
+    def get_model(self, model_name: Optional[str] = None) -> Any:
+        """获取（必要时创建）指定模型的实例"""
+        model_name = model_name or self.default_model
+        if model_name not in self._models:
+            self._models[model_name] = create_llm(
+                model_name, temperature=self.temperature, provider=self.provider
+            )
+        return self._models[model_name]
+
+    def caller_for(self, model_name: str) -> ResilientCaller:
+        """获取（必要时创建）指定模型的超时/对冲/熔断配置"""
+        if model_name not in self._callers:
+            self._callers[model_name] = ResilientCaller.from_env()
+        return self._callers[model_name]
+
+    def set_caller(self, model_name: str, caller: ResilientCaller) -> None:
+        """替换指定模型的超时/对冲/熔断配置"""
+        self._callers[model_name] = caller
+
+    def model_for(self, node: Optional[str]) -> str:
+        """节点实际使用的模型名"""
+        return self.node_models.get(node, self.default_model) if node else self.default_model
+
+    async def ainvoke(
+        self,
+        messages,
+        node: Optional[str] = None,
+        validator: Optional[Callable[[str], bool]] = None,
+        timeout: Optional[float] = None
+    ):
+        """调用 LLM
+
+        Args:
+            messages: 消息列表
+            node: 图节点名称，决定使用的模型并用于统计
+            validator: 校验回复内容的函数；便宜模型的回复未通过时升级到默认模型
+            timeout: 本次调用的截止时间（秒），默认使用模型的配置
+        """
+        model_name = self.model_for(node)
+        response = await self._call(node, model_name, messages, timeout)
+
+        if (
+            validator is not None
+            and model_name != self.default_model
+            and not validator(response.content)
+        ):
+            self._node_stats(node).escalations += 1
+            response = await self._call(node, self.default_model, messages, timeout)
+
+        return response
+
+    async def _call(self, node: Optional[str], model_name: str, messages, timeout: Optional[float] = None):
+        with span(f"llm.{self.service}.{node or 'default'}", model=model_name) as current:
+            if self.singleflight is None:
+                return await self._invoke(node, model_name, messages, timeout)
+
+            # 同一提供方、同一模型的相同请求在不同路由器（不同服务）之间也会合并；
+            # 通过 use() 注入的模型实例（测试/基准）各自独立，不与其他实例合并
+            source = self._injected.get(model_name) or self.provider or os.environ.get("LLM_PROVIDER", "openai")
+            key = f"{source}:{request_key(model_name, self.temperature, messages)}"
+            if not self.singleflight.is_inflight(key):
+                return await self.singleflight.do(key, lambda: self._invoke(node, model_name, messages, timeout))
+
+            current.set_attribute("deduplicated", True)
+            return await self._join_inflight(key, node, model_name, messages, timeout)
+
+    async def _join_inflight(self, key: str, node: Optional[str], model_name: str, messages, timeout: Optional[float]):
+        """合并到进行中的相同请求：记为缓存命中，不计成本"""
+        self._node_stats(node).deduplicated += 1
+        start = time.perf_counter()
+        response = await self.singleflight.do(key, lambda: self._invoke(node, model_name, messages, timeout))
+        self.accounting.record(
+            self.service, node, model_name, latency=time.perf_counter() - start, cache_hit=True
+        )
+        return response
+
+    async def _invoke(self, node: Optional[str], model_name: str, messages, timeout: Optional[float] = None):
+        llm = self.get_model(model_name)
+        start = time.perf_counter()
+        try:
+            response = await self.caller_for(model_name).call(lambda: llm.ainvoke(messages), timeout=timeout)
+        except Exception as e:
+            self.accounting.record(
+                self.service, node, model_name,
+                latency=time.perf_counter() - start, error=type(e).__name__
+            )
+            raise
+        elapsed = time.perf_counter() - start
+        self._record(node, model_name, messages, response, elapsed)
+        return response
+
+    def _node_stats(self, node: Optional[str]) -> NodeStats:
+        key = node or "default"
+        if key not in self._stats:
+            self._stats[key] = NodeStats()
+        return self._stats[key]
+
+    def _record(self, node: Optional[str], model_name: str, messages, response, elapsed: float) -> None:
+        usage = getattr(response, "usage_metadata", None) or {}
+        if isinstance(usage, dict) and usage.get("input_tokens") is not None:
+            prompt_tokens = usage.get("input_tokens", 0)
+            completion_tokens = usage.get("output_tokens", 0)
+        else:
+            prompt_tokens = sum(estimate_tokens(getattr(m, "content", "")) for m in messages)
+            completion_tokens = estimate_tokens(str(getattr(response, "content", "")))
+
+        current = current_span()
+        current.set_attribute("prompt_tokens", prompt_tokens)
+        current.set_attribute("completion_tokens", completion_tokens)
+
+        stats = self._node_stats(node)
+        stats.calls += 1
+        stats.latency_total += elapsed
+        stats.prompt_tokens += prompt_tokens
+        stats.completion_tokens += completion_tokens
+        stats.model_calls[model_name] = stats.model_calls.get(model_name, 0) + 1
+        record = self.accounting.record(
+            self.service, node, model_name, prompt_tokens, completion_tokens, elapsed
+        )
+        stats.cost_usd += record.cost_usd
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各节点的调用次数、升级次数、合并次数、平均延迟和估算成本"""
+        return {node: stats.to_dict() for node, stats in self._stats.items()}
+
+    def resilience_stats(self) -> Dict[str, Dict[str, Any]]:
+        """各模型的超时、对冲和熔断统计"""
+        return {model_name: caller.stats() for model_name, caller in self._callers.items()}
+
+
+# ==================== 常用校验函数 ====================
+
+def is_short_label(max_length: int = 30) -> Callable[[str], bool]:
+    """回复应为非空的单行短标签"""
+    def validate(content: str) -> bool:
+        text = content.strip()
+        return bool(text) and "\n" not in text and len(text) <= max_length
+    return validate
+
+
+def contains_any(*choices: str) -> Callable[[str], bool]:
+    """回复应包含给定选项之一"""
+    def validate(content: str) -> bool:
+        return any(choice in content for choice in choices)
+    return validate
+
+
+def is_one_of(*choices: str) -> Callable[[str], bool]:
+    """回复（去除空白、忽略大小写）应恰好为给定选项之一"""
+    normalized = {choice.lower() for choice in choices}
+    def validate(content: str) -> bool:
+        return content.strip().lower() in normalized
+    return validate
@@ -0,0 +1,80 @@
+"""相同请求合并 - 并发的相同 LLM 请求只发送一次"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict
+
+
+def request_key(model_name: str, temperature: float, messages) -> str:
+    """按模型、温度和消息内容计算请求键"""
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "temperature": temperature,
+            "messages": [
+                [getattr(m, "type", type(m).__name__), getattr(m, "content", str(m))]
+                for m in messages
+            ],
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SingleFlight:
+    """
+    进行中请求的合并层。
+
+    同一个键在第一次调用完成之前再次到达时，不会发起新的调用，而是等待同一个
+    结果（包括异常）。调用完成后键即被移除，之后的相同请求会重新调用——这里只
+    合并"同时进行"的请求，不做结果缓存，可以和任意缓存层叠加使用。
+
+    实际调用运行在独立的任务中，发起调用的协程被取消时，其他等待者不受影响。
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        # 统计
+        self.calls = 0
+        self.deduplicated = 0
+
+    @property
+    def inflight_count(self) -> int:
+        """进行中的不同请求数"""
+        return len(self._inflight)
+
+    def is_inflight(self, key: str) -> bool:
+        """该键的调用是否正在进行（此时 do 会直接等待已有结果）"""
+        return key in self._inflight
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """执行 fn，若相同 key 的调用正在进行则等待其结果"""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(future)
+
+        self.calls += 1
+        future = asyncio.ensure_future(fn())
+        self._inflight[key] = future
+        future.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        # 所有等待者都已取消时没有人读取异常，在这里读取，避免 "exception was never retrieved"
+        if not future.cancelled():
+            future.exception()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "deduplicated": self.deduplicated,
+            "inflight": self.inflight_count,
+        }
+
+
+# 进程内共享的实例：不同服务（例如 /learn/session 和批量任务）发出的相同请求也会被合并
+default_singleflight = SingleFlight()
@@ -0,0 +1,15 @@
+"""token 数估算 - 本地按字符类别估算，无需调用分词器"""
+import re
+
+
+# CJK 字符（中日韩文字及全角符号）大约 1 字 1 token，其余文本大约 4 字符 1 token
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """本地估算文本的 token 数（无需调用分词器）"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
@@ -0,0 +1,3 @@
+"""数据模型"""
+from .models import *
+from .models import __all__
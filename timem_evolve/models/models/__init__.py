@@ -3,7 +3,8 @@ from .session import Session, SessionCreate, Message
 from .skill import Skill, Workflow
 from .rule import Rule
 from .feedback import Feedback, FeedbackCreate
-from .coach import CoachTask, CoachTaskCreate, CoachState
+from .coach import CoachTask, CoachTaskCreate, CoachCurriculumRequest, CoachState, CoachBatchRequest, CoachBatchResult, CoachJob
+from .analysis import AnalysisResult, AnalyzeRequest, LearnedArtifacts
 
 __all__ = [
     "Session",
@@ -16,5 +17,12 @@ __all__ = [
     "FeedbackCreate",
     "CoachTask",
     "CoachTaskCreate",
+    "CoachCurriculumRequest",
     "CoachState",
+    "CoachBatchRequest",
+    "CoachBatchResult",
+    "CoachJob",
+    "AnalysisResult",
+    "AnalyzeRequest",
+    "LearnedArtifacts",
 ]
@@ -0,0 +1,41 @@
+"""会话分析结果数据模型"""
+from datetime import datetime
+from typing import List, Optional, Literal
+from pydantic import BaseModel, Field
+
+from .skill import Skill
+from .rule import Rule
+
+
+class AnalysisResult(BaseModel):
+    """AnalyzerService 对单个会话的分析结果"""
+    session_id: str = Field(..., description="会话ID")
+    content_hash: str = Field(..., description="会话内容哈希，内容不变时复用已保存的结果")
+    mode: str = Field("sequential", description="分析模式")
+    task_type: str = ""
+    is_successful: bool = False
+    key_insights: str = ""
+    reflection: str = Field("", description="技能或规则的 JSON 总结")
+    error: str = ""
+    cached: bool = Field(False, description="是否直接返回了已保存的结果")
+    created_at: datetime = Field(default_factory=datetime.now)
+    
+    class Config:
+        json_encoders = {
+            datetime: lambda v: v.isoformat()
+        }
+
+
+class AnalyzeRequest(BaseModel):
+    """批量分析会话的请求模型"""
+    session_ids: List[str]
+    mode: Optional[Literal["sequential", "parallel", "single_shot"]] = None
+    concurrency: int = Field(4, ge=1, le=32, description="最大并发分析数")
+    force: bool = Field(False, description="忽略已保存的结果，重新分析")
+
+
+class LearnedArtifacts(BaseModel):
+    """一次会话提炼得到的全部技能和规则"""
+    session_id: str = Field(..., description="会话ID")
+    skills: List[Skill] = Field(default_factory=list, description="提炼出的技能（可为空）")
+    rules: List[Rule] = Field(default_factory=list, description="提炼出的规则（可为空）")
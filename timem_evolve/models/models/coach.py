@@ -1,6 +1,6 @@
 """Coach 模块数据模型"""
 from datetime import datetime
-from typing import List, Dict, Any, Literal
+from typing import List, Dict, Any, Literal, Optional
 from pydantic import BaseModel, Field
 import uuid
 
@@ -42,6 +42,15 @@ class CoachTaskCreate(BaseModel):
     difficulty: Literal["easy", "medium", "hard"] = "medium"
 
 
+class CoachCurriculumRequest(BaseModel):
+    """批量生成 Coach 任务（课程）的请求模型"""
+    business_goal: str
+    n: int = Field(20, ge=1, le=1000, description="要生成的任务数")
+    difficulty_mix: Optional[Dict[Literal["easy", "medium", "hard"], float]] = Field(
+        None, description="各难度的比例，默认 easy 0.3 / medium 0.5 / hard 0.2"
+    )
+
+
 class CoachState(BaseModel):
     """Coach 模块的整体状态"""
     total_tasks: int = 0
@@ -56,3 +65,37 @@ class CoachState(BaseModel):
         json_encoders = {
             datetime: lambda v: v.isoformat()
         }
+
+
+class CoachBatchRequest(BaseModel):
+    """批量运行 Coach 任务的请求模型"""
+    task_ids: Optional[List[str]] = Field(None, description="要运行的任务，默认所有状态为 status 的任务")
+    status: Literal["pending", "failed"] = Field("pending", description="只运行该状态的任务")
+    limit: Optional[int] = Field(None, ge=1, description="最多运行的任务数")
+
+
+class CoachBatchResult(BaseModel):
+    """批量运行 Coach 任务的结果"""
+    claimed: int = Field(0, description="领取的任务数")
+    completed: int = 0
+    failed: int = 0
+    deferred: int = Field(0, description="LLM 不可用而退回 pending 的任务数")
+    elapsed_seconds: float = 0.0
+    tasks_per_minute: float = Field(0.0, description="每分钟完成的任务数")
+    tasks: List[CoachTask] = Field(default_factory=list)
+
+
+class CoachJob(BaseModel):
+    """后台运行的 Coach 任务（作业）"""
+    job_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    task_id: str = Field(..., description="运行的 Coach 任务ID")
+    status: Literal["queued", "running", "completed", "failed", "cancelled"] = "queued"
+    current_node: Optional[str] = Field(None, description="正在执行的 LangGraph 节点")
+    nodes: Dict[str, Literal["pending", "running", "done", "failed"]] = Field(
+        default_factory=dict, description="各节点的进度"
+    )
+    error: Optional[str] = None
+    task: Optional[CoachTask] = Field(None, description="任务的最新状态")
+    created_at: datetime = Field(default_factory=datetime.now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
@@ -1,6 +1,6 @@
 """会话数据模型"""
 from datetime import datetime
-from typing import List, Dict, Any, Literal
+from typing import List, Dict, Any, Literal, Optional
 from pydantic import BaseModel, Field
 import uuid
 
@@ -18,6 +18,7 @@ class Session(BaseModel):
     task: str = Field(..., description="任务描述")
     messages: List[Message] = Field(default_factory=list)
     outcome: Literal["success", "failure", "unknown"] = "unknown"
+    task_type: Optional[str] = Field(None, description="分析得到的任务类型")
     timestamp: datetime = Field(default_factory=datetime.now)
     metadata: Dict[str, Any] = Field(default_factory=dict)
     
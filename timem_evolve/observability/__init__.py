@@ -0,0 +1,30 @@
+"""可观测性 - 进程内追踪和指标"""
+from .tracing import (
+    Tracer, Span, Trace, JsonLinesExporter, OTLPExporter, TracingMiddleware,
+    default_tracer, span, traced, current_span
+)
+from .metrics import (
+    MetricsRegistry, Counter, Gauge, Histogram, EventLoopLagMonitor, MetricsMiddleware,
+    default_registry, dao_operation
+)
+
+__all__ = [
+    "Tracer",
+    "Span",
+    "Trace",
+    "JsonLinesExporter",
+    "OTLPExporter",
+    "TracingMiddleware",
+    "default_tracer",
+    "span",
+    "traced",
+    "current_span",
+    "MetricsRegistry",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "EventLoopLagMonitor",
+    "MetricsMiddleware",
+    "default_registry",
+    "dao_operation",
+]
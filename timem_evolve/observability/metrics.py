@@ -0,0 +1,360 @@
+"""进程内指标 - 计数器、直方图和仪表，以 Prometheus 文本格式导出"""
+import asyncio
+import functools
+import inspect
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+# 默认的延迟分桶（秒）
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """指标基类：按标签值分组的序列"""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[Any, ...]:
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", *self._samples()]
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}" for key, v in items]
+
+
+class Gauge(_Metric):
+    """
+    可增可减的仪表。
+
+    值可以直接 set()，也可以注册回调在导出时计算（例如存储大小、队列深度），
+    回调返回 标签值元组 -> 值 的字典，没有标签时返回单个数值。
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        self._callback: Optional[Callable[[], Any]] = None
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def set_function(self, callback: Callable[[], Any]) -> None:
+        """导出时调用 callback 获取值"""
+        self._callback = callback
+
+    def _samples(self) -> List[str]:
+        if self._callback is not None:
+            values = self._callback()
+            items = list(values.items()) if isinstance(values, dict) else [((), values)]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(v)}" for key, v in items]
+
+
+class Histogram(_Metric):
+    """按上界分桶的直方图（导出 _bucket / _sum / _count）"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # 标签值 -> [各桶计数..., 超出最大上界的计数, 总和]
+        self._series: Dict[Tuple[Any, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, **labels) -> int:
+        series = self._series.get(self._key(labels))
+        return int(sum(series[:-1])) if series else 0
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                labels = _format_labels(self.label_names, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    指标注册表。
+
+    热路径上的记录只是一次字典查找和几次加法（加锁，DAO 操作可能在线程中执行）。
+    需要 I/O 才能得到的值（存储大小等）通过 add_collector 注册异步回调，只在
+    导出（抓取 /metrics）时计算。
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def _register(self, metric: _Metric) -> Any:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError(f"Metric {metric.name} already registered with a different type or labels")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help, labels, buckets))
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        """注册导出前运行的异步回调（用于刷新需要 I/O 的仪表）"""
+        self._collectors.append(collector)
+
+    async def collect(self) -> str:
+        """运行所有回调后以 Prometheus 文本格式导出"""
+        for collector in self._collectors:
+            await collector()
+        return self.render()
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的注册表
+default_registry = MetricsRegistry()
+
+DAO_OPERATION_SECONDS = default_registry.histogram(
+    "timem_dao_operation_duration_seconds", "MemoryDAO 操作耗时", ["operation"]
+)
+DAO_OPERATION_ERRORS = default_registry.counter(
+    "timem_dao_operation_errors_total", "MemoryDAO 操作异常次数", ["operation"]
+)
+HTTP_REQUEST_SECONDS = default_registry.histogram(
+    "timem_http_request_duration_seconds", "HTTP 请求耗时（按路由模板）", ["method", "route", "status"]
+)
+EVENT_LOOP_LAG_SECONDS = default_registry.histogram(
+    "timem_event_loop_lag_seconds", "事件循环调度延迟",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+EVENT_LOOP_LAG_MAX = default_registry.gauge(
+    "timem_event_loop_lag_max_seconds", "最近一个报告周期内的最大事件循环延迟"
+)
+
+
+def dao_operation(name: str) -> Callable[[Callable], Callable]:
+    """装饰器：记录 DAO 操作的耗时和异常次数"""
+    def decorator(func: Callable) -> Callable:
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except BaseException:
+                    DAO_OPERATION_ERRORS.inc(operation=name)
+                    raise
+                finally:
+                    DAO_OPERATION_SECONDS.observe(time.perf_counter() - start, operation=name)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                DAO_OPERATION_ERRORS.inc(operation=name)
+                raise
+            finally:
+                DAO_OPERATION_SECONDS.observe(time.perf_counter() - start, operation=name)
+        return wrapper
+    return decorator
+
+
+# ==================== 事件循环延迟 ====================
+
+class EventLoopLagMonitor:
+    """
+    事件循环延迟监控。
+
+    每 interval 秒请求一次唤醒，实际唤醒时间与预期的差值就是事件循环被阻塞
+    （同步 I/O、CPU 密集计算）的时长，记录到直方图；max_lag 为当前报告周期内
+    的最大值，每 report_seconds 秒写入仪表后重置。
+
+    Args:
+        interval: 采样间隔（秒）
+        report_seconds: 最大值仪表的刷新周期（秒）
+        histogram: 记录延迟的直方图
+        max_gauge: 记录周期内最大延迟的仪表
+    """
+
+    def __init__(
+        self,
+        interval: float = 0.1,
+        report_seconds: float = 10.0,
+        histogram: Optional[Histogram] = None,
+        max_gauge: Optional[Gauge] = None
+    ):
+        self.interval = interval
+        self.report_seconds = report_seconds
+        self.histogram = histogram if histogram is not None else EVENT_LOOP_LAG_SECONDS
+        self.max_gauge = max_gauge if max_gauge is not None else EVENT_LOOP_LAG_MAX
+        self.samples: List[float] = []
+        self.max_lag = 0.0
+        self.keep_samples = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, keep_samples: bool = False) -> None:
+        """在当前事件循环中开始监控；keep_samples 为 True 时保留每个样本（用于基准）"""
+        if self._task is None or self._task.done():
+            self.keep_samples = keep_samples
+            self.max_gauge.set(0.0)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        report_at = loop.time() + self.report_seconds
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            now = loop.time()
+            lag = max(now - expected, 0.0)
+            self.histogram.observe(lag)
+            if self.keep_samples:
+                self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if now >= report_at:
+                self.max_gauge.set(self.max_lag)
+                self.max_lag = 0.0
+                report_at = now + self.report_seconds
+
+
+# ==================== ASGI ====================
+
+class MetricsMiddleware:
+    """
+    ASGI 指标中间件：按 方法、路由模板、状态码 记录请求耗时。
+
+    路由模板（例如 /sessions/{session_id}）在请求处理后从 scope["route"] 读取，
+    未匹配任何路由的请求记为 "unmatched"，避免标签随路径参数无限增长。
+
+    Args:
+        app: 被包装的 ASGI 应用
+        histogram: 记录请求耗时的直方图
+    """
+
+    def __init__(self, app, histogram: Optional[Histogram] = None):
+        self.app = app
+        self.histogram = histogram if histogram is not None else HTTP_REQUEST_SECONDS
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            self.histogram.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status[0]
+            )
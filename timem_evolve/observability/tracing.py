@@ -0,0 +1,448 @@
+"""进程内追踪 - 通过 contextvar 传播的 span，按根 span 采样，完成的追踪导出为 JSON 或 OTLP"""
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """追踪中的一段操作"""
+
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error", "_start")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self._start = time.perf_counter_ns()
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6 if self.end_ns else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": dict(self.attributes),
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """未采样时返回的 span，忽略所有属性"""
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+class Trace:
+    """一次追踪：根 span 及其所有后代；最后一个 span 结束时完成"""
+
+    __slots__ = ("trace_id", "spans", "open", "dropped")
+
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.open = 0
+        self.dropped = 0
+
+    @property
+    def root(self) -> Span:
+        return self.spans[0]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "name": self.root.name,
+            "duration_ms": round(self.root.duration_ms, 3),
+            "dropped_spans": self.dropped,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+
+NOOP_SPAN = _NoopSpan()
+# 根 span 未被采样：其后代不再重新采样
+_NOT_SAMPLED = object()
+_current: contextvars.ContextVar = contextvars.ContextVar("timem_current_span", default=None)
+
+
+def current_span() -> Union[Span, _NoopSpan]:
+    """当前上下文中的 span（未追踪时返回空操作的 span）"""
+    span = _current.get()
+    return span if isinstance(span, Span) else NOOP_SPAN
+
+
+# ==================== 导出 ====================
+
+class JsonLinesExporter:
+    """把每个完成的追踪作为一行 JSON 追加到文件"""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+
+    def export(self, traces: List[Trace]) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            for trace in traces:
+                f.write(json.dumps(trace.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPExporter:
+    """
+    以 OTLP/HTTP JSON 格式把追踪发送到本地的 OpenTelemetry Collector。
+
+    Args:
+        endpoint: Collector 地址，例如 http://localhost:4318（自动补 /v1/traces）
+        service_name: 上报的 service.name
+        timeout: 单次请求超时（秒）
+    """
+
+    def __init__(self, endpoint: str = "http://localhost:4318", service_name: str = "timem-evolve", timeout: float = 5.0):
+        endpoint = endpoint.rstrip("/")
+        self.url = endpoint if endpoint.endswith("/v1/traces") else f"{endpoint}/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+
+    def payload(self, traces: List[Trace]) -> Dict[str, Any]:
+        spans = []
+        for trace in traces:
+            for span in trace.spans:
+                otlp_span = {
+                    "traceId": trace.trace_id,
+                    "spanId": span.span_id,
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                }
+                if span.parent_id:
+                    otlp_span["parentSpanId"] = span.parent_id
+                spans.append(otlp_span)
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+            "scopeSpans": [{"scope": {"name": "timem_evolve"}, "spans": spans}],
+        }]}
+
+    def export(self, traces: List[Trace]) -> None:
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(self.payload(traces), default=str).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+# ==================== Tracer ====================
+
+class Tracer:
+    """
+    进程内追踪器。
+
+    span() 在当前上下文（contextvar）中开启一个 span，asyncio 任务和
+    asyncio.to_thread 会继承上下文，因此 DAO、LLM 调用和图节点的 span 自动挂到
+    发起它们的请求下。是否采样在根 span 处按 sample_rate 决定，未采样的追踪中
+    所有 span 都是空操作；sample_rate 为 0 时 span() 只多一次 contextvar 读取。
+
+    追踪的最后一个 span 结束后保存到最近追踪的环（最多 max_traces 个），并交给
+    后台线程依次调用各导出器，导出不阻塞事件循环。
+
+    Args:
+        sample_rate: 根 span 的采样率（0-1）
+        exporters: 导出器（带 export(traces) 方法的对象）
+        max_traces: 保留的最近追踪数
+        max_spans_per_trace: 单个追踪的 span 上限，超出的 span 不记录
+    """
+
+    def __init__(
+        self,
+        sample_rate: float = 0.0,
+        exporters: Optional[List[Any]] = None,
+        max_traces: int = 100,
+        max_spans_per_trace: int = 1000
+    ):
+        self.sample_rate = sample_rate
+        self.exporters = list(exporters or [])
+        self.max_traces = max_traces
+        self.max_spans_per_trace = max_spans_per_trace
+        self._recent: "OrderedDict[str, Trace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[Trace]" = queue.Queue()
+        self._worker: Optional[threading.Thread] = None
+        self.sampled = 0
+        self.exported = 0
+        self.export_errors = 0
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        """
+        从环境变量创建：
+        - TRACING_SAMPLE_RATE: 采样率，默认 0（只追踪强制采样的请求）
+        - TRACING_EXPORT: 逗号分隔的导出方式 json / otlp
+        - TRACING_JSON_PATH: json 导出文件，默认 ./data/traces.jsonl
+        - OTEL_EXPORTER_OTLP_ENDPOINT / OTEL_SERVICE_NAME: otlp 导出的地址和服务名
+        """
+        exporters = []
+        for kind in filter(None, (k.strip() for k in os.environ.get("TRACING_EXPORT", "").split(","))):
+            if kind == "json":
+                exporters.append(JsonLinesExporter(os.environ.get("TRACING_JSON_PATH", "./data/traces.jsonl")))
+            elif kind == "otlp":
+                exporters.append(OTLPExporter(
+                    os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "http://localhost:4318"),
+                    service_name=os.environ.get("OTEL_SERVICE_NAME", "timem-evolve")
+                ))
+            else:
+                raise ValueError(f"Unknown TRACING_EXPORT: {kind}")
+        return cls(sample_rate=float(os.environ.get("TRACING_SAMPLE_RATE", "0")), exporters=exporters)
+
+    @contextmanager
+    def span(self, name: str, sampled: Optional[bool] = None, **attributes) -> Iterator[Union[Span, _NoopSpan]]:
+        """
+        开启一个 span。
+
+        Args:
+            name: span 名称，例如 "dao.get_session"
+            sampled: 仅对根 span 有效，True/False 强制采样或不采样，None 时按 sample_rate
+            attributes: span 属性
+        """
+        parent = _current.get()
+        if parent is None:
+            if sampled is None:
+                sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+            if not sampled:
+                if self.sample_rate <= 0:
+                    # 后代 span 同样不会被采样，无需标记
+                    yield NOOP_SPAN
+                    return
+                token = _current.set(_NOT_SAMPLED)
+                try:
+                    yield NOOP_SPAN
+                finally:
+                    _current.reset(token)
+                return
+            trace = Trace()
+            parent_id = None
+        elif parent is _NOT_SAMPLED:
+            yield NOOP_SPAN
+            return
+        else:
+            trace = parent.trace
+            parent_id = parent.span_id
+
+        with self._lock:
+            if len(trace.spans) >= self.max_spans_per_trace:
+                trace.dropped += 1
+                span = None
+            else:
+                span = Span(trace, name, parent_id, attributes)
+                trace.spans.append(span)
+                trace.open += 1
+        if span is None:
+            yield NOOP_SPAN
+            return
+
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self._end(span)
+
+    def traced(self, name: Optional[str] = None, **attributes) -> Callable:
+        """装饰器：在 span 中运行同步或异步函数（默认以函数限定名为 span 名称）"""
+        def decorator(func: Callable) -> Callable:
+            span_name = name or func.__qualname__
+
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    if _current.get() is None and self.sample_rate <= 0:
+                        return await func(*args, **kwargs)
+                    with self.span(span_name, **attributes):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current.get() is None and self.sample_rate <= 0:
+                    return func(*args, **kwargs)
+                with self.span(span_name, **attributes):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def _end(self, span: Span) -> None:
+        span.end_ns = span.start_ns + (time.perf_counter_ns() - span._start)
+        trace = span.trace
+        with self._lock:
+            trace.open -= 1
+            if trace.open:
+                return
+            self.sampled += 1
+            self._recent[trace.trace_id] = trace
+            while len(self._recent) > self.max_traces:
+                self._recent.popitem(last=False)
+        if self.exporters:
+            self._ensure_worker()
+            self._queue.put(trace)
+
+    # ==================== 导出线程 ====================
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._export_loop, name="tracing-export", daemon=True)
+            self._worker.start()
+
+    def _export_loop(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # 把已排队的追踪合并成一批导出
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for exporter in self.exporters:
+                try:
+                    exporter.export(batch)
+                except Exception as e:
+                    self.export_errors += 1
+                    logger.warning("追踪导出失败 (%s): %s", type(exporter).__name__, e)
+            self.exported += len(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self) -> None:
+        """等待已完成的追踪全部导出（阻塞，在线程中调用）"""
+        if self._worker is not None:
+            self._queue.join()
+
+    # ==================== 查询 ====================
+
+    def recent(self, limit: int = 20, name: Optional[str] = None) -> List[Dict[str, Any]]:
+        """最近完成的追踪（最新的在前），可按根 span 名称过滤"""
+        with self._lock:
+            traces = list(reversed(self._recent.values()))
+        if name:
+            traces = [trace for trace in traces if trace.root.name == name]
+        return [trace.to_dict() for trace in traces[:limit]]
+
+    def get(self, trace_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            trace = self._recent.get(trace_id)
+        return trace.to_dict() if trace else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "sampled": self.sampled,
+            "exported": self.exported,
+            "export_errors": self.export_errors,
+            "exporters": [type(exporter).__name__ for exporter in self.exporters],
+        }
+
+
+# 进程内共享的追踪器
+default_tracer = Tracer.from_env()
+span = default_tracer.span
+traced = default_tracer.traced
+
+
+# ==================== ASGI ====================
+
+# 强制追踪单个请求的请求头
+TRACE_HEADER = b"x-trace"
+TRACE_ID_HEADER = b"x-trace-id"
+
+
+class TracingMiddleware:
+    """
+    ASGI 追踪中间件：每个 HTTP 请求是一个根 span。
+
+    请求带 X-Trace: 1 时强制采样，响应头 X-Trace-Id 返回追踪 ID；结束后根 span
+    以路由模板（例如 /sessions/{session_id}）命名，避免名称随路径参数变化。
+
+    Args:
+        app: 被包装的 ASGI 应用
+        tracer: 追踪器，默认 default_tracer
+    """
+
+    def __init__(self, app, tracer: Optional[Tracer] = None):
+        self.app = app
+        self.tracer = tracer or default_tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        forced = None
+        for name, value in scope["headers"]:
+            if name == TRACE_HEADER:
+                forced = value not in (b"", b"0")
+                break
+        if forced is None and self.tracer.sample_rate <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        with self.tracer.span(f"{scope['method']} {scope['path']}", sampled=forced) as root:
+            if isinstance(root, Span):
+                trace_id = root.trace.trace_id.encode()
+
+                async def send_wrapper(message):
+                    if message["type"] == "http.response.start":
+                        root.set_attribute("http.status_code", message["status"])
+                        message = {**message, "headers": [*message.get("headers", []), (TRACE_ID_HEADER, trace_id)]}
+                    await send(message)
+            else:
+                send_wrapper = send
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                route = scope.get("route")
+                if isinstance(root, Span) and route is not None and hasattr(route, "path"):
+                    root.name = f"{scope['method']} {route.path}"
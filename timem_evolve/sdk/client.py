@@ -1,13 +1,16 @@
 """TiMEM-Evolve SDK 客户端"""
 import requests
-from typing import List, Optional, Dict, Any
+from typing import Iterator, List, Optional, Dict, Any
+import json
 import os
+import time
 
 from ..models import (
     Session, SessionCreate, 
     Skill, Rule, 
     Feedback, FeedbackCreate,
-    CoachTask, CoachState, CoachTaskCreate
+    CoachTask, CoachState, CoachTaskCreate, CoachCurriculumRequest, CoachBatchRequest, CoachJob,
+    AnalysisResult, AnalyzeRequest, LearnedArtifacts
 )
 
 
@@ -22,14 +25,20 @@ class EvolveClient:
         if not self.base_url.endswith("/"):
             self.base_url += "/"
             
-    def _request(self, method: str, endpoint: str, data: Optional[Dict[str, Any]] = None) -> Any:
-        """通用请求方法"""
+    def _request(
+        self,
+        method: str,
+        endpoint: str,
+        data: Optional[Dict[str, Any]] = None,
+        params: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """通用请求方法（GET 的 data 作为查询参数，POST 的 data 作为 JSON 请求体，params 为额外的查询参数）"""
         url = f"{self.base_url}{endpoint}"
         try:
             if method == "GET":
-                response = requests.get(url, params=data)
+                response = requests.get(url, params={**(data or {}), **(params or {})})
             elif method == "POST":
-                response = requests.post(url, json=data)
+                response = requests.post(url, json=data, params=params)
             else:
                 raise ValueError(f"Unsupported method: {method}")
                 
@@ -59,14 +68,28 @@ class EvolveClient:
                 return None
             raise
 
-    def list_sessions(self, outcome: Optional[str] = None, limit: int = 100) -> List[Session]:
+    def list_sessions(self, outcome: Optional[str] = None, limit: int = 100, task_type: Optional[str] = None) -> List[Session]:
         """列出会话"""
         params = {"limit": limit}
         if outcome:
             params["outcome"] = outcome
+        if task_type:
+            params["task_type"] = task_type
         data = self._request("GET", "sessions", params)
         return [Session(**item) for item in data]
 
+    def analyze_sessions(
+        self,
+        session_ids: List[str],
+        mode: Optional[str] = None,
+        concurrency: int = 4,
+        force: bool = False
+    ) -> List[AnalysisResult]:
+        """批量分析会话"""
+        request = AnalyzeRequest(session_ids=session_ids, mode=mode, concurrency=concurrency, force=force)
+        data = self._request("POST", "sessions/analyze", request.model_dump())
+        return [AnalysisResult(**item) for item in data]
+
     # ==================== Feedbacks ====================
 
     def add_feedback(self, feedback_create: FeedbackCreate) -> Feedback:
@@ -115,6 +138,13 @@ class EvolveClient:
         data = self._request("POST", f"learn/session/{session_id}")
         return data
 
+    def learn_artifacts_from_session(self, session_id: str, min_confidence: float = 0.0) -> LearnedArtifacts:
+        """一次调用从会话中同时提炼技能和规则"""
+        data = self._request(
+            "POST", f"learn/session/{session_id}/artifacts", params={"min_confidence": min_confidence}
+        )
+        return LearnedArtifacts(**data)
+
     # ==================== Coach ====================
 
     def get_coach_state(self) -> CoachState:
@@ -122,15 +152,93 @@ class EvolveClient:
         data = self._request("GET", "coach/state")
         return CoachState(**data)
 
+    def get_coach_state_breakdown(self, by: str = "business_goal") -> Dict[str, CoachState]:
+        """按业务目标（business_goal）或难度（difficulty）分组的 Coach 统计状态"""
+        data = self._request("GET", "coach/state/breakdown", {"by": by})
+        return {key: CoachState(**value) for key, value in data.items()}
+
+    def rebuild_coach_state(self) -> CoachState:
+        """从任务重新计算物化的 Coach 统计"""
+        data = self._request("POST", "coach/state/rebuild")
+        return CoachState(**data)
+
     def generate_coach_task(self, task_create: CoachTaskCreate) -> CoachTask:
         """生成一个新的 Coach 任务"""
         data = self._request("POST", "coach/generate_task", task_create.model_dump())
         return CoachTask(**data)
 
-    def run_coach_task(self, task_id: str) -> CoachTask:
-        """运行一个 Coach 任务"""
+    def generate_coach_curriculum(
+        self,
+        business_goal: str,
+        n: int = 20,
+        difficulty_mix: Optional[Dict[str, float]] = None
+    ) -> List[CoachTask]:
+        """批量生成一组去重后的 Coach 任务"""
+        request = CoachCurriculumRequest(business_goal=business_goal, n=n, difficulty_mix=difficulty_mix)
+        data = self._request("POST", "coach/generate_curriculum", request.model_dump())
+        return [CoachTask(**item) for item in data]
+
+    def run_coach_task(self, task_id: str) -> CoachJob:
+        """提交一个 Coach 任务在后台运行，返回作业（用 wait_coach_job 等待结果）"""
         data = self._request("POST", f"coach/run_task/{task_id}")
-        return CoachTask(**data)
+        return CoachJob(**data)
+
+    def get_coach_job(self, job_id: str) -> CoachJob:
+        """获取 Coach 作业的状态和各节点进度"""
+        data = self._request("GET", f"coach/jobs/{job_id}")
+        return CoachJob(**data)
+
+    def list_coach_jobs(self, status: Optional[str] = None) -> List[CoachJob]:
+        """列出 Coach 作业"""
+        params = {"status": status} if status else None
+        data = self._request("GET", "coach/jobs", params)
+        return [CoachJob(**item) for item in data]
+
+    def cancel_coach_job(self, job_id: str) -> CoachJob:
+        """取消 Coach 作业"""
+        data = self._request("POST", f"coach/jobs/{job_id}/cancel")
+        return CoachJob(**data)
+
+    def wait_coach_job(self, job_id: str, poll_interval: float = 1.0, timeout: Optional[float] = None) -> CoachJob:
+        """轮询直到作业结束（completed / failed / cancelled），超时抛出 TimeoutError"""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            job = self.get_coach_job(job_id)
+            if job.status in ("completed", "failed", "cancelled"):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Coach job {job_id} did not finish within {timeout}s")
+            time.sleep(poll_interval)
+
+    def stream_coach_job(self, job_id: str) -> Iterator[CoachJob]:
+        """订阅作业进度的 Server-Sent Events，每次进度变化返回一次作业快照"""
+        url = f"{self.base_url}coach/jobs/{job_id}/events"
+        with requests.get(url, stream=True, headers={"Accept": "text/event-stream"}) as response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data:"):
+                    yield CoachJob(**json.loads(line[len("data:"):].strip()))
+
+    def run_coach_batch(
+        self,
+        task_ids: Optional[List[str]] = None,
+        status: str = "pending",
+        limit: Optional[int] = None
+    ) -> List[CoachJob]:
+        """提交一批 Coach 任务在后台运行，返回每个任务的作业（用 wait_coach_job 等待结果）"""
+        request = CoachBatchRequest(task_ids=task_ids, status=status, limit=limit)
+        data = self._request("POST", "coach/run_batch", request.model_dump())
+        return [CoachJob(**item) for item in data]
+
+    def get_coach_task(self, task_id: str) -> Optional[CoachTask]:
+        """获取 Coach 任务"""
+        try:
+            data = self._request("GET", f"coach/tasks/{task_id}")
+            return CoachTask(**data)
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
 
     def list_coach_tasks(self, status: Optional[str] = None) -> List[CoachTask]:
         """列出 Coach 任务"""
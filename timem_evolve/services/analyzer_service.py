@@ -1,16 +1,29 @@
 """LangGraph 分析器 - 使用 LLM 反思和分析会话"""
-from typing import TypedDict, Annotated, Literal
-from langgraph.graph import StateGraph, END
-from langchain_openai import ChatOpenAI
+import asyncio
+import hashlib
+import json
+import uuid
+from typing import TypedDict, Annotated, Literal, Optional, List, Dict, AsyncIterator
+from langgraph.graph import StateGraph, START, END
 from langchain_core.messages import HumanMessage, SystemMessage
 import os
 
-from ..models import Session
+from ..models import Session, AnalysisResult
+from ..dao.memory_dao import MemoryDAO
+from ..llm import ModelRouter, CHEAP_MODEL_NAME
+from ..llm.router import is_short_label, contains_any
+from ..observability import traced
+from .transcript_packer import TranscriptPacker
+from .outcome_classifier import OutcomeClassifier
+from .text_features import session_text
+from .task_type_index import TaskTypeIndex
+from .graph_checkpoints import GraphCheckpoints
 
 
 class AnalysisState(TypedDict):
     """分析状态"""
     session: Session
+    transcript: str
     task_type: str
     is_successful: bool
     key_insights: str
@@ -18,28 +31,100 @@ class AnalysisState(TypedDict):
     error: str
 
 
+AnalysisMode = Literal["sequential", "parallel", "single_shot"]
+
+
+def session_content_hash(session: Session) -> str:
+    """计算会话内容哈希（任务、结果和消息），内容不变则哈希不变"""
+    digest = hashlib.sha256()
+    digest.update(session.task.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(session.outcome.encode("utf-8"))
+    for msg in session.messages:
+        digest.update(b"\x00")
+        digest.update(msg.role.encode("utf-8"))
+        digest.update(b"\x00")
+        digest.update(msg.content.encode("utf-8"))
+    return digest.hexdigest()
+
+
 class AnalyzerService:
-    """基于 LangGraph 的会话分析器"""
+    """基于 LangGraph 的会话分析器
+    
+    支持三种分析模式：
+    - sequential: 四个节点依次执行（四次串行 LLM 调用）
+    - parallel: identify_task 与 evaluate_outcome 并行扇出，再汇合到 extract_insights
+    - single_shot: 一次结构化调用同时得到任务类型、结果、洞察和技能/规则 JSON
+    """
     
-    def __init__(self, model_name: str = "gpt-4.1-mini"):
-        # 初始化 LLM
-        self.llm = ChatOpenAI(
-            model=model_name,
+    def __init__(
+        self,
+        model_name: Optional[str] = None,
+        packer: Optional[TranscriptPacker] = None,
+        mode: AnalysisMode = "sequential",
+        dao: Optional[MemoryDAO] = None,
+        provider: Optional[str] = None,
+        node_models: Optional[Dict[str, str]] = None,
+        outcome_classifier: Optional[OutcomeClassifier] = None,
+        task_type_index: Optional[TaskTypeIndex] = None,
+        checkpoints: Optional[GraphCheckpoints] = None
+    ):
+        # 初始化 LLM（提供方由 provider 参数或 LLM_PROVIDER 环境变量决定）
+        # 只返回一个标签的分类节点默认使用小模型，回答不合格时升级到默认模型
+        self.llm = ModelRouter(
+            "analyzer",
+            model_name,
             temperature=0.7,
+            provider=provider,
+            node_models=node_models if node_models is not None else {
+                "identify_task": CHEAP_MODEL_NAME,
+                "evaluate_outcome": CHEAP_MODEL_NAME,
+            }
         )
         
-        # 构建图
-        self.graph = self._build_graph()
+        # 会话记录打包器（多个节点共享同一份缓存的打包结果）
+        self.packer = packer or TranscriptPacker()
+        
+        # 用于持久化分析结果（可选）
+        self.dao = dao
+        
+        # 本地成功/失败分类器（可选），置信度不足时才调用 LLM
+        self.outcome_classifier = outcome_classifier
+        
+        # 任务类型最近邻索引（可选），相似任务直接复用已识别的类型
+        self.task_type_index = task_type_index
+        
+        # 构建图（每种模式一张）
+        self.mode = mode
+        self._builders = {
+            "sequential": self._build_graph,
+            "parallel": self._build_parallel_graph,
+            "single_shot": self._build_single_shot_graph,
+        }
+        self.graphs = {name: build() for name, build in self._builders.items()}
+        self.graph = self.graphs["sequential"]
+        
+        # 检查点（可选）：分析中断后再次分析同一会话时跳过已完成的节点
+        self.checkpoints = checkpoints
+        self._checkpointed_graphs: Dict[str, StateGraph] = {}
+        # 本进程中正在运行的检查点线程，同一内容的并发分析各用一个独立线程
+        self._active_threads: set = set()
+    
+    async def _graph_with_checkpoints(self, mode: str) -> StateGraph:
+        """带检查点的分析图（第一次使用时编译）"""
+        if mode not in self._checkpointed_graphs:
+            self._checkpointed_graphs[mode] = self._builders[mode](await self.checkpoints.saver())
+        return self._checkpointed_graphs[mode]
     
-    def _build_graph(self) -> StateGraph:
+    def _build_graph(self, checkpointer=None) -> StateGraph:
         """构建分析流程图"""
         workflow = StateGraph(AnalysisState)
         
         # 添加节点
-        workflow.add_node("identify_task", self._identify_task)
-        workflow.add_node("evaluate_outcome", self._evaluate_outcome)
-        workflow.add_node("extract_insights", self._extract_insights)
-        workflow.add_node("reflect", self._reflect)
+        workflow.add_node("identify_task", traced("analyzer.identify_task")(self._identify_task))
+        workflow.add_node("evaluate_outcome", traced("analyzer.evaluate_outcome")(self._evaluate_outcome))
+        workflow.add_node("extract_insights", traced("analyzer.extract_insights")(self._extract_insights))
+        workflow.add_node("reflect", traced("analyzer.reflect")(self._reflect))
         
         # 定义边
         workflow.set_entry_point("identify_task")
@@ -48,27 +133,68 @@ class AnalyzerService:
         workflow.add_edge("extract_insights", "reflect")
         workflow.add_edge("reflect", END)
         
-        return workflow.compile()
+        return workflow.compile(checkpointer=checkpointer)
+    
+    def _build_parallel_graph(self, checkpointer=None) -> StateGraph:
+        """构建并行扇出的分析流程图
+        
+        evaluate_outcome 不依赖 identify_task，两者同时执行，
+        extract_insights 等待两者都完成后再运行。
+        """
+        workflow = StateGraph(AnalysisState)
+        
+        workflow.add_node("identify_task", traced("analyzer.identify_task")(self._identify_task))
+        workflow.add_node("evaluate_outcome", traced("analyzer.evaluate_outcome")(self._evaluate_outcome))
+        workflow.add_node("extract_insights", traced("analyzer.extract_insights")(self._extract_insights))
+        workflow.add_node("reflect", traced("analyzer.reflect")(self._reflect))
+        
+        workflow.add_edge(START, "identify_task")
+        workflow.add_edge(START, "evaluate_outcome")
+        workflow.add_edge(["identify_task", "evaluate_outcome"], "extract_insights")
+        workflow.add_edge("extract_insights", "reflect")
+        workflow.add_edge("reflect", END)
+        
+        return workflow.compile(checkpointer=checkpointer)
+    
+    def _build_single_shot_graph(self, checkpointer=None) -> StateGraph:
+        """构建单次调用的分析流程图"""
+        workflow = StateGraph(AnalysisState)
+        
+        workflow.add_node("analyze_single_shot", traced("analyzer.analyze_single_shot")(self._analyze_single_shot))
+        workflow.add_edge(START, "analyze_single_shot")
+        workflow.add_edge("analyze_single_shot", END)
+        
+        return workflow.compile(checkpointer=checkpointer)
     
     async def _identify_task(self, state: AnalysisState) -> AnalysisState:
-        """识别任务类型"""
+        """识别任务类型（已记录或索引中有相似任务时不调用 LLM）"""
         session = state["session"]
         
+        if session.task_type:
+            return {"task_type": session.task_type}
+        if self.task_type_index is not None:
+            task_type = await self.task_type_index.lookup(session.task)
+            if task_type:
+                return {"task_type": task_type}
+        
         prompt = f"""
 分析以下任务会话，识别任务类型和目标。
 
 任务描述: {session.task}
 
 会话消息:
-{self._format_messages(session.messages)}
+{state['transcript']}
 
 请简洁地描述这个任务的类型（例如：数据分析、代码调试、信息检索等）。
 只需要返回任务类型，不要其他内容。
 """
         
-        response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-        state["task_type"] = response.content.strip()
-        return state
+        response = await self.llm.ainvoke(
+            [HumanMessage(content=prompt)],
+            node="identify_task",
+            validator=is_short_label()
+        )
+        return {"task_type": response.content.strip()}
     
     async def _evaluate_outcome(self, state: AnalysisState) -> AnalysisState:
         """评估任务结果"""
@@ -76,24 +202,37 @@ class AnalyzerService:
         
         # 如果已经标记了结果，直接使用
         if session.outcome in ["success", "failure"]:
-            state["is_successful"] = (session.outcome == "success")
-        else:
-            # 使用 LLM 评估
-            prompt = f"""
+            return {"is_successful": session.outcome == "success"}
+        
+        if self.outcome_classifier:
+            outcome = await self.outcome_classifier.classify(
+                session_text(session.task, session.messages),
+                lambda: self._evaluate_outcome_with_llm(state)
+            )
+            return {"is_successful": outcome == "success"}
+        
+        return {"is_successful": await self._evaluate_outcome_with_llm(state) == "success"}
+    
+    async def _evaluate_outcome_with_llm(self, state: AnalysisState) -> str:
+        """使用 LLM 评估任务结果，返回 success 或 failure"""
+        session = state["session"]
+        prompt = f"""
 分析以下任务会话，判断任务是否成功完成。
 
 任务描述: {session.task}
 
 会话消息:
-{self._format_messages(session.messages)}
+{state['transcript']}
 
 请判断这个任务是否成功完成。只需要返回 "成功" 或 "失败"，不要其他内容。
 """
-            
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            state["is_successful"] = "成功" in response.content
         
-        return state
+        response = await self.llm.ainvoke(
+            [HumanMessage(content=prompt)],
+            node="evaluate_outcome",
+            validator=contains_any("成功", "失败")
+        )
+        return "success" if "成功" in response.content else "failure"
     
     async def _extract_insights(self, state: AnalysisState) -> AnalysisState:
         """提取关键洞察"""
@@ -107,7 +246,7 @@ class AnalyzerService:
 任务描述: {session.task}
 
 会话消息:
-{self._format_messages(session.messages)}
+{state['transcript']}
 
 请提取：
 1. 关键的成功步骤
@@ -124,7 +263,7 @@ class AnalyzerService:
 任务描述: {session.task}
 
 会话消息:
-{self._format_messages(session.messages)}
+{state['transcript']}
 
 请提取：
 1. 失败的原因
@@ -134,9 +273,8 @@ class AnalyzerService:
 以简洁的要点形式返回。
 """
         
-        response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-        state["key_insights"] = response.content.strip()
-        return state
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_insights")
+        return {"key_insights": response.content.strip()}
     
     async def _reflect(self, state: AnalysisState) -> AnalysisState:
         """反思和总结"""
@@ -186,23 +324,100 @@ class AnalyzerService:
 }}
 """
         
-        response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-        state["reflection"] = response.content.strip()
-        return state
-    
-    def _format_messages(self, messages) -> str:
-        """格式化消息"""
-        formatted = []
-        for msg in messages:
-            role = msg.role if hasattr(msg, 'role') else msg.get('role', 'unknown')
-            content = msg.content if hasattr(msg, 'content') else msg.get('content', '')
-            formatted.append(f"{role}: {content}")
-        return "\n".join(formatted)
-    
-    async def analyze(self, session: Session) -> AnalysisState:
-        """分析会话"""
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="reflect")
+        return {"reflection": response.content.strip()}
+    
+    async def _analyze_single_shot(self, state: AnalysisState) -> AnalysisState:
+        """一次结构化调用完成全部分析"""
+        session = state["session"]
+        
+        if session.outcome in ["success", "failure"]:
+            outcome_hint = f"该任务已标记为{'成功' if session.outcome == 'success' else '失败'}，请据此分析。"
+        else:
+            outcome_hint = "请先判断这个任务是否成功完成。"
+        
+        prompt = f"""
+分析以下任务会话，一次性完成任务识别、结果评估、洞察提取和经验总结。
+
+任务描述: {session.task}
+
+会话消息:
+{state['transcript']}
+
+{outcome_hint}
+
+请完成：
+1. 任务类型（例如：数据分析、代码调试、信息检索等）
+2. 任务是否成功完成
+3. 关键洞察（成功时：关键步骤、方法技巧、可复用模式；失败时：失败原因、遇到的问题、应避免的做法）
+4. 成功时生成一个可复用的技能，失败时生成一个约束规则
+
+以 JSON 格式返回：
+{{
+    "task_type": "任务类型",
+    "is_successful": true,
+    "key_insights": "以简洁的要点形式描述的关键洞察",
+    "skill": {{
+        "name": "技能名称",
+        "description": "技能描述",
+        "steps": ["步骤1", "步骤2", "步骤3"],
+        "sop": "详细的标准操作流程描述"
+    }},
+    "rule": {{
+        "name": "规则名称",
+        "description": "规则描述",
+        "constraint": "约束条件",
+        "reason": "原因说明"
+    }}
+}}
+
+成功时 "rule" 为 null，失败时 "skill" 为 null。只返回 JSON，不要其他内容。
+"""
+        
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="analyze_single_shot")
+        content = response.content.strip()
+        
+        # 提取 JSON
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+        
+        data = json.loads(content)
+        
+        if session.outcome in ["success", "failure"]:
+            is_successful = session.outcome == "success"
+        else:
+            is_successful = bool(data.get("is_successful"))
+        artifact = data.get("skill") if is_successful else data.get("rule")
+        
+        return {
+            "task_type": str(data.get("task_type", "")).strip(),
+            "is_successful": is_successful,
+            "key_insights": str(data.get("key_insights", "")).strip(),
+            "reflection": json.dumps(artifact or {}, ensure_ascii=False, indent=4),
+        }
+    
+    def _pack_session(self, session: Session) -> str:
+        """在 token 预算内格式化会话"""
+        return self.packer.pack(session.messages, session_id=session.session_id)
+    
+    @traced("analyzer.analyze")
+    async def analyze(self, session: Session, mode: Optional[AnalysisMode] = None) -> AnalysisState:
+        """分析会话
+        
+        Args:
+            session: 要分析的会话
+            mode: 分析模式（sequential/parallel/single_shot），默认使用构造时指定的模式
+        """
+        mode = mode or self.mode
+        if mode not in self.graphs:
+            raise ValueError(f"Unknown analysis mode: {mode}")
+        
         initial_state: AnalysisState = {
             "session": session,
+            # 只格式化一次，所有节点共享
+            "transcript": self._pack_session(session),
             "task_type": "",
             "is_successful": False,
             "key_insights": "",
@@ -210,9 +425,115 @@ class AnalyzerService:
             "error": ""
         }
         
+        thread_id = None
         try:
-            result = await self.graph.ainvoke(initial_state)
+            graph = self.graphs[mode]
+            graph_input: Optional[AnalysisState] = initial_state
+            config = None
+            if self.checkpoints is not None:
+                graph = await self._graph_with_checkpoints(mode)
+                thread_id = f"analyzer:{mode}:{session_content_hash(session)}"
+                if thread_id in self._active_threads:
+                    # 同一内容正在分析：使用一次性的线程，不读取也不删除对方的检查点
+                    thread_id = f"{thread_id}:{uuid.uuid4().hex}"
+                self._active_threads.add(thread_id)
+                config = self.checkpoints.config(thread_id)
+                # 上次中断（异常或进程重启）时从未完成的节点继续
+                if await self.checkpoints.pending_nodes(graph, thread_id):
+                    graph_input = None
+                    self.checkpoints.resumed += 1
+            
+            result = await graph.ainvoke(graph_input, config)
+            if thread_id is not None:
+                await self.checkpoints.delete(thread_id)
+            await self._remember_task_type(session, result["task_type"])
             return result
         except Exception as e:
             initial_state["error"] = str(e)
             return initial_state
+        finally:
+            self._active_threads.discard(thread_id)
+    
+    async def _remember_task_type(self, session: Session, task_type: str) -> None:
+        """把识别出的任务类型加入索引，并记录到会话上"""
+        if not task_type:
+            return
+        if self.task_type_index is not None:
+            self.task_type_index.add(session.task, task_type)
+        if task_type != session.task_type:
+            session.task_type = task_type
+            if self.dao:
+                await self.dao.update_session_task_type(session.session_id, task_type)
+    
+    async def analyze_many(
+        self,
+        sessions: List[Session],
+        concurrency: int = 4,
+        mode: Optional[AnalysisMode] = None
+    ) -> AsyncIterator[AnalysisState]:
+        """批量分析会话，最多 concurrency 个同时进行，按完成顺序逐个返回结果
+        
+        用法:
+            async for result in analyzer.analyze_many(sessions, concurrency=8):
+                print(result["session"].session_id, result["task_type"])
+        """
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+        
+        async def run(session: Session) -> AnalysisState:
+            async with semaphore:
+                return await self.analyze(session, mode=mode)
+        
+        tasks = [asyncio.create_task(run(session)) for session in sessions]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # 调用方提前停止迭代时，取消尚未完成的分析
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+    
+    async def analyze_sessions(
+        self,
+        sessions: List[Session],
+        concurrency: int = 4,
+        mode: Optional[AnalysisMode] = None,
+        force: bool = False
+    ) -> List[AnalysisResult]:
+        """批量分析并持久化结果；内容未变化的会话直接返回同一模式下已保存的结果"""
+        if self.dao is None:
+            raise RuntimeError("AnalyzerService was created without a DAO")
+        
+        mode = mode or self.mode
+        results = {}
+        hashes = {}
+        pending = []
+        for session in sessions:
+            content_hash = session_content_hash(session)
+            hashes[session.session_id] = content_hash
+            cached = None if force else await self.dao.get_analysis(content_hash, mode)
+            if cached:
+                cached.session_id = session.session_id
+                cached.cached = True
+                results[session.session_id] = cached
+            else:
+                pending.append(session)
+        
+        async for state in self.analyze_many(pending, concurrency=concurrency, mode=mode):
+            session_id = state["session"].session_id
+            result = AnalysisResult(
+                session_id=session_id,
+                content_hash=hashes[session_id],
+                mode=mode,
+                task_type=state["task_type"],
+                is_successful=state["is_successful"],
+                key_insights=state["key_insights"],
+                reflection=state["reflection"],
+                error=state["error"],
+            )
+            if not result.error:
+                await self.dao.save_analysis(result)
+            results[session_id] = result
+        
+        # 按请求顺序返回
+        return [results[session.session_id] for session in sessions]
@@ -0,0 +1,178 @@
+"""Coach 后台作业 - 在请求之外运行 Coach 任务，支持进度查询、事件流和取消"""
+import asyncio
+from collections import OrderedDict
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from ..models import CoachJob, CoachTask
+from ..llm import LLMUnavailableError
+from .coach_service import CoachService, COACH_NODES
+
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class CoachJobManager:
+    """
+    Coach 作业管理器。
+
+    submit 先原子领取任务（标记为 running），再在后台排队执行，最多
+    max_concurrency 个作业同时运行 LangGraph 工作流。每个节点开始/结束时
+    更新作业进度并通知 events() 的订阅者。取消作业会中止工作流并把任务退回
+    pending。作业只保存在内存中，超过 max_history 后丢弃最早结束的作业。
+
+    Args:
+        coach_service: Coach 服务
+        max_concurrency: 同时运行的最大作业数
+        max_history: 保留的作业数上限
+    """
+
+    def __init__(self, coach_service: CoachService, max_concurrency: int = 2, max_history: int = 1000):
+        self.coach_service = coach_service
+        self.max_concurrency = max_concurrency
+        self.max_history = max_history
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._jobs: "OrderedDict[str, CoachJob]" = OrderedDict()
+        self._runners: Dict[str, asyncio.Task] = {}
+        self._subscribers: Dict[str, List[asyncio.Queue]] = {}
+
+    async def submit(self, task_id: str) -> CoachJob:
+        """提交任务在后台运行；任务不是 pending（已被领取）时抛出 ValueError"""
+        claimed = await asyncio.to_thread(self.coach_service.coach_storage.claim_tasks, [task_id])
+        if not claimed:
+            raise ValueError(f"Task {task_id} is not pending")
+        return self._start(claimed[0])
+
+    async def submit_batch(
+        self,
+        task_ids: Optional[List[str]] = None,
+        status: str = "pending",
+        limit: Optional[int] = None
+    ) -> List[CoachJob]:
+        """
+        一次性原子领取一批任务并逐个提交为作业，返回领取到的任务的作业。
+
+        Args:
+            task_ids: 要运行的任务，默认所有状态为 status 的任务
+            status: 只领取该状态的任务（pending，或用 failed 重跑失败任务）
+            limit: 最多领取的任务数
+        """
+        claimed = await asyncio.to_thread(self.coach_service.coach_storage.claim_tasks, task_ids, status, limit)
+        return [self._start(task) for task in claimed]
+
+    def _start(self, task: CoachTask) -> CoachJob:
+        """为已领取的任务创建作业并在后台排队执行"""
+        job = CoachJob(
+            task_id=task.task_id,
+            nodes={node: "pending" for node in COACH_NODES},
+            task=task
+        )
+        self._jobs[job.job_id] = job
+        self._trim()
+        self._runners[job.job_id] = asyncio.create_task(self._run(job, task))
+        return job
+
+    def get(self, job_id: str) -> Optional[CoachJob]:
+        return self._jobs.get(job_id)
+
+    def list_jobs(self, status: Optional[str] = None) -> List[CoachJob]:
+        jobs = list(self._jobs.values())
+        if status:
+            jobs = [job for job in jobs if job.status == status]
+        return jobs
+
+    async def cancel(self, job_id: str) -> Optional[CoachJob]:
+        """取消作业（已结束的作业原样返回），等待作业停止后返回"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        runner = self._runners.get(job_id)
+        if runner is not None and not runner.done():
+            runner.cancel()
+            await asyncio.gather(runner, return_exceptions=True)
+        return job
+
+    async def events(self, job_id: str) -> AsyncIterator[CoachJob]:
+        """作业状态的快照流：先返回当前状态，之后每次进度变化返回一次，作业结束后停止"""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(job_id, []).append(queue)
+        try:
+            snapshot = job.model_copy(deep=True)
+            yield snapshot
+            while snapshot.status not in TERMINAL_STATUSES:
+                snapshot = await queue.get()
+                yield snapshot
+        finally:
+            subscribers = self._subscribers.get(job_id, [])
+            if queue in subscribers:
+                subscribers.remove(queue)
+            if not subscribers:
+                self._subscribers.pop(job_id, None)
+
+    async def shutdown(self) -> None:
+        """取消所有未结束的作业（任务退回 pending）"""
+        runners = [runner for runner in self._runners.values() if not runner.done()]
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        """各状态的作业数和并发上限"""
+        counts = {status: 0 for status in ("queued", "running") + TERMINAL_STATUSES}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        counts["max_concurrency"] = self.max_concurrency
+        return counts
+
+    async def _run(self, job: CoachJob, task: CoachTask) -> None:
+        try:
+            async with self._semaphore:
+                job.status = "running"
+                job.started_at = datetime.now()
+                self._publish(job)
+                job.task = await self.coach_service._run_claimed(
+                    task, on_node=lambda node, state: self._on_node(job, node, state)
+                )
+                job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            if job.started_at is None:
+                # 排队时被取消：工作流尚未运行，由这里把任务退回 pending
+                task.status = "pending"
+                task.coach_feedback = "任务运行已取消"
+                await asyncio.to_thread(self.coach_service.coach_storage.save_task, task, "running")
+            job.task = task
+        except LLMUnavailableError as e:
+            # 任务已退回 pending，稍后可以重新提交
+            job.status = "failed"
+            job.error = f"LLM 暂不可用: {e}"
+            job.task = task
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            job.task = task
+        finally:
+            job.current_node = None
+            job.finished_at = datetime.now()
+            self._runners.pop(job.job_id, None)
+            self._publish(job)
+
+    def _on_node(self, job: CoachJob, node: str, state: str) -> None:
+        job.nodes[node] = state
+        job.current_node = node if state == "running" else None
+        self._publish(job)
+
+    def _publish(self, job: CoachJob) -> None:
+        for queue in self._subscribers.get(job.job_id, []):
+            queue.put_nowait(job.model_copy(deep=True))
+
+    def _trim(self) -> None:
+        """超过 max_history 时丢弃最早结束的作业"""
+        excess = len(self._jobs) - self.max_history
+        if excess <= 0:
+            return
+        for job_id in [j.job_id for j in self._jobs.values() if j.status in TERMINAL_STATUSES][:excess]:
+            del self._jobs[job_id]
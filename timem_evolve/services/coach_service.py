@@ -1,84 +1,444 @@
 """Coach 模块核心逻辑 - Gym 模式"""
 import json
 import asyncio
-from typing import List, Dict, Any, Optional
-from langchain_openai import ChatOpenAI
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, Callable, Optional
 from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from pydantic import BaseModel
 
-from ..models import CoachTask, CoachTaskCreate, CoachState, Session, Message
+from ..models import CoachTask, CoachTaskCreate, CoachState, CoachBatchResult, Session, Message
 from ..dao.memory_dao import MemoryDAO
+from ..llm import ModelRouter, CHEAP_MODEL_NAME, LLMUnavailableError
+from ..llm.router import is_one_of
+from ..observability import traced
 from .learner_service import LearnerService
+from .outcome_classifier import OutcomeClassifier, OUTCOME_SOURCE_KEY
+from .text_features import session_text, hashed_vector, cosine_similarity
+from .graph_checkpoints import GraphCheckpoints
+from .transcript_packer import format_messages
+
+logger = logging.getLogger(__name__)
+
+
+# Coach 工作流的节点（按执行顺序）
+COACH_NODES = ("execute_task", "evaluate_result", "learn_from_session")
+
+# 物化的 Coach 统计字段（与 CoachState 一致）
+STAT_FIELDS = (
+    "total_tasks", "completed_tasks", "successful_tasks",
+    "failed_tasks", "skills_gained", "rules_gained",
+)
+
+# coach_stats 的统计口径版本（记录在 PRAGMA user_version 中）
+STATS_VERSION = 1
+
+# SQLite 单条语句的参数个数有上限，IN (...) 按批展开
+SQL_IN_BATCH = 500
+
+# 课程生成的默认难度比例
+DEFAULT_DIFFICULTY_MIX = {"easy": 0.3, "medium": 0.5, "hard": 0.2}
+
+
+class CoachGraphState(BaseModel):
+    """Coach 工作流状态"""
+    task: CoachTask
+    session: Optional[Session] = None
 
 
 class CoachStorage:
-    """Coach 任务存储（简化为 JSON 文件）"""
+    """Coach 任务存储（SQLite 表，task_id 为主键，status 有索引）
+    
+    任务的完整内容以 JSON 存在 data 列，status 等常用过滤字段单独成列；
+    读取时以 status 列为准。状态迁移使用带条件的 UPDATE（compare-and-set），
+    因此即使多个进程共享同一个数据库，同一个任务也只会被一个执行者领取；
+    save_tasks 覆盖已有任务时同样保留 status 列，除非调用方给出 from_status。
+    首次打开时会把旧版 coach_tasks.json 中的任务导入数据库。
+    
+    方法都是同步的（连接加锁，可以跨线程使用），在事件循环中应通过
+    asyncio.to_thread 调用，避免锁等待（最长 30 秒）阻塞事件循环。
+    
+    统计计数（总数、完成、成功、失败、学到的技能/规则）按全局、业务目标和
+    难度三个维度物化在 coach_stats 表中，与任务在同一个事务里增量更新，
+    读取是 O(1) 的；计数与任务不一致时可以用 rebuild_stats 重新计算。
+    """
     
     def __init__(self, data_dir: str = "./data"):
-        self.tasks_path = Path(data_dir) / "coach_tasks.json"
-        if not self.tasks_path.exists():
-            self.tasks_path.write_text("[]")
-        
-    def _load_tasks(self) -> List[Dict[str, Any]]:
-        return json.loads(self.tasks_path.read_text())
+        self.db_path = Path(data_dir) / "coach.db"
+        self.legacy_path = Path(data_dir) / "coach_tasks.json"
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+        self._init_db()
+        self._migrate_json()
     
-    def _save_tasks(self, tasks: List[Dict[str, Any]]) -> None:
-        self.tasks_path.write_text(json.dumps(tasks, indent=2, ensure_ascii=False))
-        
-    def save_task(self, task: CoachTask) -> None:
-        tasks = self._load_tasks()
-        
-        # 检查是否已存在
-        for i, t in enumerate(tasks):
-            if t["task_id"] == task.task_id:
-                tasks[i] = task.model_dump(mode='json')
-                self._save_tasks(tasks)
-                return
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+    
+    def _init_db(self) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS coach_tasks (
+                    task_id TEXT PRIMARY KEY,
+                    business_goal TEXT NOT NULL,
+                    difficulty TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    outcome TEXT,
+                    learned_skill_id TEXT,
+                    learned_rule_id TEXT
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_coach_tasks_status ON coach_tasks(status)")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS coach_stats (
+                    scope TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    total_tasks INTEGER NOT NULL DEFAULT 0,
+                    completed_tasks INTEGER NOT NULL DEFAULT 0,
+                    successful_tasks INTEGER NOT NULL DEFAULT 0,
+                    failed_tasks INTEGER NOT NULL DEFAULT 0,
+                    skills_gained INTEGER NOT NULL DEFAULT 0,
+                    rules_gained INTEGER NOT NULL DEFAULT 0,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (scope, key)
+                )
+            """)
+            
+            # 旧表没有结果和学习结果列：补齐列后从 JSON 回填，并重建统计
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(coach_tasks)")}
+            missing = [c for c in ("outcome", "learned_skill_id", "learned_rule_id") if c not in columns]
+            for column in missing:
+                self._conn.execute(f"ALTER TABLE coach_tasks ADD COLUMN {column} TEXT")
+            if missing:
+                rows = self._conn.execute("SELECT task_id, data FROM coach_tasks").fetchall()
+                self._conn.executemany(
+                    "UPDATE coach_tasks SET outcome = ?, learned_skill_id = ?, learned_rule_id = ? WHERE task_id = ?",
+                    [
+                        (data.get("outcome"), data.get("learned_skill_id"), data.get("learned_rule_id"), task_id)
+                        for task_id, data in ((row[0], json.loads(row[1])) for row in rows)
+                    ]
+                )
+            # 统计口径变化（结果和学习结果只计入已完成的任务）时按新口径重建
+            if missing or self._conn.execute("PRAGMA user_version").fetchone()[0] < STATS_VERSION:
+                self._rebuild_stats()
+                self._conn.execute(f"PRAGMA user_version = {STATS_VERSION}")
+    
+    def _migrate_json(self) -> None:
+        """导入旧版 JSON 文件中的任务，完成后重命名为 coach_tasks.json.migrated"""
+        if not self.legacy_path.exists():
+            return
+        tasks = [CoachTask(**t) for t in json.loads(self.legacy_path.read_text() or "[]")]
+        self.save_tasks(tasks)
+        os.replace(self.legacy_path, self.legacy_path.with_suffix(".json.migrated"))
+    
+    @staticmethod
+    def _task_row(task: CoachTask, status: str) -> tuple:
+        return (
+            task.task_id, task.business_goal, task.difficulty, status,
+            task.created_at.isoformat(), task.model_dump_json(),
+            task.outcome, task.learned_skill_id, task.learned_rule_id
+        )
+    
+    @staticmethod
+    def _row_to_task(row) -> CoachTask:
+        data = json.loads(row[1])
+        data["status"] = row[0]
+        return CoachTask(**data)
+    
+    # ==================== 统计 ====================
+    
+    @staticmethod
+    def _contribution(status, outcome, learned_skill_id, learned_rule_id, sign: int = 1) -> List[int]:
+        """一个任务对各计数的贡献，顺序与 STAT_FIELDS 一致；结果和学习结果只计入已完成的任务"""
+        completed = status == "completed"
+        return [
+            sign,
+            sign * completed,
+            sign * (completed and outcome == "success"),
+            sign * (completed and outcome == "failure"),
+            sign * (completed and bool(learned_skill_id)),
+            sign * (completed and bool(learned_rule_id)),
+        ]
+    
+    @staticmethod
+    def _add_delta(deltas: Dict[tuple, List[int]], business_goal: str, difficulty: str, contribution: List[int]) -> None:
+        for key in (("all", ""), ("business_goal", business_goal), ("difficulty", difficulty)):
+            current = deltas.setdefault(key, [0] * len(STAT_FIELDS))
+            for i, value in enumerate(contribution):
+                current[i] += value
+    
+    def _apply_deltas(self, deltas: Dict[tuple, List[int]]) -> None:
+        """在当前事务中把增量累加到 coach_stats"""
+        now = datetime.now().isoformat()
+        rows = [(scope, key, *values, now) for (scope, key), values in deltas.items() if any(values)]
+        if not rows:
+            return
+        fields = ", ".join(STAT_FIELDS)
+        updates = ", ".join(f"{f} = {f} + excluded.{f}" for f in STAT_FIELDS)
+        self._conn.executemany(
+            f"""
+            INSERT INTO coach_stats (scope, key, {fields}, updated_at)
+            VALUES (?, ?, {", ".join("?" for _ in STAT_FIELDS)}, ?)
+            ON CONFLICT(scope, key) DO UPDATE SET {updates}, updated_at = excluded.updated_at
+            """,
+            rows
+        )
+    
+    def _rebuild_stats(self) -> None:
+        """在当前事务中从 coach_tasks 重新计算全部统计"""
+        now = datetime.now().isoformat()
+        self._conn.execute("DELETE FROM coach_stats")
+        for scope, column in (("all", "''"), ("business_goal", "business_goal"), ("difficulty", "difficulty")):
+            self._conn.execute(
+                f"""
+                INSERT INTO coach_stats (scope, key, {", ".join(STAT_FIELDS)}, updated_at)
+                SELECT ?, {column}, COUNT(*),
+                       SUM(status = 'completed'),
+                       SUM(status = 'completed' AND outcome IS 'success'),
+                       SUM(status = 'completed' AND outcome IS 'failure'),
+                       SUM(status = 'completed' AND COALESCE(learned_skill_id, '') != ''),
+                       SUM(status = 'completed' AND COALESCE(learned_rule_id, '') != ''),
+                       ?
+                FROM coach_tasks GROUP BY {column}
+                """,
+                (scope, now)
+            )
+    
+    def rebuild_stats(self) -> None:
+        """从任务表重新计算统计（用于修复计数）"""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._rebuild_stats()
+    
+    def get_stats(self, scope: str = "all", key: str = "") -> Dict[str, Any]:
+        """读取一个维度的统计计数，没有任务时各计数为 0"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(STAT_FIELDS)}, updated_at FROM coach_stats WHERE scope = ? AND key = ?",
+                (scope, key)
+            ).fetchone()
+        if not row:
+            return {field: 0 for field in STAT_FIELDS}
+        stats = dict(zip(STAT_FIELDS, row[:-1]))
+        stats["last_update"] = row[-1]
+        return stats
+    
+    def get_stats_breakdown(self, scope: str) -> Dict[str, Dict[str, Any]]:
+        """按业务目标（business_goal）或难度（difficulty）分组的统计计数"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, {', '.join(STAT_FIELDS)}, updated_at FROM coach_stats "
+                "WHERE scope = ? AND total_tasks > 0 ORDER BY key",
+                (scope,)
+            ).fetchall()
+        return {
+            row[0]: {**dict(zip(STAT_FIELDS, row[1:-1])), "last_update": row[-1]}
+            for row in rows
+        }
+    
+    # ==================== 任务 ====================
         
-        # 新增
-        tasks.append(task.model_dump(mode='json'))
-        self._save_tasks(tasks)
+    def save_task(self, task: CoachTask, from_status: Optional[str] = None) -> None:
+        self.save_tasks([task], from_status=from_status)
+    
+    def save_tasks(self, new_tasks: List[CoachTask], from_status: Optional[str] = None) -> None:
+        """
+        在一个事务中写入多个任务并更新统计。
+        
+        新任务按 task.status 插入。已存在的任务按 task_id 覆盖内容，但 status 列
+        保持数据库中的值（可能已被其他进程迁移），只有给出 from_status 且任务
+        当前状态仍为 from_status 时才改为 task.status。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            deltas: Dict[tuple, List[int]] = {}
+            for task in new_tasks:
+                old = self._conn.execute(
+                    "SELECT business_goal, difficulty, status, outcome, learned_skill_id, learned_rule_id "
+                    "FROM coach_tasks WHERE task_id = ?",
+                    (task.task_id,)
+                ).fetchone()
+                status = task.status
+                if old:
+                    self._add_delta(deltas, old[0], old[1], self._contribution(*old[2:], sign=-1))
+                    if from_status is None or old[2] != from_status:
+                        status = old[2]
+                self._add_delta(deltas, task.business_goal, task.difficulty, self._contribution(
+                    status, task.outcome, task.learned_skill_id, task.learned_rule_id
+                ))
+                self._conn.execute(
+                    """
+                    INSERT INTO coach_tasks (
+                        task_id, business_goal, difficulty, status, created_at, data,
+                        outcome, learned_skill_id, learned_rule_id
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(task_id) DO UPDATE SET
+                        business_goal = excluded.business_goal,
+                        difficulty = excluded.difficulty,
+                        status = excluded.status,
+                        data = excluded.data,
+                        outcome = excluded.outcome,
+                        learned_skill_id = excluded.learned_skill_id,
+                        learned_rule_id = excluded.learned_rule_id
+                    """,
+                    self._task_row(task, status)
+                )
+            self._apply_deltas(deltas)
+    
+    def get_task(self, task_id: str) -> Optional[CoachTask]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, data FROM coach_tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return self._row_to_task(row) if row else None
+    
+    def transition(self, task_id: str, from_status: str, to_status: str) -> bool:
+        """原子地把任务从 from_status 改为 to_status，任务当前不是 from_status 时返回 False"""
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            return bool(self._set_status([task_id], from_status, to_status))
+    
+    def claim_tasks(
+        self,
+        task_ids: Optional[List[str]] = None,
+        status: str = "pending",
+        limit: Optional[int] = None
+    ) -> List[CoachTask]:
+        """
+        原子地领取任务：在一个事务中把状态为 status 的任务（可限定 task_ids，
+        按给出的顺序）标记为 running 并返回。已被其他执行者领取的任务不会再次返回。
+        """
+        with self._lock, self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            if task_ids is not None:
+                order = {task_id: i for i, task_id in enumerate(dict.fromkeys(task_ids))}
+                candidates = []
+                ids = list(order)
+                for start in range(0, len(ids), SQL_IN_BATCH):
+                    chunk = ids[start:start + SQL_IN_BATCH]
+                    candidates += [row[0] for row in self._conn.execute(
+                        f"SELECT task_id FROM coach_tasks WHERE status = ? "
+                        f"AND task_id IN ({', '.join('?' for _ in chunk)})",
+                        (status, *chunk)
+                    )]
+                candidates.sort(key=order.__getitem__)
+                if limit is not None:
+                    candidates = candidates[:limit]
+            else:
+                candidates = [row[0] for row in self._conn.execute(
+                    "SELECT task_id FROM coach_tasks WHERE status = ? ORDER BY rowid LIMIT ?",
+                    (status, -1 if limit is None else limit)
+                )]
+            rows = self._set_status(candidates, status, "running")
+        claimed = {task.task_id: task for task in (self._row_to_task(row) for row in rows)}
+        return [claimed[task_id] for task_id in candidates if task_id in claimed]
+    
+    def _set_status(self, task_ids: List[str], from_status: str, to_status: str) -> list:
+        """在当前事务中把状态为 from_status 的任务改为 to_status 并更新统计，返回迁移成功的 (status, data) 行"""
+        rows = []
+        for start in range(0, len(task_ids), SQL_IN_BATCH):
+            chunk = task_ids[start:start + SQL_IN_BATCH]
+            rows += self._conn.execute(
+                f"UPDATE coach_tasks SET status = ? WHERE status = ? "
+                f"AND task_id IN ({', '.join('?' for _ in chunk)}) "
+                "RETURNING status, data, business_goal, difficulty, outcome, learned_skill_id, learned_rule_id",
+                (to_status, from_status, *chunk)
+            ).fetchall()
+        # 只有状态变化：每个任务的增量是新旧两行贡献之差
+        deltas: Dict[tuple, List[int]] = {}
+        for row in rows:
+            self._add_delta(deltas, row[2], row[3], self._contribution(from_status, *row[4:], sign=-1))
+            self._add_delta(deltas, row[2], row[3], self._contribution(to_status, *row[4:]))
+        self._apply_deltas(deltas)
+        return rows
         
     def list_tasks(self, status: Optional[str] = None) -> List[CoachTask]:
-        tasks = self._load_tasks()
-        if status:
-            tasks = [t for t in tasks if t.get("status") == status]
-        return [CoachTask(**t) for t in tasks]
+        with self._lock:
+            if status:
+                rows = self._conn.execute(
+                    "SELECT status, data FROM coach_tasks WHERE status = ? ORDER BY rowid", (status,)
+                ).fetchall()
+            else:
+                rows = self._conn.execute("SELECT status, data FROM coach_tasks ORDER BY rowid").fetchall()
+        return [self._row_to_task(row) for row in rows]
+    
+    def count_tasks(self, status: Optional[str] = None) -> int:
+        with self._lock:
+            if status:
+                row = self._conn.execute("SELECT COUNT(*) FROM coach_tasks WHERE status = ?", (status,)).fetchone()
+            else:
+                row = self._conn.execute("SELECT COUNT(*) FROM coach_tasks").fetchone()
+        return row[0]
 
 
 class CoachService:
     """Coach Agent - 负责生成任务、观察和评估"""
     
-    def __init__(self, dao: MemoryDAO, learner_service: LearnerService, model_name: str = "gpt-4.1-mini"):
+    def __init__(
+        self,
+        dao: MemoryDAO,
+        learner_service: LearnerService,
+        model_name: Optional[str] = None,
+        provider: Optional[str] = None,
+        node_models: Optional[Dict[str, str]] = None,
+        outcome_classifier: Optional[OutcomeClassifier] = None,
+        checkpoints: Optional[GraphCheckpoints] = None
+    ):
         self.dao = dao
         self.coach_storage = CoachStorage(data_dir=dao.data_dir)
         self.learner_service = learner_service
-        self.llm = ChatOpenAI(model=model_name, temperature=0.5)
-        self.learner_llm = ChatOpenAI(model=model_name, temperature=0.7) # 模拟 Learner Agent
+        # 成功/失败判定只返回一个词，默认使用小模型
+        self.llm = ModelRouter(
+            "coach",
+            model_name,
+            temperature=0.5,
+            provider=provider,
+            node_models=node_models if node_models is not None else {"evaluate_outcome": CHEAP_MODEL_NAME}
+        )
+        self.learner_llm = ModelRouter("coach_learner", model_name, temperature=0.7, provider=provider) # 模拟 Learner Agent
+        # 本地成功/失败分类器（可选），置信度不足时才调用 LLM
+        self.outcome_classifier = outcome_classifier
         
         # Coach Agent 的 LangGraph
         self.graph = self._build_graph()
         
-    def _build_graph(self) -> StateGraph:
-        """构建 Coach Agent 的工作流"""
+        # 检查点（可选）：每个节点完成后保存状态，中断的任务再次运行时跳过已完成的节点
+        self.checkpoints = checkpoints
+        self._checkpointed_graph = None
         
-        class CoachGraphState(BaseModel):
-            task: CoachTask
-            session: Optional[Session] = None
-            
+    def _build_graph(self, checkpointer=None) -> StateGraph:
+        """构建 Coach Agent 的工作流"""
         workflow = StateGraph(CoachGraphState)
         
-        workflow.add_node("execute_task", self._execute_task)
-        workflow.add_node("evaluate_result", self._evaluate_result)
-        workflow.add_node("learn_from_session", self._learn_from_session)
+        workflow.add_node("execute_task", traced("coach.execute_task")(self._execute_task))
+        workflow.add_node("evaluate_result", traced("coach.evaluate_result")(self._evaluate_result))
+        workflow.add_node("learn_from_session", traced("coach.learn_from_session")(self._learn_from_session))
         
         workflow.set_entry_point("execute_task")
         workflow.add_edge("execute_task", "evaluate_result")
         workflow.add_edge("evaluate_result", "learn_from_session")
         workflow.add_edge("learn_from_session", END)
         
-        return workflow.compile()
+        return workflow.compile(checkpointer=checkpointer)
+    
+    async def _graph_with_checkpoints(self):
+        """带检查点的工作流（第一次使用时编译）"""
+        if self._checkpointed_graph is None:
+            self._checkpointed_graph = self._build_graph(await self.checkpoints.saver())
+        return self._checkpointed_graph
+    
+    @staticmethod
+    def _thread_id(task_id: str) -> str:
+        return f"coach:{task_id}"
         
     async def generate_task(self, business_goal: str) -> CoachTask:
         """生成一个有益的任务"""
@@ -98,7 +458,7 @@ Learner Agent 的目标是积累技能（SOP/Workflow）和规则（约束）。
 }}
 """
         
-        response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="generate_task")
         content = response.content.strip()
         
         if "```json" in content:
@@ -114,18 +474,222 @@ Learner Agent 的目标是积累技能（SOP/Workflow）和规则（约束）。
             difficulty=data["difficulty"],
             status="pending"
         )
-        self.coach_storage.save_task(task)
+        await asyncio.to_thread(self.coach_storage.save_task, task)
         return task
-        
+
+    async def generate_curriculum(
+        self,
+        business_goal: str,
+        n: int = 20,
+        difficulty_mix: Optional[Dict[str, float]] = None,
+        batch_size: int = 20,
+        similarity_threshold: float = 0.9,
+        max_rounds: int = 3
+    ) -> List[CoachTask]:
+        """
+        批量生成一组任务（课程）。
+
+        每次 LLM 调用以 JSON 数组返回最多 batch_size 个任务，多个批次并发请求；
+        与已有任务或本批其他任务的哈希 n-gram 余弦相似度不低于
+        similarity_threshold 的任务视为重复而丢弃，缺口在下一轮补齐
+        （最多 max_rounds 轮）。全部任务最后一次性写入存储。
+
+        Args:
+            business_goal: 业务目标
+            n: 要生成的任务数
+            difficulty_mix: 各难度的比例，默认 DEFAULT_DIFFICULTY_MIX
+            batch_size: 每次 LLM 调用生成的任务数
+            similarity_threshold: 判定为重复的相似度阈值
+            max_rounds: 去重后补齐缺口的最大轮数
+        """
+        remaining = self._difficulty_quota(n, difficulty_mix or DEFAULT_DIFFICULTY_MIX)
+        existing = [t.task_description for t in await asyncio.to_thread(self.coach_storage.list_tasks)]
+        seen_vectors = [hashed_vector(text) for text in existing]
+        accepted: List[CoachTask] = []
+
+        for _ in range(max_rounds):
+            if not sum(remaining.values()):
+                break
+            chunks = self._curriculum_chunks(remaining, batch_size)
+            avoid = existing[-10:] + [t.task_description for t in accepted[-10:]]
+            results = await asyncio.gather(
+                *(self._generate_task_batch(business_goal, chunk, avoid, i + 1)
+                  for i, chunk in enumerate(chunks)),
+                return_exceptions=True
+            )
+
+            for items in results:
+                if isinstance(items, Exception):
+                    logger.warning("批量生成任务失败: %s", items)
+                    continue
+                for item in items:
+                    description = str(item.get("task_description", "")).strip()
+                    difficulty = item.get("difficulty")
+                    # LLM 输出不可信：difficulty 可能缺失、非字符串或不在配额中
+                    if not description or not isinstance(difficulty, str) or remaining.get(difficulty, 0) <= 0:
+                        continue
+                    vector = hashed_vector(description)
+                    if any(cosine_similarity(vector, other) >= similarity_threshold for other in seen_vectors):
+                        continue
+                    seen_vectors.append(vector)
+                    remaining[difficulty] -= 1
+                    accepted.append(CoachTask(
+                        business_goal=business_goal,
+                        task_description=description,
+                        difficulty=difficulty,
+                        status="pending"
+                    ))
+
+        if accepted:
+            await asyncio.to_thread(self.coach_storage.save_tasks, accepted)
+        return accepted
+
+    @staticmethod
+    def _difficulty_quota(n: int, difficulty_mix: Dict[str, float]) -> Dict[str, int]:
+        """按比例把 n 分配到各难度（最大余数法，总数恰好为 n）"""
+        total = sum(weight for weight in difficulty_mix.values() if weight > 0)
+        if total <= 0:
+            raise ValueError("difficulty_mix must contain a positive weight")
+        shares = {
+            level: n * max(difficulty_mix.get(level, 0.0), 0.0) / total
+            for level in ("easy", "medium", "hard")
+        }
+        quota = {level: int(share) for level, share in shares.items()}
+        leftover = n - sum(quota.values())
+        for level in sorted(shares, key=lambda l: shares[l] - quota[l], reverse=True)[:leftover]:
+            quota[level] += 1
+        return quota
+
+    @staticmethod
+    def _curriculum_chunks(remaining: Dict[str, int], batch_size: int) -> List[Dict[str, int]]:
+        """把各难度的缺口切分为每批不超过 batch_size 个任务"""
+        chunks: List[Dict[str, int]] = []
+        current: Dict[str, int] = {}
+        for level, count in remaining.items():
+            while count > 0:
+                room = batch_size - sum(current.values())
+                take = min(room, count)
+                current[level] = current.get(level, 0) + take
+                count -= take
+                if sum(current.values()) >= batch_size:
+                    chunks.append(current)
+                    current = {}
+        if current:
+            chunks.append(current)
+        return chunks
+
+    async def _generate_task_batch(
+        self,
+        business_goal: str,
+        counts: Dict[str, int],
+        avoid: List[str],
+        batch_number: int
+    ) -> List[Dict[str, Any]]:
+        """一次 LLM 调用生成一批任务，返回 task_description/difficulty 字典列表"""
+        quota_lines = "\n".join(f"- {level}: {count} 个" for level, count in counts.items() if count)
+        avoid_lines = "\n".join(f"- {text}" for text in avoid) or "（无）"
+
+        prompt = f"""
+你是一个经验丰富的 Coach Agent，你的目标是为 Learner Agent 批量生成一组有挑战性且有益的学习任务（第 {batch_number} 批）。
+Learner Agent 的目标是积累技能（SOP/Workflow）和规则（约束）。
+
+当前业务目标: {business_goal}
+
+请生成以下数量的任务，每个任务都必须具体、可执行，并且彼此明显不同：
+{quota_lines}
+
+不要生成与以下已有任务相似的任务：
+{avoid_lines}
+
+输出 JSON 数组格式：
+[
+    {{"task_description": "具体的任务描述", "difficulty": "easy" | "medium" | "hard"}}
+]
+"""
+
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="generate_curriculum")
+        content = response.content.strip()
+
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+
+        data = json.loads(content)
+        if isinstance(data, dict):
+            data = data.get("tasks", [])
+        return [item for item in data if isinstance(item, dict)]
+
     async def run_task(self, task: CoachTask) -> CoachTask:
-        """运行 Coach 任务"""
-        
+        """运行 Coach 任务（先原子领取，任务不是 pending 时抛出 ValueError）"""
+        claimed = await asyncio.to_thread(self.coach_storage.claim_tasks, [task.task_id])
+        if not claimed:
+            raise ValueError(f"Task {task.task_id} is not pending")
+        return await self._run_claimed(claimed[0])
+    
+    async def run_tasks(
+        self,
+        task_ids: Optional[List[str]] = None,
+        status: str = "pending",
+        concurrency: int = 4,
+        limit: Optional[int] = None
+    ) -> CoachBatchResult:
+        """
+        并发运行一批任务。
+        
+        先一次性原子领取全部任务（标记为 running），再最多 concurrency 个同时
+        执行 LangGraph 工作流，因此同一任务不会被两个执行者（包括并发的批次）
+        重复执行。LLM 不可用的任务退回 pending。
+        
+        Args:
+            task_ids: 要运行的任务，默认所有状态为 status 的任务
+            status: 只领取该状态的任务（pending，或用 failed 重跑失败任务）
+            concurrency: 最大并发数
+            limit: 最多领取的任务数
+        """
+        tasks = await asyncio.to_thread(self.coach_storage.claim_tasks, task_ids, status, limit)
+        semaphore = asyncio.Semaphore(concurrency)
+        start = time.perf_counter()
+        
+        async def run(task: CoachTask) -> CoachTask:
+            async with semaphore:
+                try:
+                    return await self._run_claimed(task)
+                except Exception:
+                    # 状态已在 _run_claimed 中保存
+                    return task
+        
+        results = await asyncio.gather(*(run(task) for task in tasks))
+        elapsed = time.perf_counter() - start
+        
+        completed = [t for t in results if t.status == "completed"]
+        return CoachBatchResult(
+            claimed=len(tasks),
+            completed=len(completed),
+            failed=len([t for t in results if t.status == "failed"]),
+            deferred=len([t for t in results if t.status == "pending"]),
+            elapsed_seconds=round(elapsed, 3),
+            tasks_per_minute=round(len(completed) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+            tasks=results
+        )
+    
+    @traced("coach.run_task")
+    async def _run_claimed(
+        self,
+        task: CoachTask,
+        on_node: Optional[Callable[[str, str], None]] = None
+    ) -> CoachTask:
+        """运行已领取（状态为 running）的任务
+        
+        Args:
+            task: 已领取的任务
+            on_node: 节点进度回调 on_node(节点名, "running" | "done" | "failed")
+        """
         task.status = "running"
-        self.coach_storage.save_task(task)
         
         try:
             # 运行 LangGraph
-            result = await self.graph.ainvoke({"task": task})
+            result = await self._run_graph(task, on_node)
             
             # 更新任务状态
             final_task = result["task"]
@@ -133,15 +697,86 @@ Learner Agent 的目标是积累技能（SOP/Workflow）和规则（约束）。
             final_task.session_id = result["session"].session_id
             final_task.outcome = result["session"].outcome
             
-            self.coach_storage.save_task(final_task)
+            await asyncio.to_thread(self.coach_storage.save_task, final_task, "running")
             return final_task
             
+        except asyncio.CancelledError:
+            # 运行被取消：任务退回 pending，可以重新运行
+            task.status = "pending"
+            task.coach_feedback = "任务运行已取消"
+            await asyncio.to_thread(self.coach_storage.save_task, task, "running")
+            raise
+        except LLMUnavailableError as e:
+            # LLM 超时或熔断：任务退回 pending，等待稍后重新运行
+            task.status = "pending"
+            task.coach_feedback = f"LLM 暂不可用，任务已推迟: {e}"
+            await asyncio.to_thread(self.coach_storage.save_task, task, "running")
+            raise
         except Exception as e:
             task.status = "failed"
             task.coach_feedback = f"执行失败: {e}"
-            self.coach_storage.save_task(task)
+            await asyncio.to_thread(self.coach_storage.save_task, task, "running")
             raise
             
+    async def _run_graph(
+        self,
+        task: CoachTask,
+        on_node: Optional[Callable[[str, str], None]] = None
+    ) -> Dict[str, Any]:
+        """运行 Coach 工作流，返回最终状态；提供 on_node 时逐节点报告进度
+        
+        配置了检查点时，任务上次中断的运行会从未完成的节点继续，运行完成后
+        删除该任务的检查点。
+        """
+        graph = self.graph
+        graph_input: Optional[Dict[str, Any]] = {"task": task}
+        config = None
+        if self.checkpoints is not None:
+            graph = await self._graph_with_checkpoints()
+            thread_id = self._thread_id(task.task_id)
+            config = self.checkpoints.config(thread_id)
+            pending = await self.checkpoints.pending_nodes(graph, thread_id)
+            if pending:
+                # 从中断处继续：已完成的节点不再执行
+                graph_input = None
+                self.checkpoints.resumed += 1
+                if on_node is not None:
+                    for node in COACH_NODES[:COACH_NODES.index(pending[0])]:
+                        on_node(node, "done")
+        
+        if on_node is None:
+            result = await graph.ainvoke(graph_input, config)
+        else:
+            result = {}
+            async for mode, chunk in graph.astream(graph_input, config, stream_mode=["tasks", "values"]):
+                if mode == "values":
+                    result = chunk
+                elif "input" in chunk:
+                    on_node(chunk["name"], "running")
+                else:
+                    on_node(chunk["name"], "failed" if chunk.get("error") else "done")
+        
+        if self.checkpoints is not None:
+            await self.checkpoints.delete(self._thread_id(task.task_id))
+        return result
+    
+    async def recover_orphaned_tasks(self) -> Dict[str, List[str]]:
+        """
+        启动时处理上次进程退出时仍为 running 的任务：全部退回 pending。
+        有检查点的任务归入 resumable（再次运行时从中断的节点继续），其余归入 reset。
+        
+        只应在没有其他进程运行同一批任务时调用（例如单进程部署的启动阶段）。
+        """
+        recovered: Dict[str, List[str]] = {"resumable": [], "reset": []}
+        for task in await asyncio.to_thread(self.coach_storage.list_tasks, "running"):
+            resumable = False
+            if self.checkpoints is not None:
+                graph = await self._graph_with_checkpoints()
+                resumable = bool(await self.checkpoints.pending_nodes(graph, self._thread_id(task.task_id)))
+            if await asyncio.to_thread(self.coach_storage.transition, task.task_id, "running", "pending"):
+                recovered["resumable" if resumable else "reset"].append(task.task_id)
+        return recovered
+            
     async def _execute_task(self, state: CoachGraphState) -> CoachGraphState:
         """模拟 Learner Agent 执行任务"""
         task = state.task
@@ -159,38 +794,54 @@ Learner Agent 的目标是积累技能（SOP/Workflow）和规则（约束）。
         response = await self.learner_llm.ainvoke([
             SystemMessage(content=system_prompt),
             HumanMessage(content=task.task_description)
-        ])
+        ], node="execute_task")
         
         messages.append(Message(role="assistant", content=response.content))
         
-        # 模拟 Coach Agent 评估任务结果
+        # 模拟 Coach Agent 评估任务结果（本地分类器足够确定时不调用 LLM）
+        if self.outcome_classifier:
+            outcome, source = await self.outcome_classifier.classify_with_source(
+                session_text(task.task_description, messages),
+                lambda: self._evaluate_outcome(task, response.content)
+            )
+        else:
+            outcome, source = await self._evaluate_outcome(task, response.content), "llm"
+            
+        # 创建会话（记录结果标签的来源，本地分类器给出的标签不用于再训练分类器）
+        session = Session(
+            task=task.task_description,
+            messages=messages,
+            outcome=outcome,
+            metadata={OUTCOME_SOURCE_KEY: source}
+        )
+        await self.dao.save_session(session)
+        
+        state.session = session
+        return state
+        
+    async def _evaluate_outcome(self, task: CoachTask, final_response: str) -> str:
+        """使用 LLM 判断 Learner Agent 是否完成了任务，返回 success 或 failure"""
         evaluation_prompt = f"""
 Learner Agent 尝试完成以下任务：
 任务描述: {task.task_description}
 
 Learner Agent 的最终回复:
-{response.content}
+{final_response}
 
 请以 Coach Agent 的身份，严格评估 Learner Agent 的回复是否成功完成了任务。
 如果成功，返回 "success"。如果失败或不完整，返回 "failure"。
 只需要返回 "success" 或 "failure"，不要其他内容。
 """
-        evaluation_response = await self.llm.ainvoke([HumanMessage(content=evaluation_prompt)])
+        evaluation_response = await self.llm.ainvoke(
+            [HumanMessage(content=evaluation_prompt)],
+            node="evaluate_outcome",
+            validator=is_one_of("success", "failure")
+        )
         outcome = evaluation_response.content.strip().lower()
         
         if outcome not in ["success", "failure"]:
             outcome = "failure" # 默认失败
-            
-        # 创建会话
-        session = Session(
-            task=task.task_description,
-            messages=messages,
-            outcome=outcome
-        )
-        await self.dao.save_session(session)
-        
-        state.session = session
-        return state
+        return outcome
         
     async def _evaluate_result(self, state: CoachGraphState) -> CoachGraphState:
         """Coach Agent 评估并生成反馈"""
@@ -203,13 +854,13 @@ Learner Agent 的最终回复:
 执行结果: {session.outcome}
 
 Learner Agent 的对话:
-{self.learner._format_messages(session.messages)}
+{format_messages(session.messages)}
 
 请根据执行结果，为 Learner Agent 生成一个详细的反馈和总结。
 如果成功，总结成功的关键步骤。如果失败，指出失败的原因和改进方向。
 """
         
-        response = await self.llm.ainvoke([HumanMessage(content=prompt)])
+        response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="evaluate_result")
         state.task.coach_feedback = response.content.strip()
         return state
         
@@ -231,30 +882,32 @@ Learner Agent 的对话:
         
         return state
         
-    def get_state(self) -> CoachState:
-        """获取 Coach 模块的统计状态"""
-        tasks = self.coach_storage.list_tasks()
-        
-        total_tasks = len(tasks)
-        completed_tasks = len([t for t in tasks if t.status == "completed"])
-        successful_tasks = len([t for t in tasks if t.outcome == "success"])
-        failed_tasks = len([t for t in tasks if t.outcome == "failure"])
-        
-        skills_gained = len([t for t in tasks if t.learned_skill_id])
-        rules_gained = len([t for t in tasks if t.learned_rule_id])
-        
-        return CoachState(
-            total_tasks=total_tasks,
-            completed_tasks=completed_tasks,
-            successful_tasks=successful_tasks,
-            failed_tasks=failed_tasks,
-            skills_gained=skills_gained,
-            rules_gained=rules_gained,
-            last_update=datetime.now()
-        )
+    async def get_state(self) -> CoachState:
+        """获取 Coach 模块的统计状态（读取物化的计数，不扫描任务）"""
+        return CoachState(**await asyncio.to_thread(self.coach_storage.get_stats))
+    
+    async def get_state_breakdown(self, by: str = "business_goal") -> Dict[str, CoachState]:
+        """按业务目标（business_goal）或难度（difficulty）分组的统计状态"""
+        if by not in ("business_goal", "difficulty"):
+            raise ValueError(f"Unknown breakdown: {by}")
+        return {
+            key: CoachState(**stats)
+            for key, stats in (await asyncio.to_thread(self.coach_storage.get_stats_breakdown, by)).items()
+        }
+    
+    async def rebuild_state(self) -> CoachState:
+        """从任务重新计算物化的统计（用于修复计数）"""
+        await asyncio.to_thread(self.coach_storage.rebuild_stats)
+        return await self.get_state()
         
-    def list_tasks(self, status: Optional[str] = None) -> List[CoachTask]:
+    async def get_task(self, task_id: str) -> Optional[CoachTask]:
+        """按 ID 获取 Coach 任务"""
+        return await asyncio.to_thread(self.coach_storage.get_task, task_id)
+        
+    async def list_tasks(self, status: Optional[str] = None) -> List[CoachTask]:
         """列出 Coach 任务"""
-        return self.coach_storage.list_tasks(status=status)
-
-from pathlib import Path
+        return await asyncio.to_thread(self.coach_storage.list_tasks, status)
+    
+    def close(self) -> None:
+        """关闭 Coach 任务存储"""
+        self.coach_storage.close()
@@ -0,0 +1,131 @@
+"""反馈合并窗口 - 将同一会话短时间内的多条反馈合并为一次学习"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+from ..models import Feedback
+from .learner_service import LearnerService
+
+
+logger = logging.getLogger(__name__)
+
+class _PendingBatch:
+    """某个会话窗口内尚未处理的反馈"""
+
+    def __init__(self):
+        self.feedbacks: List[Feedback] = []
+        self.futures: List[asyncio.Future] = []
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.deadline = 0.0
+
+
+class FeedbackCoalescer:
+    """
+    按 session_id 合并反馈的去抖动层。
+
+    同一会话的反馈被收集到一起，直到 window_seconds 内没有新的反馈到达
+    （每条新反馈重新计时，但从第一条起最多等待 max_wait_seconds），或达到
+    max_batch_size 时，调用一次 LearnerService.learn_from_feedbacks，
+    再把每条反馈各自的学习结果返回给对应的调用方。
+
+    用法:
+        coalescer = FeedbackCoalescer(learner_service, window_seconds=2.0)
+        learned_id = await coalescer.submit(feedback)  # 等待学习结果
+        coalescer.enqueue(feedback)                    # 不等待，在后台学习
+
+    Args:
+        learner_service: 学习服务
+        window_seconds: 去抖动窗口（秒）
+        max_batch_size: 每批反馈数上限
+        max_wait_seconds: 从第一条反馈起的最长等待时间，默认 window_seconds 的 5 倍
+    """
+
+    def __init__(
+        self,
+        learner_service: LearnerService,
+        window_seconds: float = 2.0,
+        max_batch_size: int = 20,
+        max_wait_seconds: Optional[float] = None
+    ):
+        self.learner_service = learner_service
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds if max_wait_seconds is not None else window_seconds * 5
+        self._pending: Dict[str, _PendingBatch] = {}
+        self._flushing: set = set()
+
+        # 统计
+        self.batches = 0
+        self.feedbacks = 0
+
+    @property
+    def pending_count(self) -> int:
+        """等待合并的反馈数"""
+        return sum(len(batch.feedbacks) for batch in self._pending.values())
+
+    async def submit(self, feedback: Feedback) -> Optional[str]:
+        """提交一条反馈，等待所在窗口学习完成后返回学到的 skill_id 或 rule_id"""
+        return await self._add(feedback)
+
+    def enqueue(self, feedback: Feedback) -> None:
+        """提交一条反馈但不等待学习结果；学习失败只记录日志"""
+        self._add(feedback).add_done_callback(self._log_failure)
+
+    def _add(self, feedback: Feedback) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(feedback.session_id)
+        if batch is None:
+            batch = _PendingBatch()
+            batch.deadline = loop.time() + self.max_wait_seconds
+            self._pending[feedback.session_id] = batch
+
+        future = loop.create_future()
+        batch.feedbacks.append(feedback)
+        batch.futures.append(future)
+
+        if len(batch.feedbacks) >= self.max_batch_size:
+            self._schedule_flush(feedback.session_id)
+        else:
+            # 去抖动：每条新反馈重新计时，但不超过第一条反馈的最长等待时间
+            if batch.timer:
+                batch.timer.cancel()
+            delay = min(self.window_seconds, max(batch.deadline - loop.time(), 0.0))
+            batch.timer = loop.call_later(delay, self._schedule_flush, feedback.session_id)
+        return future
+
+    @staticmethod
+    def _log_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("反馈学习失败: %s", future.exception())
+
+    def _schedule_flush(self, session_id: str) -> None:
+        batch = self._pending.pop(session_id, None)
+        if batch is None:
+            return
+        if batch.timer:
+            batch.timer.cancel()
+        task = asyncio.ensure_future(self._flush(batch))
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: _PendingBatch) -> None:
+        self.batches += 1
+        self.feedbacks += len(batch.feedbacks)
+        try:
+            results = await self.learner_service.learn_from_feedbacks(batch.feedbacks)
+        except Exception as e:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for feedback, future in zip(batch.feedbacks, batch.futures):
+            if not future.done():
+                future.set_result(results.get(feedback.feedback_id))
+
+    async def flush_all(self) -> None:
+        """立即处理所有等待中的反馈（例如在关闭服务前）"""
+        for session_id in list(self._pending):
+            self._schedule_flush(session_id)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
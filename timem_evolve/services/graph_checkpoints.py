@@ -0,0 +1,76 @@
+"""LangGraph 工作流的 SQLite 检查点 - 进程重启后从最后完成的节点继续运行"""
+import asyncio
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import aiosqlite
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+from .. import models
+
+
+def _model_allowlist():
+    """允许从检查点反序列化的数据模型（图状态中保存的 CoachTask、Session 等）"""
+    return [
+        (cls.__module__, cls.__name__)
+        for cls in (getattr(models, name) for name in models.__all__)
+        if isinstance(cls, type)
+    ]
+
+
+class GraphCheckpoints:
+    """
+    LangGraph 检查点存储（AsyncSqliteSaver 的封装）。
+
+    每个节点完成后图状态写入 SQLite；同一个 thread_id 的运行中断（异常、取消、
+    进程重启）后再次运行时，从未完成的节点继续，已完成节点的 LLM 调用不会重发。
+    AsyncSqliteSaver 必须在事件循环中创建，因此第一次使用时才打开连接。
+
+    Args:
+        path: 检查点数据库文件
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._saver: Optional[AsyncSqliteSaver] = None
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self.resumed = 0
+
+    async def saver(self) -> AsyncSqliteSaver:
+        """获取（必要时创建）检查点存储"""
+        if self._saver is None:
+            if self._lock is None:
+                self._lock = asyncio.Lock()
+            async with self._lock:
+                if self._saver is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self._conn = await aiosqlite.connect(self.path)
+                    saver = AsyncSqliteSaver(
+                        self._conn,
+                        serde=JsonPlusSerializer(allowed_msgpack_modules=_model_allowlist())
+                    )
+                    await saver.setup()
+                    self._saver = saver
+        return self._saver
+
+    @staticmethod
+    def config(thread_id: str) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": thread_id}}
+
+    async def pending_nodes(self, graph, thread_id: str) -> Tuple[str, ...]:
+        """线程中尚未完成的节点；没有检查点或上次运行已完成时返回空元组"""
+        snapshot = await graph.aget_state(self.config(thread_id))
+        return tuple(snapshot.next)
+
+    async def delete(self, thread_id: str) -> None:
+        """运行完成后删除线程的检查点"""
+        saver = await self.saver()
+        await saver.adelete_thread(thread_id)
+
+    async def close(self) -> None:
+        if self._conn is not None:
+            await self._conn.close()
+        self._conn = None
+        self._saver = None
@@ -1,20 +1,53 @@
 """学习器 - 从会话和反馈中提炼技能和规则"""
 import json
-from typing import Optional
-from langchain_openai import ChatOpenAI
+from typing import Optional, Dict, List
 from langchain_core.messages import HumanMessage
 
-from ..models import Session, Skill, Rule, Feedback, Workflow, Message
+from ..models import Session, Skill, Rule, Feedback, Workflow, Message, LearnedArtifacts
 from ..dao.memory_dao import MemoryDAO
+from ..llm import ModelRouter, CHEAP_MODEL_NAME, LLMUnavailableError
+from ..observability import span, traced
+from .transcript_packer import TranscriptPacker
+from .session_summarizer import SessionSummarizer
+from .turn_batcher import TurnBatcher
 
 
 class LearnerService:
     """经验学习器"""
     
-    def __init__(self, dao: MemoryDAO, model_name: str = "gpt-4.1-mini"):
+    def __init__(
+        self,
+        dao: MemoryDAO,
+        model_name: Optional[str] = None,
+        packer: Optional[TranscriptPacker] = None,
+        provider: Optional[str] = None,
+        node_models: Optional[Dict[str, str]] = None,
+        micro_batch_size: int = 0,
+        micro_batch_wait: float = 0.05
+    ):
+        """
+        Args:
+            micro_batch_size: 大于 1 时启用微批处理模式，并发的单轮提炼请求
+                （可跨会话）最多按该数量打包进一次 LLM 调用
+            micro_batch_wait: 微批处理模式下凑批的最长等待时间（秒）
+        """
         self.dao = dao
-        self.llm = ChatOpenAI(model=model_name, temperature=0.7)
+        # 会话摘要只需压缩信息，默认使用小模型
+        self.llm = ModelRouter(
+            "learner",
+            model_name,
+            temperature=0.7,
+            provider=provider,
+            node_models=node_models if node_models is not None else {"summarize": CHEAP_MODEL_NAME}
+        )
+        self.packer = packer or TranscriptPacker()
+        self.summarizer = SessionSummarizer(dao, self.llm, packer=self.packer)
+        self.turn_batcher = (
+            TurnBatcher(self, max_batch_size=micro_batch_size, max_wait_seconds=micro_batch_wait)
+            if micro_batch_size > 1 else None
+        )
     
+    @traced("learner.learn_from_feedback")
     async def learn_from_feedback(self, feedback: Feedback) -> Optional[str]:
         """从单轮反馈中学习
         
@@ -30,9 +63,13 @@ class LearnerService:
         if feedback.message_index < 0 or feedback.message_index >= len(session.messages):
             return None
         
-        # 构建上下文：前面的消息 + 当前这一轮
-        context_messages = session.messages[:feedback.message_index + 1]
-        current_turn = self._extract_dialog_turn(context_messages, feedback.message_index)
+        # 构建上下文：早前对话的滚动摘要 + 最近几条消息 + 当前这一轮
+        with span("learner.build_context"):
+            context_messages = session.messages[:feedback.message_index + 1]
+            context = await self.summarizer.build_context(session, feedback.message_index)
+            current_turn = self._extract_dialog_turn(
+                context_messages, feedback.message_index, context=context
+            )
         
         if feedback.rating == "positive":
             # 好评 -> 提炼技能
@@ -42,16 +79,7 @@ class LearnerService:
                 feedback_comment=feedback.comment
             )
             if skill:
-                skill.source_sessions = [session.session_id]
-                skill.metadata["feedback_id"] = feedback.feedback_id
-                self.dao.save_skill(skill)
-                
-                # 更新反馈状态
-                feedback.learned = True
-                feedback.learned_skill_id = skill.skill_id
-                self.dao.save_feedback(feedback)
-                
-                return skill.skill_id
+                return await self._save_skill_for_feedback(skill, session, feedback)
         else:
             # 差评 -> 提炼规则
             rule = await self._extract_rule_from_turn(
@@ -60,21 +88,204 @@ class LearnerService:
                 feedback_comment=feedback.comment
             )
             if rule:
-                rule.source_sessions = [session.session_id]
-                rule.metadata["feedback_id"] = feedback.feedback_id
-                self.dao.save_rule(rule)
-                
-                # 更新反馈状态
-                feedback.learned = True
-                feedback.learned_rule_id = rule.rule_id
-                self.dao.save_feedback(feedback)
-                
-                return rule.rule_id
+                return await self._save_rule_for_feedback(rule, session, feedback)
         
         return None
     
-    def _extract_dialog_turn(self, messages: list, current_index: int) -> dict:
-        """提取对话轮次"""
+    async def _save_skill_for_feedback(self, skill: Skill, session: Session, feedback: Feedback) -> str:
+        """保存从反馈中学到的技能并更新反馈状态"""
+        skill.source_sessions = [session.session_id]
+        skill.metadata["feedback_id"] = feedback.feedback_id
+        await self.dao.save_skill(skill)
+        
+        # 更新反馈状态
+        feedback.learned = True
+        feedback.learned_skill_id = skill.skill_id
+        await self.dao.save_feedback(feedback)
+        
+        return skill.skill_id
+    
+    async def _save_rule_for_feedback(self, rule: Rule, session: Session, feedback: Feedback) -> str:
+        """保存从反馈中学到的规则并更新反馈状态"""
+        rule.source_sessions = [session.session_id]
+        rule.metadata["feedback_id"] = feedback.feedback_id
+        await self.dao.save_rule(rule)
+        
+        # 更新反馈状态
+        feedback.learned = True
+        feedback.learned_rule_id = rule.rule_id
+        await self.dao.save_feedback(feedback)
+        
+        return rule.rule_id
+    
+    @traced("learner.learn_from_feedbacks")
+    async def learn_from_feedbacks(self, feedbacks: List[Feedback]) -> Dict[str, Optional[str]]:
+        """从同一会话的多条反馈中一次性学习
+        
+        所有被评价的轮次放进同一个提示词，一次 LLM 调用返回多个技能和规则，
+        再按轮次映射回各条反馈。模型漏掉或返回无效内容的轮次单独重试。
+        
+        Returns:
+            feedback_id -> 学到的 skill_id 或 rule_id
+        """
+        results: Dict[str, Optional[str]] = {f.feedback_id: None for f in feedbacks}
+        if not feedbacks:
+            return results
+        if len({f.session_id for f in feedbacks}) > 1:
+            raise ValueError("learn_from_feedbacks expects feedbacks from a single session")
+        if len(feedbacks) == 1:
+            results[feedbacks[0].feedback_id] = await self.learn_from_feedback(feedbacks[0])
+            return results
+        
+        session = await self.dao.get_session(feedbacks[0].session_id)
+        if not session:
+            return results
+        
+        valid = [f for f in feedbacks if 0 <= f.message_index < len(session.messages)]
+        if not valid:
+            return results
+        valid.sort(key=lambda f: f.message_index)
+        
+        # 上下文只构建一次，覆盖到最后一个被评价轮次之前，每个轮次都能看到自己之前的对话
+        context = await self.summarizer.build_context(session, valid[-1].message_index)
+        turns = [
+            self._extract_dialog_turn(session.messages, f.message_index, context="")
+            for f in valid
+        ]
+        
+        items = await self._extract_from_turns(session.task, context, turns, valid)
+        
+        retry = []
+        for number, feedback in enumerate(valid, start=1):
+            item = items.get(number)
+            try:
+                if feedback.rating == "positive" and item and item.get("type") == "skill":
+                    skill = self._skill_from_data(item)
+                    results[feedback.feedback_id] = await self._save_skill_for_feedback(skill, session, feedback)
+                elif feedback.rating == "negative" and item and item.get("type") == "rule":
+                    rule = self._rule_from_data(item)
+                    results[feedback.feedback_id] = await self._save_rule_for_feedback(rule, session, feedback)
+                else:
+                    retry.append(feedback)
+            except Exception as e:
+                print(f"批量学习结果无效（轮次 {number}）: {e}")
+                retry.append(feedback)
+        
+        for feedback in retry:
+            results[feedback.feedback_id] = await self.learn_from_feedback(feedback)
+        
+        return results
+    
+    async def _extract_from_turns(
+        self,
+        task: str,
+        context: str,
+        turns: List[dict],
+        feedbacks: List[Feedback]
+    ) -> Dict[int, dict]:
+        """一次调用从多个被评价的轮次中提炼技能和规则，返回 轮次编号 -> 结果"""
+        sections = []
+        for number, (turn, feedback) in enumerate(zip(turns, feedbacks), start=1):
+            label = "好评" if feedback.rating == "positive" else "差评"
+            sections.append(f"""### 轮次 {number}（{label}）
+用户: {turn['user_message']}
+AI: {turn['ai_response']}
+用户反馈: {feedback.comment or label}""")
+        turns_text = "\n\n".join(sections)
+        
+        prompt = f"""
+以下是同一个会话中被用户评价的多个对话轮次。请逐个分析：
+好评的轮次提炼一个可复用的技能，差评的轮次提炼一个约束规则。
+
+任务背景: {task}
+
+对话上下文:
+{context}
+
+被评价的轮次:
+{turns_text}
+
+以 JSON 格式返回，每个轮次对应 items 中的一项：
+{{
+    "items": [
+        {{
+            "turn": 1,
+            "type": "skill",
+            "name": "技能名称",
+            "description": "技能描述",
+            "steps": ["步骤1", "步骤2", "步骤3"],
+            "sop": "详细的标准操作流程描述",
+            "confidence": 0.8
+        }},
+        {{
+            "turn": 2,
+            "type": "rule",
+            "name": "规则名称",
+            "description": "规则描述",
+            "constraint": "约束条件",
+            "reason": "原因说明",
+            "confidence": 0.8
+        }}
+    ]
+}}
+
+只返回 JSON，不要其他内容。
+"""
+        
+        try:
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_from_turns")
+            data = self._parse_json(response.content)
+            return {
+                int(item["turn"]): item
+                for item in data.get("items", [])
+                if isinstance(item, dict) and "turn" in item
+            }
+        except LLMUnavailableError:
+            # 超时或熔断交给调用方处理（返回未学习的反馈、稍后重试），不当作无效回复
+            raise
+        except Exception as e:
+            print(f"批量提炼失败: {e}")
+            return {}
+    
+    @traced("learner.parse_json")
+    def _parse_json(self, content: str):
+        """从 LLM 回复中提取 JSON"""
+        content = content.strip()
+        if "```json" in content:
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif "```" in content:
+            content = content.split("```")[1].split("```")[0].strip()
+        return json.loads(content)
+    
+    def _skill_from_data(self, data: dict) -> Skill:
+        """由 LLM 返回的字段构建技能"""
+        return Skill(
+            name=data["name"],
+            description=data["description"],
+            workflow=Workflow(
+                steps=data["steps"],
+                sop=data["sop"]
+            ),
+            confidence=data.get("confidence", 0.7)
+        )
+    
+    def _rule_from_data(self, data: dict) -> Rule:
+        """由 LLM 返回的字段构建规则"""
+        return Rule(
+            name=data["name"],
+            description=data["description"],
+            constraint=data["constraint"],
+            reason=data["reason"],
+            confidence=data.get("confidence", 0.7)
+        )
+    
+    def _extract_dialog_turn(
+        self,
+        messages: list,
+        current_index: int,
+        context: Optional[str] = None
+    ) -> dict:
+        """提取对话轮次（未提供上下文时按 token 预算打包前面的消息）"""
         # 找到当前 AI 回复对应的用户消息
         user_msg = None
         ai_msg = messages[current_index]
@@ -90,25 +301,23 @@ class LearnerService:
         return {
             "user_message": user_msg.content if user_msg else "",
             "ai_response": ai_msg.content if hasattr(ai_msg, 'content') else ai_msg.get('content', ''),
-            "context": self._format_messages(messages[:current_index])
+            "context": context if context is not None else self.packer.pack(messages[:current_index])
         }
     
-    def _format_messages(self, messages) -> str:
-        """格式化消息"""
-        formatted = []
-        for msg in messages:
-            role = msg.role if hasattr(msg, 'role') else msg.get('role', 'unknown')
-            content = msg.content if hasattr(msg, 'content') else msg.get('content', '')
-            formatted.append(f"{role}: {content}")
-        return "\n".join(formatted)
+    def _pack_session(self, session: Session) -> str:
+        """在 token 预算内格式化整个会话"""
+        return self.packer.pack(session.messages, session_id=session.session_id)
     
     async def _extract_skill_from_turn(
         self, 
         task: str,
         dialog_turn: dict,
-        feedback_comment: Optional[str]
+        feedback_comment: Optional[str],
+        use_batch: bool = True
     ) -> Optional[Skill]:
         """从好评的对话轮次中提炼技能"""
+        if use_batch and self.turn_batcher:
+            return await self.turn_batcher.submit("skill", task, dialog_turn, feedback_comment)
         
         prompt = f"""
 基于以下用户好评的对话，提炼一个可复用的技能。
@@ -139,16 +348,8 @@ AI: {dialog_turn['ai_response']}
 """
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            content = response.content.strip()
-            
-            # 提取 JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(content)
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_skill_from_turn")
+            data = self._parse_json(response.content)
             
             return Skill(
                 name=data["name"],
@@ -159,6 +360,9 @@ AI: {dialog_turn['ai_response']}
                 ),
                 confidence=data.get("confidence", 0.7)
             )
+        except LLMUnavailableError:
+            # 超时或熔断交给调用方处理（返回未学习的反馈、稍后重试），不当作无效回复
+            raise
         except Exception as e:
             print(f"提炼技能失败: {e}")
             return None
@@ -167,9 +371,12 @@ AI: {dialog_turn['ai_response']}
         self,
         task: str,
         dialog_turn: dict,
-        feedback_comment: Optional[str]
+        feedback_comment: Optional[str],
+        use_batch: bool = True
     ) -> Optional[Rule]:
         """从差评的对话轮次中提炼规则"""
+        if use_batch and self.turn_batcher:
+            return await self.turn_batcher.submit("rule", task, dialog_turn, feedback_comment)
         
         prompt = f"""
 基于以下用户差评的对话，提炼一个约束规则。
@@ -200,16 +407,8 @@ AI: {dialog_turn['ai_response']}
 """
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            content = response.content.strip()
-            
-            # 提取 JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(content)
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_rule_from_turn")
+            data = self._parse_json(response.content)
             
             return Rule(
                 name=data["name"],
@@ -218,10 +417,14 @@ AI: {dialog_turn['ai_response']}
                 reason=data["reason"],
                 confidence=data.get("confidence", 0.7)
             )
+        except LLMUnavailableError:
+            # 超时或熔断交给调用方处理（返回未学习的反馈、稍后重试），不当作无效回复
+            raise
         except Exception as e:
             print(f"提炼规则失败: {e}")
             return None
     
+    @traced("learner.extract_skill_from_session")
     async def extract_skill_from_session(self, session: Session) -> Optional[Skill]:
         """从成功的完整会话中提炼技能"""
         
@@ -231,7 +434,7 @@ AI: {dialog_turn['ai_response']}
 任务: {session.task}
 
 会话消息:
-{self._format_messages(session.messages)}
+{self._pack_session(session)}
 
 请分析这个任务是如何成功完成的，并提炼成一个可复用的技能。
 
@@ -248,16 +451,8 @@ AI: {dialog_turn['ai_response']}
 """
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            content = response.content.strip()
-            
-            # 提取 JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(content)
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_skill_from_session")
+            data = self._parse_json(response.content)
             
             skill = Skill(
                 name=data["name"],
@@ -270,13 +465,14 @@ AI: {dialog_turn['ai_response']}
                 source_sessions=[session.session_id]
             )
             
-            self.dao.save_skill(skill)
+            await self.dao.save_skill(skill)
             return skill
             
         except Exception as e:
             print(f"提炼技能失败: {e}")
             return None
     
+    @traced("learner.extract_rule_from_session")
     async def extract_rule_from_session(self, session: Session) -> Optional[Rule]:
         """从失败的完整会话中提炼规则"""
         
@@ -286,7 +482,7 @@ AI: {dialog_turn['ai_response']}
 任务: {session.task}
 
 会话消息:
-{self._format_messages(session.messages)}
+{self._pack_session(session)}
 
 请分析这个任务为什么失败，并提炼成一个约束规则。
 
@@ -303,16 +499,8 @@ AI: {dialog_turn['ai_response']}
 """
         
         try:
-            response = await self.llm.ainvoke([HumanMessage(content=prompt)])
-            content = response.content.strip()
-            
-            # 提取 JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            data = json.loads(content)
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_rule_from_session")
+            data = self._parse_json(response.content)
             
             rule = Rule(
                 name=data["name"],
@@ -323,9 +511,93 @@ AI: {dialog_turn['ai_response']}
                 source_sessions=[session.session_id]
             )
             
-            self.dao.save_rule(rule)
+            await self.dao.save_rule(rule)
             return rule
             
         except Exception as e:
             print(f"提炼规则失败: {e}")
             return None
+    
+    @traced("learner.extract_artifacts_from_session")
+    async def extract_artifacts_from_session(
+        self,
+        session: Session,
+        min_confidence: float = 0.0
+    ) -> LearnedArtifacts:
+        """
+        一次调用从会话中同时提炼技能和规则。
+        
+        适用于结果混合（既有成功的做法又有失误）或结果未知的会话：模型可以返回
+        零个或多个技能、零个或多个规则，每项带独立的置信度。低于 min_confidence
+        或字段不完整的条目被丢弃，其余在一次 DAO 写入中保存。
+        """
+        prompt = f"""
+基于以下任务会话，同时提炼可复用的技能和需要避免的约束规则。
+
+任务: {session.task}
+会话结果: {session.outcome}
+
+会话消息:
+{self._pack_session(session)}
+
+会话中值得复用的做法提炼为技能，出现的失误提炼为规则。两类都可以有零条或多条，
+没有就返回空数组，不要为了凑数而编造。每一条给出独立的置信度（0-1）。
+
+以 JSON 格式返回：
+{{
+    "skills": [
+        {{
+            "name": "技能名称",
+            "description": "技能描述",
+            "steps": ["步骤1", "步骤2", "步骤3"],
+            "sop": "详细的标准操作流程描述",
+            "confidence": 0.8
+        }}
+    ],
+    "rules": [
+        {{
+            "name": "规则名称",
+            "description": "规则描述",
+            "constraint": "约束条件",
+            "reason": "原因说明",
+            "confidence": 0.8
+        }}
+    ]
+}}
+
+只返回 JSON，不要其他内容。
+"""
+        
+        artifacts = LearnedArtifacts(session_id=session.session_id)
+        try:
+            response = await self.llm.ainvoke([HumanMessage(content=prompt)], node="extract_artifacts_from_session")
+            data = self._parse_json(response.content)
+            if not isinstance(data, dict):
+                raise ValueError(f"期望 JSON 对象，实际为 {type(data).__name__}")
+        except Exception as e:
+            print(f"提炼技能和规则失败: {e}")
+            return artifacts
+        
+        for item in data.get("skills") or []:
+            try:
+                skill = self._skill_from_data(item)
+            except Exception as e:
+                print(f"解析技能失败: {e}")
+                continue
+            if skill.confidence >= min_confidence:
+                skill.source_sessions = [session.session_id]
+                artifacts.skills.append(skill)
+        
+        for item in data.get("rules") or []:
+            try:
+                rule = self._rule_from_data(item)
+            except Exception as e:
+                print(f"解析规则失败: {e}")
+                continue
+            if rule.confidence >= min_confidence:
+                rule.source_sessions = [session.session_id]
+                artifacts.rules.append(rule)
+        
+        if artifacts.skills or artifacts.rules:
+            await self.dao.save_learned_artifacts(artifacts.skills, artifacts.rules)
+        return artifacts
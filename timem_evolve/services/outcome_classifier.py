@@ -0,0 +1,195 @@
+"""本地结果分类器 - 用已标注的会话训练，替代成功/失败判定的 LLM 调用"""
+import math
+import random
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from ..dao.memory_dao import MemoryDAO
+from ..models import Session
+from .text_features import DEFAULT_BUCKETS, hashed_ngrams, session_text
+
+
+LABELS = ("success", "failure")
+
+# 会话 metadata 中记录结果标签来源的键：human（用户提交）、llm（LLM 判定）、classifier（本地分类器）
+OUTCOME_SOURCE_KEY = "outcome_source"
+# 可用于训练的标签来源；本地分类器自己给出的标签不参与训练，避免自我强化
+TRAINABLE_SOURCES = ("human", "llm")
+
+
+def outcome_source(session: Session) -> str:
+    """会话结果标签的来源；未记录来源的会话视为用户提交"""
+    return session.metadata.get(OUTCOME_SOURCE_KEY, "human")
+
+
+class OutcomeClassifier:
+    """
+    基于哈希 n-gram 的朴素贝叶斯成功/失败分类器。
+
+    从 sessions 表中结果已知（success/failure）且标签来自用户或 LLM 的会话增量训练
+    （按会话时间的游标推进，每次只读取新会话）；判定时若最大后验概率达到 threshold
+    则直接返回本地结果，否则调用 LLM 兜底。按 audit_rate 的比例对本地判定的结果
+    也调用 LLM 抽查，用于统计与 LLM 的一致率。
+
+    Args:
+        dao: 训练数据来源；为 None 时只能通过 partial_fit 训练
+        threshold: 直接使用本地结果所需的置信度
+        min_samples: 每个类别至少需要的训练样本数，不足时总是回退到 LLM
+        refresh_seconds: 距上次训练超过该时间时，下一次判定前先增量训练
+        audit_rate: 本地判定后仍调用 LLM 对比的比例
+        buckets: 哈希桶数量
+        alpha: 拉普拉斯平滑系数
+    """
+
+    def __init__(
+        self,
+        dao: Optional[MemoryDAO] = None,
+        threshold: float = 0.95,
+        min_samples: int = 20,
+        refresh_seconds: float = 300.0,
+        audit_rate: float = 0.05,
+        buckets: int = DEFAULT_BUCKETS,
+        alpha: float = 1.0,
+        seed: Optional[int] = None
+    ):
+        self.dao = dao
+        self.threshold = threshold
+        self.min_samples = min_samples
+        self.refresh_seconds = refresh_seconds
+        self.audit_rate = audit_rate
+        self.buckets = buckets
+        self.alpha = alpha
+        self._rng = random.Random(seed)
+
+        self._docs: Dict[str, int] = {label: 0 for label in LABELS}
+        self._feature_counts: Dict[str, Dict[int, int]] = {label: {} for label in LABELS}
+        self._totals: Dict[str, int] = {label: 0 for label in LABELS}
+        # 训练游标：已训练到的会话时间，以及该时间上已训练过的会话（时间相同的会话可能分批读取）
+        self._cursor: Optional[str] = None
+        self._seen: Set[str] = set()
+        self._trained_at = 0.0
+
+        # 统计
+        self.calls = 0
+        self.avoided = 0
+        self.audits = 0
+        self.fallbacks = 0
+        self.compared = 0
+        self.agreed = 0
+
+    @property
+    def is_ready(self) -> bool:
+        """每个类别都有足够的训练样本"""
+        return all(self._docs[label] >= self.min_samples for label in LABELS)
+
+    def _features(self, text: str) -> Dict[int, int]:
+        # 只记录是否出现，避免长会话中重复的词让后验概率过于极端
+        return {bucket: 1 for bucket in hashed_ngrams(text, buckets=self.buckets)}
+
+    def partial_fit(self, text: str, label: str) -> None:
+        """用一条样本更新模型"""
+        if label not in LABELS:
+            raise ValueError(f"Unknown outcome label: {label}")
+        counts = self._feature_counts[label]
+        for bucket in self._features(text):
+            counts[bucket] = counts.get(bucket, 0) + 1
+            self._totals[label] += 1
+        self._docs[label] += 1
+
+    async def train_from_dao(self, batch_size: int = 1000) -> int:
+        """从游标处继续，用 DAO 中新的已标注会话增量训练，返回新增样本数"""
+        added = 0
+        while True:
+            sessions = await self.dao.list_labeled_sessions(since=self._cursor, limit=batch_size)
+            new = [s for s in sessions if s.session_id not in self._seen]
+            for session in new:
+                timestamp = session.timestamp.isoformat()
+                if timestamp != self._cursor:
+                    self._cursor = timestamp
+                    self._seen = set()
+                self._seen.add(session.session_id)
+                if outcome_source(session) in TRAINABLE_SOURCES:
+                    self.partial_fit(session_text(session.task, session.messages), session.outcome)
+                    added += 1
+            if len(sessions) < batch_size or not new:
+                break
+        self._trained_at = time.monotonic()
+        return added
+
+    def predict(self, text: str) -> Tuple[str, float]:
+        """返回 (标签, 置信度)"""
+        features = self._features(text)
+        total_docs = sum(self._docs.values())
+        log_probs = {}
+        for label in LABELS:
+            prior = (self._docs[label] + 1) / (total_docs + len(LABELS))
+            counts = self._feature_counts[label]
+            denominator = math.log(self._totals[label] + self.alpha * self.buckets)
+            log_prob = math.log(prior)
+            for bucket in features:
+                log_prob += math.log(counts.get(bucket, 0) + self.alpha) - denominator
+            log_probs[label] = log_prob
+
+        best = max(log_probs, key=log_probs.get)
+        norm = max(log_probs.values())
+        total = sum(math.exp(lp - norm) for lp in log_probs.values())
+        return best, 1.0 / total
+
+    async def classify(self, text: str, llm_fallback: Callable[[], Awaitable[str]]) -> str:
+        """
+        判定成功/失败：置信度足够时直接返回本地结果，否则调用 llm_fallback。
+
+        Args:
+            text: 会话文本（与训练时同样的格式，见 text_features.session_text）
+            llm_fallback: 返回 "success" 或 "failure" 的 LLM 判定
+        """
+        label, _ = await self.classify_with_source(text, llm_fallback)
+        return label
+
+    async def classify_with_source(
+        self,
+        text: str,
+        llm_fallback: Callable[[], Awaitable[str]]
+    ) -> Tuple[str, str]:
+        """同 classify，同时返回标签来源（"classifier" 或 "llm"），保存会话时写入 metadata"""
+        self.calls += 1
+        if self.dao is not None and time.monotonic() - self._trained_at >= self.refresh_seconds:
+            try:
+                await self.train_from_dao()
+            except Exception as e:
+                print(f"训练结果分类器失败: {e}")
+
+        if self.is_ready:
+            label, confidence = self.predict(text)
+            if confidence >= self.threshold:
+                if self.audit_rate and self._rng.random() < self.audit_rate:
+                    self.audits += 1
+                    self._compare(label, await llm_fallback())
+                else:
+                    self.avoided += 1
+                return label, "classifier"
+            self.fallbacks += 1
+            llm_label = await llm_fallback()
+            self._compare(label, llm_label)
+            return llm_label, "llm"
+
+        self.fallbacks += 1
+        return await llm_fallback(), "llm"
+
+    def _compare(self, label: str, llm_label: str) -> None:
+        if llm_label in LABELS:
+            self.compared += 1
+            self.agreed += int(label == llm_label)
+
+    def stats(self) -> Dict[str, float]:
+        """本地判定比例（节省的 LLM 调用）和与 LLM 的一致率"""
+        return {
+            "trained": sum(self._docs.values()),
+            "calls": self.calls,
+            "avoided": self.avoided,
+            "avoided_rate": round(self.avoided / self.calls, 4) if self.calls else 0.0,
+            "audits": self.audits,
+            "fallbacks": self.fallbacks,
+            "compared": self.compared,
+            "agreement_rate": round(self.agreed / self.compared, 4) if self.compared else None,
+        }
@@ -29,7 +29,8 @@ class SessionService:
     async def list_sessions(
         self, 
         outcome: Optional[str] = None,
-        limit: int = 100
+        limit: int = 100,
+        task_type: Optional[str] = None
     ) -> List[Session]:
         """列出会话"""
-        return await self.dao.list_sessions(outcome=outcome, limit=limit)
+        return await self.dao.list_sessions(outcome=outcome, limit=limit, task_type=task_type)
@@ -0,0 +1,135 @@
+"""滚动会话摘要 - 增量维护会话前缀的摘要，避免每次反馈都重发完整上下文"""
+import hashlib
+from collections import OrderedDict
+from typing import Optional, Tuple
+from langchain_core.messages import HumanMessage
+
+from ..models import Session
+from ..dao.memory_dao import MemoryDAO
+from ..llm import ModelRouter
+from .transcript_packer import TranscriptPacker, format_message, format_messages
+
+
+def prefix_hash(messages) -> str:
+    """计算消息前缀的内容哈希，用于校验已保存的摘要是否仍然有效"""
+    digest = hashlib.sha1()
+    for msg in messages:
+        digest.update(format_message(msg).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+
+class SessionSummarizer:
+    """
+    会话滚动摘要器。
+
+    摘要按 chunk_size 条消息为粒度推进：覆盖前 k 条消息的摘要由覆盖前
+    k - chunk_size 条的摘要加上新增的消息生成，每个会话的每个分块只调用
+    一次 LLM。摘要持久化在 DAO 中；构建好的上下文在进程内按
+    (session_id, index, 前缀哈希) 做有上限的 LRU 缓存，消息被修改后不会命中旧结果。
+
+    Args:
+        dao: 数据访问对象
+        llm: 模型路由器（摘要调用使用 node 分级和 validator 校验，必须是 ModelRouter）
+        recent_messages: 上下文中原样保留的最近消息数
+        chunk_size: 摘要推进的粒度（消息数）
+        packer: 格式化最近消息的打包器
+        cache_size: 上下文缓存的条目上限
+    """
+
+    def __init__(
+        self,
+        dao: MemoryDAO,
+        llm: ModelRouter,
+        recent_messages: int = 4,
+        chunk_size: int = 20,
+        packer: Optional[TranscriptPacker] = None,
+        cache_size: int = 256
+    ):
+        self.dao = dao
+        self.llm = llm
+        self.recent_messages = recent_messages
+        self.chunk_size = chunk_size
+        self.packer = packer or TranscriptPacker()
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple[str, int, str], str]" = OrderedDict()
+
+    def _summary_boundary(self, index: int) -> int:
+        """摘要覆盖的消息数：保证最近 recent_messages 条消息原样保留"""
+        upto = max(index - self.recent_messages, 0)
+        return (upto // self.chunk_size) * self.chunk_size
+
+    async def build_context(self, session: Session, index: int) -> str:
+        """
+        构建第 index 条消息之前的上下文：早前对话摘要 + 最近几条原始消息。
+
+        Args:
+            session: 会话
+            index: 目标消息索引（不包含在上下文中）
+        """
+        cache_key = (session.session_id, index, prefix_hash(session.messages[:index]))
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            self._cache.move_to_end(cache_key)
+            return cached
+
+        upto = self._summary_boundary(index)
+        recent = self.packer.pack(session.messages[upto:index])
+
+        if upto == 0:
+            context = recent
+        else:
+            summary = await self.summarize(session, upto)
+            context = f"[早前对话摘要]\n{summary}\n\n[最近对话]\n{recent}"
+
+        self._cache[cache_key] = context
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return context
+
+    async def summarize(self, session: Session, upto: int) -> str:
+        """获取覆盖前 upto 条消息的摘要，必要时从最近的已保存摘要增量推进"""
+        messages = session.messages
+        saved = await self.dao.get_session_summary(session.session_id, upto)
+
+        summary = ""
+        start = 0
+        if saved and saved["prefix_hash"] == prefix_hash(messages[:saved["upto_index"]]):
+            summary = saved["summary"]
+            start = saved["upto_index"]
+            if start == upto:
+                return summary
+
+        # 逐块推进，每块一次 LLM 调用，并持久化中间结果供后续反馈复用
+        while start < upto:
+            end = min(start + self.chunk_size, upto)
+            summary = await self._extend_summary(session.task, summary, messages[start:end])
+            await self.dao.save_session_summary(
+                session.session_id, end, prefix_hash(messages[:end]), summary
+            )
+            start = end
+
+        return summary
+
+    async def _extend_summary(self, task: str, summary: str, new_messages) -> str:
+        """用新增消息更新已有摘要"""
+        prompt = f"""
+请维护以下任务会话的滚动摘要。
+
+任务背景: {task}
+
+已有摘要:
+{summary or '（无）'}
+
+新增消息:
+{format_messages(new_messages)}
+
+请将新增消息中的关键信息（用户意图、已采取的步骤、出现的问题和结论）合并进已有摘要，
+输出更新后的完整摘要，控制在 300 字以内。只返回摘要，不要其他内容。
+"""
+        response = await self.llm.ainvoke(
+            [HumanMessage(content=prompt)],
+            node="summarize",
+            validator=lambda content: bool(content.strip())
+        )
+        return response.content.strip()
@@ -0,0 +1,103 @@
+"""任务类型索引 - 相似的任务描述直接复用已识别的任务类型"""
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from ..dao.memory_dao import MemoryDAO
+from .text_features import cosine_similarity, hashed_vector
+
+
+class TaskTypeIndex:
+    """
+    任务描述 -> 任务类型的最近邻索引。
+
+    每个已识别任务类型的会话保存其任务描述的哈希 n-gram 向量；新会话与最相似
+    的已知任务的余弦相似度达到 threshold 时直接复用其标签，否则返回 None，
+    由调用方交给 LLM 识别后再 add 进索引。通过 lookup 命中得到标签的任务
+    不会再被 add 进索引（它与已有条目足够相似，不带来新信息）。
+
+    Args:
+        dao: 预热数据来源（sessions 表中已标注的 task_type）
+        threshold: 复用标签所需的最低相似度
+        max_entries: 索引最多保存的条目数，超出时丢弃最早加入的
+        buckets: 向量维度
+    """
+
+    def __init__(
+        self,
+        dao: Optional[MemoryDAO] = None,
+        threshold: float = 0.85,
+        max_entries: int = 5000,
+        buckets: int = 4096
+    ):
+        self.dao = dao
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.buckets = buckets
+        # 任务描述 -> (向量, 任务类型)，按加入顺序排列
+        self._entries: "OrderedDict[str, Tuple[Dict[int, float], str]]" = OrderedDict()
+        # 最近通过 lookup 命中的任务描述 -> 任务类型，随后的 add 跳过这些任务
+        self._recent_hits: "OrderedDict[str, str]" = OrderedDict()
+        self._loaded = False
+
+        # 统计
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def load(self) -> None:
+        """从 DAO 加载已标注的会话（只加载一次）"""
+        if self._loaded or self.dao is None:
+            return
+        self._loaded = True
+        for example in reversed(await self.dao.list_task_type_examples(limit=self.max_entries)):
+            self.add(example["task"], example["task_type"])
+
+    def add(self, task: str, task_type: str) -> None:
+        """记录一个任务描述的任务类型（相同描述只保存一次，lookup 命中的任务不保存）"""
+        if not task or not task_type:
+            return
+        if self._recent_hits.pop(task, None) == task_type:
+            return
+        existing = self._entries.get(task)
+        if existing is not None:
+            if existing[1] != task_type:
+                self._entries[task] = (existing[0], task_type)
+            return
+        self._entries[task] = (hashed_vector(task, self.buckets), task_type)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def nearest(self, task: str) -> Optional[Tuple[str, float]]:
+        """最相似的已知任务的 (任务类型, 相似度)"""
+        if task in self._entries:
+            return self._entries[task][1], 1.0
+        vector = hashed_vector(task, self.buckets)
+        best: Optional[Tuple[str, float]] = None
+        for entry_vector, task_type in self._entries.values():
+            similarity = cosine_similarity(vector, entry_vector)
+            if best is None or similarity > best[1]:
+                best = (task_type, similarity)
+        return best
+
+    async def lookup(self, task: str) -> Optional[str]:
+        """相似度达到阈值时返回已知的任务类型，否则返回 None"""
+        await self.load()
+        self.lookups += 1
+        match = self.nearest(task)
+        if match and match[1] >= self.threshold:
+            self.hits += 1
+            self._recent_hits[task] = match[0]
+            while len(self._recent_hits) > self.max_entries:
+                self._recent_hits.popitem(last=False)
+            return match[0]
+        return None
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "entries": len(self._entries),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+        }
@@ -0,0 +1,57 @@
+"""文本特征 - 哈希 n-gram，不依赖分词器或向量模型"""
+import re
+import zlib
+from typing import Dict, Iterable
+
+from .transcript_packer import format_messages
+
+
+DEFAULT_BUCKETS = 1 << 18
+
+# 连续的 ASCII 字母/数字作为一个词，其余（中文等）按单字切分
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+|[^\sa-z0-9_]", re.IGNORECASE)
+
+
+def tokenize(text: str) -> list:
+    """切分为小写的英文单词和单个非 ASCII 字符（中文按字）"""
+    return [token.lower() for token in _TOKEN_PATTERN.findall(text)]
+
+
+def hashed_ngrams(text: str, n: Iterable[int] = (1, 2), buckets: int = DEFAULT_BUCKETS) -> Dict[int, int]:
+    """文本的哈希 n-gram 计数：桶编号 -> 出现次数
+
+    使用 crc32 而不是内置 hash()，保证不同进程得到相同的桶编号。
+    """
+    tokens = tokenize(text)
+    counts: Dict[int, int] = {}
+    for size in n:
+        for i in range(len(tokens) - size + 1):
+            gram = "\x1f".join(tokens[i:i + size])
+            bucket = zlib.crc32(gram.encode("utf-8")) % buckets
+            counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+
+def session_text(task: str, messages, max_chars: int = 8000) -> str:
+    """任务描述 + 会话消息，过长时保留首尾"""
+    text = f"{task}\n{format_messages(messages)}"
+    if len(text) > max_chars:
+        half = max_chars // 2
+        text = text[:half] + "\n" + text[-half:]
+    return text
+
+
+def hashed_vector(text: str, buckets: int = 4096) -> Dict[int, float]:
+    """L2 归一化的哈希 n-gram 稀疏向量"""
+    counts = hashed_ngrams(text, buckets=buckets)
+    norm = sum(value * value for value in counts.values()) ** 0.5
+    if not norm:
+        return {}
+    return {bucket: value / norm for bucket, value in counts.items()}
+
+
+def cosine_similarity(a: Dict[int, float], b: Dict[int, float]) -> float:
+    """两个已归一化稀疏向量的余弦相似度"""
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(bucket, 0.0) for bucket, value in a.items())
@@ -0,0 +1,138 @@
+"""会话记录打包器 - 在 token 预算内格式化会话消息"""
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Tuple
+
+from ..llm.tokens import estimate_tokens
+
+
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("TRANSCRIPT_TOKEN_BUDGET", "3000"))
+
+
+def format_message(msg) -> str:
+    """格式化单条消息"""
+    role = msg.role if hasattr(msg, 'role') else msg.get('role', 'unknown')
+    content = msg.content if hasattr(msg, 'content') else msg.get('content', '')
+    return f"{role}: {content}"
+
+
+def format_messages(messages) -> str:
+    """完整格式化消息列表（不做任何裁剪）"""
+    return "\n".join(format_message(msg) for msg in messages)
+
+
+def _truncate(line: str, max_tokens: int) -> str:
+    """将单条过长的消息截断为首尾两段"""
+    if estimate_tokens(line) <= max_tokens:
+        return line
+    # 按字符比例粗略截断，保留开头和结尾
+    ratio = max_tokens / max(estimate_tokens(line), 1)
+    keep = max(int(len(line) * ratio) // 2, 1)
+    return f"{line[:keep]} ...[内容过长已截断]... {line[-keep:]}"
+
+
+class TranscriptPacker:
+    """
+    在 token 预算内打包会话记录。
+
+    始终保留首条、末条以及指定的目标消息，其余消息从两端向中间填充，
+    超出预算的中间部分以省略标记代替。结果按会话和消息内容的哈希缓存，
+    同一会话的多次格式化（例如分析器的多个节点）只计算一次，消息被修改后
+    不会返回旧的结果。
+    """
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_TOKEN_BUDGET,
+        max_message_tokens: Optional[int] = None,
+        cache_size: int = 256
+    ):
+        self.token_budget = token_budget
+        self.max_message_tokens = max_message_tokens or max(token_budget // 4, 1)
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[Tuple, str]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def pack(
+        self,
+        messages,
+        keep: Iterable[int] = (),
+        session_id: Optional[str] = None
+    ) -> str:
+        """
+        打包消息列表。
+
+        Args:
+            messages: 消息列表
+            keep: 必须保留的消息索引（例如被反馈的目标轮次）
+            session_id: 会话ID，提供时启用缓存（键中包含消息内容的哈希）
+
+        Returns:
+            不超过 token 预算（必须保留的消息除外）的格式化文本
+        """
+        keep = tuple(sorted(set(keep)))
+        lines = [format_message(msg) for msg in messages]
+        cache_key = None
+        if session_id:
+            digest = hashlib.blake2b("\0".join(lines).encode(), digest_size=16).hexdigest()
+            cache_key = (session_id, digest, keep, self.token_budget)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                self._cache.move_to_end(cache_key)
+                self.cache_hits += 1
+                return cached
+            self.cache_misses += 1
+
+        packed = self._pack(lines, keep)
+
+        if cache_key:
+            self._cache[cache_key] = packed
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return packed
+
+    def _pack(self, lines: List[str], keep: Tuple[int, ...]) -> str:
+        if not lines:
+            return ""
+
+        costs = [estimate_tokens(line) for line in lines]
+        if sum(costs) + len(lines) <= self.token_budget:
+            return "\n".join(lines)
+
+        # 必须保留：首条、末条和目标消息（过长则截断）
+        n = len(lines)
+        required = {0, n - 1} | {i for i in keep if 0 <= i < n}
+        selected = {}
+        used = 0
+        for i in sorted(required):
+            line = _truncate(lines[i], self.max_message_tokens)
+            selected[i] = line
+            used += estimate_tokens(line) + 1
+
+        # 从两端向中间填充，优先最近的消息
+        head, tail = 1, n - 2
+        take_tail = True
+        while head <= tail:
+            i = tail if take_tail else head
+            if i not in selected:
+                if used + costs[i] + 1 > self.token_budget:
+                    break
+                selected[i] = lines[i]
+                used += costs[i] + 1
+            if take_tail:
+                tail -= 1
+            else:
+                head += 1
+            take_tail = not take_tail
+
+        # 按原始顺序输出，缺口处插入省略标记
+        output: List[str] = []
+        prev = -1
+        for i in sorted(selected):
+            if i - prev > 1:
+                output.append(f"...[省略 {i - prev - 1} 条消息]...")
+            output.append(selected[i])
+            prev = i
+        return "\n".join(output)
@@ -0,0 +1,258 @@
+"""跨会话微批处理 - 将多个独立的对话轮次打包进一次 LLM 调用"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional, Union
+from langchain_core.messages import HumanMessage
+
+from ..models import Skill, Rule
+from ..llm.tokens import estimate_tokens
+
+
+class _TurnRequest:
+    """一个等待批处理的轮次"""
+
+    def __init__(self, kind: str, task: str, dialog_turn: dict, feedback_comment: Optional[str]):
+        self.kind = kind
+        self.task = task
+        self.dialog_turn = dialog_turn
+        self.feedback_comment = feedback_comment
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class TurnBatcher:
+    """
+    学习器的微批处理模式。
+
+    并发到达的 _extract_skill_from_turn / _extract_rule_from_turn 请求（可以来自
+    不同会话）被收集起来，凑满 max_batch_size 或等待 max_wait_seconds 后打包成
+    一个提示词，要求模型返回 JSON 数组。数组中的每个元素单独校验，无效或缺失的
+    元素再走单轮路径单独重试，不影响同批次的其他结果。
+
+    Args:
+        learner_service: 所属的 LearnerService（用于 LLM 调用和单轮重试）
+        max_batch_size: 每个提示词最多包含的轮次数
+        max_wait_seconds: 第一个请求到达后最多等待多久就发出批次
+        rate_window_seconds: 统计每秒处理轮次数的滑动窗口（秒）
+    """
+
+    def __init__(
+        self,
+        learner_service,
+        max_batch_size: int = 8,
+        max_wait_seconds: float = 0.05,
+        rate_window_seconds: float = 60.0
+    ):
+        self.learner_service = learner_service
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.rate_window_seconds = rate_window_seconds
+        self._queue: List[_TurnRequest] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._inflight: set = set()
+
+        # 统计
+        self.turns = 0
+        self.batches = 0
+        self.retries = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._first_submit: Optional[float] = None
+        # 最近完成的批次：(完成时间, 轮次数)
+        self._completed: deque = deque()
+
+    @property
+    def pending_count(self) -> int:
+        """等待打包的轮次数"""
+        return len(self._queue)
+
+    async def submit(
+        self,
+        kind: str,
+        task: str,
+        dialog_turn: dict,
+        feedback_comment: Optional[str]
+    ) -> Optional[Union[Skill, Rule]]:
+        """提交一个轮次，kind 为 "skill" 或 "rule"，返回提炼结果"""
+        request = _TurnRequest(kind, task, dialog_turn, feedback_comment)
+        self._queue.append(request)
+        if self._first_submit is None:
+            self._first_submit = time.perf_counter()
+
+        if len(self._queue) >= self.max_batch_size:
+            self._dispatch()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait_seconds, self._dispatch)
+
+        return await request.future
+
+    def _dispatch(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        while self._queue:
+            batch = self._queue[:self.max_batch_size]
+            self._queue = self._queue[self.max_batch_size:]
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _run_batch(self, batch: List[_TurnRequest]) -> None:
+        self.batches += 1
+        self.turns += len(batch)
+        try:
+            items = await self._extract_batch(batch) if len(batch) > 1 else {}
+
+            # 有效结果先返回，不等待同批次其他轮次的重试
+            retry = []
+            for number, request in enumerate(batch, start=1):
+                if request.future.done():
+                    continue
+                result = self._validate(request, items.get(number))
+                if result is None:
+                    retry.append(request)
+                else:
+                    request.future.set_result(result)
+
+            # 无效或缺失的轮次并发地单独重试（单轮路径，不再进入批处理）；
+            # 只有一个轮次的批次直接走单轮路径，不计为重试
+            if len(batch) > 1:
+                self.retries += len(retry)
+            await asyncio.gather(*(self._retry(request) for request in retry))
+        finally:
+            # 批次被取消（例如服务关闭）时不让调用方一直等待
+            for request in batch:
+                if not request.future.done():
+                    request.future.cancel()
+            self._completed.append((time.perf_counter(), len(batch)))
+
+    async def _retry(self, request: _TurnRequest) -> None:
+        try:
+            if request.kind == "skill":
+                result = await self.learner_service._extract_skill_from_turn(
+                    request.task, request.dialog_turn, request.feedback_comment, use_batch=False
+                )
+            else:
+                result = await self.learner_service._extract_rule_from_turn(
+                    request.task, request.dialog_turn, request.feedback_comment, use_batch=False
+                )
+        except Exception as e:
+            if not request.future.done():
+                request.future.set_exception(e)
+            return
+        if not request.future.done():
+            request.future.set_result(result)
+
+    def _validate(self, request: _TurnRequest, item: Optional[Dict[str, Any]]) -> Optional[Union[Skill, Rule]]:
+        """校验数组中的单个元素，无效时返回 None"""
+        if not isinstance(item, dict) or item.get("type") != request.kind:
+            return None
+        try:
+            if request.kind == "skill":
+                return self.learner_service._skill_from_data(item)
+            return self.learner_service._rule_from_data(item)
+        except Exception as e:
+            print(f"批量结果校验失败: {e}")
+            return None
+
+    async def _extract_batch(self, batch: List[_TurnRequest]) -> Dict[int, Dict[str, Any]]:
+        """一次调用处理整个批次，返回 条目编号 -> 元素"""
+        sections = []
+        for number, request in enumerate(batch, start=1):
+            label = "好评，提炼技能" if request.kind == "skill" else "差评，提炼规则"
+            default_comment = "好评" if request.kind == "skill" else "差评"
+            turn = request.dialog_turn
+            sections.append(f"""### 条目 {number}（{label}）
+任务背景: {request.task}
+对话上下文:
+{turn['context']}
+用户: {turn['user_message']}
+AI: {turn['ai_response']}
+用户反馈: {request.feedback_comment or default_comment}""")
+        items_text = "\n\n".join(sections)
+
+        prompt = f"""
+以下是多个互相独立的对话条目，请批量提炼：
+好评的条目分析 AI 回复为什么获得好评，提炼一个可复用的技能；
+差评的条目分析 AI 回复为什么获得差评，提炼一个约束规则，避免未来犯同样的错误。
+
+{items_text}
+
+以 JSON 数组格式返回，每个条目对应一个元素：
+[
+    {{
+        "item": 1,
+        "type": "skill",
+        "name": "技能名称（简短）",
+        "description": "技能描述（1-2句话）",
+        "steps": ["步骤1", "步骤2", "步骤3"],
+        "sop": "详细的标准操作流程描述",
+        "confidence": 0.8
+    }},
+    {{
+        "item": 2,
+        "type": "rule",
+        "name": "规则名称（简短）",
+        "description": "规则描述（1-2句话）",
+        "constraint": "约束条件（应该避免什么行为）",
+        "reason": "原因说明",
+        "confidence": 0.8
+    }}
+]
+
+只返回 JSON，不要其他内容。
+"""
+
+        try:
+            response = await self.learner_service.llm.ainvoke(
+                [HumanMessage(content=prompt)], node="extract_turns_batch"
+            )
+            self._count_tokens(prompt, response)
+            data = self.learner_service._parse_json(response.content)
+            if isinstance(data, dict):
+                data = data.get("items", [])
+            return {
+                int(item["item"]): item
+                for item in data
+                if isinstance(item, dict) and "item" in item
+            }
+        except Exception as e:
+            print(f"批量提炼失败: {e}")
+            return {}
+
+    def _count_tokens(self, prompt: str, response) -> None:
+        usage = getattr(response, "usage_metadata", None)
+        if isinstance(usage, dict) and usage.get("input_tokens") is not None:
+            self.prompt_tokens += usage["input_tokens"]
+            self.completion_tokens += usage.get("output_tokens", 0)
+        else:
+            self.prompt_tokens += estimate_tokens(prompt)
+            self.completion_tokens += estimate_tokens(str(response.content))
+
+    async def drain(self) -> None:
+        """立即发出所有等待中的批次并等待完成"""
+        self._dispatch()
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def _turns_per_second(self) -> float:
+        """最近 rate_window_seconds 内完成的轮次数 / 窗口时长（运行不足一个窗口时按实际时长）"""
+        if self._first_submit is None:
+            return 0.0
+        now = time.perf_counter()
+        window_start = max(now - self.rate_window_seconds, self._first_submit)
+        while self._completed and self._completed[0][0] < window_start:
+            self._completed.popleft()
+        elapsed = now - window_start
+        return sum(n for _, n in self._completed) / elapsed if elapsed > 0 else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """批处理统计：最近窗口内每秒处理轮次数和每轮平均 token 数（不含单独重试的调用）"""
+        return {
+            "turns": self.turns,
+            "batches": self.batches,
+            "retries": self.retries,
+            "avg_batch_size": round(self.turns / self.batches, 2) if self.batches else 0.0,
+            "turns_per_second": round(self._turns_per_second(), 2),
+            "tokens_per_turn": round((self.prompt_tokens + self.completion_tokens) / self.turns, 1) if self.turns else 0.0,
+        }
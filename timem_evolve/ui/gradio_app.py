@@ -2,6 +2,7 @@
 import gradio as gr
 import requests
 import os
+import time
 from typing import List, Dict, Any, Optional
 
 # 假设 FastAPI 服务运行在 8000 端口
@@ -298,22 +299,29 @@ def create_gradio_app():
                         placeholder="输入要运行的任务ID"
                     )
                     run_task_btn = gr.Button("▶️ 运行任务")
+                    cancel_job_btn = gr.Button("⏹️ 取消运行")
                 
+                run_job_id = gr.State(None)
                 run_task_output = gr.Markdown(label="运行结果")
                 
-                def run_task_action(task_id: str):
-                    if not task_id:
-                        return "请输入任务ID"
-                    try:
-                        response = requests.post(f"{API_BASE_URL}/coach/run_task/{task_id}")
-                        response.raise_for_status()
-                        task = response.json()
-                        
-                        feedback = task.get('coach_feedback', '无反馈')
-                        
-                        return f"""
+                def format_job(job: Dict[str, Any]) -> str:
+                    node_names = {"execute_task": "执行任务", "evaluate_result": "评估结果", "learn_from_session": "学习"}
+                    node_icons = {"pending": "⏳", "running": "🔄", "done": "✅", "failed": "❌"}
+                    progress = " → ".join(
+                        f"{node_icons.get(state, '')} {node_names.get(node, node)}"
+                        for node, state in job.get('nodes', {}).items()
+                    )
+                    text = f"""
+**作业ID**: {job['job_id']}
+**作业状态**: {job['status']}
+**节点进度**: {progress}
+"""
+                    if job.get('error'):
+                        text += f"\n**错误**: {job['error']}\n"
+                    task = job.get('task')
+                    if job['status'] == "completed" and task:
+                        text += f"""
 **任务ID**: {task['task_id']}
-**状态**: {task['status']}
 **结果**: {task['outcome']}
 **学习结果**: 
 - 技能ID: {task.get('learned_skill_id', 'N/A')}
@@ -321,16 +329,50 @@ def create_gradio_app():
 
 ---
 **Coach 反馈**:
-{feedback}
+{task.get('coach_feedback', '无反馈')}
 """
+                    return text
+                
+                def run_task_action(task_id: str):
+                    """提交后台作业并轮询进度，界面在运行期间保持响应"""
+                    if not task_id:
+                        yield "请输入任务ID", None
+                        return
+                    try:
+                        response = requests.post(f"{API_BASE_URL}/coach/run_task/{task_id}")
+                        response.raise_for_status()
+                        job = response.json()
+                        yield format_job(job), job['job_id']
+                        
+                        while job['status'] not in ("completed", "failed", "cancelled"):
+                            time.sleep(1)
+                            response = requests.get(f"{API_BASE_URL}/coach/jobs/{job['job_id']}")
+                            response.raise_for_status()
+                            job = response.json()
+                            yield format_job(job), job['job_id']
                     except requests.exceptions.HTTPError as e:
-                        return f"运行任务失败: {e.response.json().get('detail', str(e))}"
+                        yield f"运行任务失败: {e.response.json().get('detail', str(e))}", None
+                    except requests.exceptions.RequestException as e:
+                        yield f"运行任务失败: {e}", None
+                
+                def cancel_job_action(job_id: Optional[str]):
+                    if not job_id:
+                        return "没有正在运行的作业"
+                    try:
+                        response = requests.post(f"{API_BASE_URL}/coach/jobs/{job_id}/cancel")
+                        response.raise_for_status()
+                        return format_job(response.json())
                     except requests.exceptions.RequestException as e:
-                        return f"运行任务失败: {e}"
+                        return f"取消作业失败: {e}"
                 
                 run_task_btn.click(
                     fn=run_task_action,
                     inputs=run_task_id_input,
+                    outputs=[run_task_output, run_job_id]
+                )
+                cancel_job_btn.click(
+                    fn=cancel_job_action,
+                    inputs=run_job_id,
                     outputs=run_task_output
                 )
             